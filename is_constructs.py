@@ -1,33 +1,173 @@
 from sklearn.feature_extraction import stop_words
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer
 from sklearn.preprocessing import Normalizer
 from sklearn.decomposition import TruncatedSVD
+from sklearn.cluster import KMeans
 from sklearn.metrics import roc_curve
 from sklearn.metrics import roc_auc_score
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial.distance import squareform
 
 from stemming.porter2 import stem as stem_porter2
 from stemming.paicehusk import stem as stem_paicehusk
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 import editdistance
 import glove
 import csv
 import os.path
+import shutil
+import json
+import hashlib
+import numbers
+import sqlite3
+import time
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import OrderedDict
 import gc  # Garbage collector.
 import warnings
+import multiprocessing
 import matplotlib.pyplot as plt
 
 
 def info(var):
     """Gives basic information on the passed object. Only used for prototyping and testing."""
-    if isinstance(var, np.ndarray):
+    if isinstance(var, np.ndarray) or sp.issparse(var):
         print("Type:", type(var), "\nShape:", np.shape(var))
     else:
         print("Type:", type(var), "\nLength:", len(var))
 
 
+def unique_index(values, axis=None):
+    """Collapses identical values (e.g. parsed documents, construct names or rows of a matrix with axis=0) to the
+    unique values in the order of their first occurrence. Returns the unique values and the index of every value in
+    them, so that values == unique[index]. Computations on the unique values are mapped back with the index."""
+    values = np.asarray(values)
+    _, first, inverse = np.unique(values, axis=axis, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return values[first[order]], rank[np.ravel(inverse)]
+
+
+def deduplication_report(name, n, n_unique, seconds, pairwise=True):
+    """Prints the deduplication ratio of n values with n_unique unique values and the time saved by computing on the
+    unique values, estimated from the seconds it took on them and the work of all values (all pairs if pairwise)."""
+    work = (n / max(n_unique, 1)) ** (2 if pairwise else 1)
+    print("Deduplication", name + ":", n_unique, "unique of", n, "-", round((1 - n_unique / max(n, 1)) * 100, 2),
+          "% duplicates, about", round(seconds * (work - 1), 2), "s saved.")
+
+
+def test_ui():
+    values = np.asarray(['technolog use', 'eas use', 'technolog use', 'trust', 'eas use'])
+    result_1, result_2 = unique_index(values)
+    print(result_1, "\n", result_2, "\n", np.all(result_1[result_2] == values), "\n")
+    matrix = np.asarray([[0, 1], [1, 0], [0, 1]])
+    print(unique_index(matrix, axis=0), "\n")
+    deduplication_report('test', len(values), len(result_1), 1.0)
+    info(result_1)
+    info(result_2)
+
+
+class CondensedSimilarity(object):
+    """Symmetric similarity matrix stored as labeled condensed pair vector: the upper triangular without diagonal
+    in row-major order, like scipy.spatial.distance.pdist. Pair (i, j) with i < j of n ids is stored at
+    n * i - i * (i + 1) / 2 + j - i - 1. Together with a smaller dtype (float32, float16) this needs a fraction of
+    the memory of the full float64 matrix, and the flat values can be passed to evaluate(...) directly."""
+
+    def __init__(self, ids, values, dtype=np.float32):
+        self.ids = np.asarray(ids)
+        self.values = np.asarray(values, dtype=dtype)
+        assert len(self.values) == len(self.ids) * (len(self.ids) - 1) // 2, \
+            "n values must be n ids * (n ids - 1) / 2."
+
+    @classmethod
+    def from_square(cls, matrix, ids=None, dtype=np.float32):
+        """Creates the condensed vector from the upper triangular of a square matrix (DataFrame or array)."""
+        if ids is None:
+            ids = matrix.index.values if isinstance(matrix, pd.DataFrame) else np.arange(len(matrix))
+        matrix = np.asarray(matrix)
+        values = np.empty(len(matrix) * (len(matrix) - 1) // 2, dtype=dtype)
+        k = 0
+        for i in range(len(matrix) - 1):
+            values[k:k + len(matrix) - i - 1] = matrix[i, i + 1:]
+            k += len(matrix) - i - 1
+        return cls(ids, values, dtype=dtype)
+
+    @classmethod
+    def from_vectors(cls, vectors, ids=None, dtype=np.float32, clip=False, block_size=1024):
+        """Creates the condensed cosine (dot product) similarity of the passed (normalized) vectors in blocks of rows,
+        without creating the full similarity matrix. Negative similarities are set to 0 if clip=True."""
+        if ids is None:
+            ids = vectors.index.values if isinstance(vectors, pd.DataFrame) else np.arange(len(vectors))
+        vectors = np.asarray(vectors)
+        n = len(vectors)
+        values = np.empty(n * (n - 1) // 2, dtype=dtype)
+        k = 0
+        for start in range(0, n, block_size):
+            # Similarity of the row block to all rows from the block on.
+            block = vectors[start:start + block_size].dot(vectors[start:].T)
+            if clip:
+                block = block.clip(min=0)
+            for r in range(len(block)):
+                values[k:k + n - start - r - 1] = block[r, r + 1:]
+                k += n - start - r - 1
+        return cls(ids, values, dtype=dtype)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def pair_index(self, rows, cols):
+        """Returns the condensed indices of the passed pairs of row positions, which must not lie on the diagonal."""
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        i = np.minimum(rows, cols)
+        j = np.maximum(rows, cols)
+        return len(self.ids) * i - i * (i + 1) // 2 + j - i - 1
+
+    def subset(self, ids):
+        """Returns the condensed similarity between the passed ids, in the passed order."""
+        positions = pd.Index(self.ids).get_indexer(ids)
+        assert np.all(positions >= 0), "ids not contained in condensed similarity."
+        values = np.empty(len(ids) * (len(ids) - 1) // 2, dtype=self.values.dtype)
+        k = 0
+        for r in range(len(ids) - 1):
+            values[k:k + len(ids) - r - 1] = self.values[self.pair_index(positions[r], positions[r + 1:])]
+            k += len(ids) - r - 1
+        return CondensedSimilarity(ids, values, dtype=self.values.dtype)
+
+    def to_square(self, diagonal=1.0):
+        """Returns the full symmetric similarity matrix DataFrame."""
+        matrix = squareform(self.values.astype(np.promote_types(self.values.dtype, np.float32)), checks=False)
+        np.fill_diagonal(matrix, diagonal)
+        return pd.DataFrame(matrix, index=self.ids, columns=self.ids)
+
+    def __repr__(self):
+        return "CondensedSimilarity(" + str(len(self.ids)) + " ids, " + str(len(self.values)) + " pairs, " + \
+               str(self.values.dtype) + ")"
+
+
+def test_cs():
+    similarity = pd.DataFrame([[1.0, 0.8, -0.2, 0.1],
+                               [0.8, 1.0, 0.3, 0.0],
+                               [-0.2, 0.3, 1.0, 0.6],
+                               [0.1, 0.0, 0.6, 1.0]], index=[1, 2, 4, 9], columns=[1, 2, 4, 9])
+    result = CondensedSimilarity.from_square(similarity, dtype=np.float16)
+    print(result, "\n", result.values, "\n", result.subset([9, 2, 1]).values, "\n", result.to_square(), "\n")
+    vectors = pd.DataFrame(Normalizer(norm='l2').fit_transform([[1, 0], [1, 1], [0, 1], [-1, 0]]), index=[1, 2, 4, 9])
+    result = CondensedSimilarity.from_vectors(vectors, clip=True, block_size=3)
+    print(result, "\n", result.values, "\n")
+    info(result)
+
+
 def recreate_construct_identity_gold(gold_standard, pool_ids, full_var_ids=None):
     """Translates the gold standard by Larsen and Bong 2016 into a binary construct identity matrix with ID labeling.
     Pass full_var_ids if not prototyping, since not all variable ids are present in pools."""
@@ -69,13 +209,927 @@ def test_rcig():
     info(result)
 
 
-def load_data(prototype=False, max_editdistance=1, verbose=False):
+def file_fingerprint(file_name, chunk_size=1024 * 1024):
+    """Returns the SHA-1 hash, the modification time and the size of the passed file."""
+    sha1 = hashlib.sha1()
+    with open(file_name, 'rb') as file:
+        for block in iter(lambda: file.read(chunk_size), b''):
+            sha1.update(block)
+    stat = os.stat(file_name)
+    return {'sha1': sha1.hexdigest(), 'mtime': stat.st_mtime, 'size': stat.st_size}
+
+
+def read_excel_cached(file_name, sheet_names=None, cache_dir='table_cache', verbose=False):
+    """Reads sheets of an Excel file through a columnar on-disk cache. On first load, all sheets of the workbook are
+    read in a single pass and every sheet is written to an Arrow (Feather) file, which is memory-mapped when loading.
+    Falls back to pickle files if pyarrow is not installed or a sheet can not be converted to Arrow.
+    The cache is invalid if the modification time or size of the source file changed and its SHA-1 hash differs.
+    Cache files are keyed by a hash of the absolute path of the source file (and of the sheet name), so that
+    workbooks with the same name in different directories do not share a cache.
+    Returns a dict {sheet name: DataFrame} if a list of sheet_names is passed, else the first sheet as DataFrame."""
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_name = os.path.join(cache_dir, os.path.basename(file_name) + '.' +
+                              hashlib.sha1(os.path.abspath(file_name).encode()).hexdigest()[:16])
+    try:
+        with open(cache_name + '.json') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        manifest = None
+    # Check whether the cache is still valid. Hashing is only necessary if modification time or size changed.
+    stat = os.stat(file_name)
+    if manifest is not None and (manifest['mtime'] != stat.st_mtime or manifest['size'] != stat.st_size):
+        fingerprint = file_fingerprint(file_name)
+        if fingerprint['sha1'] == manifest['sha1']:
+            manifest.update(fingerprint)
+            with open(cache_name + '.json', 'w') as file:
+                json.dump(manifest, file)
+        else:
+            manifest = None
+    if manifest is None:
+        if verbose:
+            print("No valid table cache found for", file_name, "- reading all sheets and creating cache...")
+        sheets = pd.read_excel(file_name, sheet_name=None)  # Reads all sheets in one pass.
+        manifest = file_fingerprint(file_name)
+        manifest['sheets'] = {}
+        for sheet_name, table in sheets.items():
+            sheet_file = cache_name + '.' + hashlib.sha1(str(sheet_name).encode()).hexdigest()[:16]
+            try:
+                table.reset_index(drop=True).to_feather(sheet_file + '.feather')
+                manifest['sheets'][sheet_name] = sheet_file + '.feather'
+            except (ImportError, ValueError, TypeError):
+                # pyarrow not available or column types not supported by Arrow.
+                table.to_pickle(sheet_file + '.df')
+                manifest['sheets'][sheet_name] = sheet_file + '.df'
+        with open(cache_name + '.json', 'w') as file:
+            json.dump(manifest, file)
+
+    def read_sheet(sheet_file):
+        if sheet_file.endswith('.feather'):
+            from pyarrow import feather  # Only needed if the cache has been written with pyarrow.
+            return feather.read_table(sheet_file, memory_map=True).to_pandas()
+        return pd.read_pickle(sheet_file)
+
+    if sheet_names is None:
+        return read_sheet(next(iter(manifest['sheets'].values())))
+    return {sheet_name: read_sheet(manifest['sheets'][sheet_name]) for sheet_name in sheet_names}
+
+
+def test_rec():
+    data_1 = pd.DataFrame([[1, 'Perceived usefulness'], [2, 'Ease of use']], columns=['VariableId', 'VariableName'])
+    data_2 = pd.DataFrame([[1, 1], [1, 2]], columns=['Poolid', 'VariableID'])
+    with pd.ExcelWriter('test.xlsx') as writer:
+        data_1.to_excel(writer, sheet_name='Items', index=False)
+        data_2.to_excel(writer, sheet_name='GoldStandard', index=False)
+    sheet_names = ['GoldStandard', 'Items']
+    verbose = True
+    result_1 = read_excel_cached('test.xlsx', sheet_names=sheet_names, cache_dir='test_cache', verbose=verbose)
+    result_2 = read_excel_cached('test.xlsx', sheet_names=None, cache_dir='test_cache', verbose=verbose)  # Cached.
+    print(result_1, "\n", result_2, "\n")
+    # A workbook with the same name in another directory gets its own cache.
+    os.makedirs('test_dir', exist_ok=True)
+    data_1.iloc[:1].to_excel(os.path.join('test_dir', 'test.xlsx'), sheet_name='Items', index=False)
+    print(len(read_excel_cached(os.path.join('test_dir', 'test.xlsx'), cache_dir='test_cache', verbose=verbose)),
+          "\n")  # 1 row.
+    info(result_1)
+    info(result_2)
+
+
+class ResultStore(object):
+    """Transactional store of experiment results in a SQLite file, e.g. for grid searches. Every result is recorded
+    immediately under a canonical hash of the experiment name, the full configuration and the version of the input
+    data, so that completed configurations can be skipped on restart. Several processes can write to the same file:
+    every operation opens its own connection and waits for the lock of concurrent writers (WAL journal)."""
+
+    def __init__(self, file_name='results.sqlite', timeout=60):
+        self.file_name = file_name
+        self.timeout = timeout
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, experiment TEXT, "
+                               "data_version TEXT, config TEXT, result TEXT, finished REAL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.file_name, timeout=self.timeout)
+
+    @staticmethod
+    def _dumps(obj):
+        # Canonical JSON: sorted keys and numpy scalars as Python types.
+        return json.dumps(obj, sort_keys=True, default=lambda value: value.item())
+
+    def key(self, experiment, config, data_version):
+        """Returns the canonical hash of experiment, configuration dictionary and data version."""
+        return hashlib.sha1(self._dumps([experiment, config, data_version]).encode()).hexdigest()
+
+    def completed(self, experiment, config, data_version):
+        """Returns True if a result for the configuration and data version is recorded."""
+        with self._connect() as connection:
+            row = connection.execute("SELECT 1 FROM results WHERE key = ?",
+                                     (self.key(experiment, config, data_version),)).fetchone()
+        return row is not None
+
+    def record(self, experiment, config, data_version, result):
+        """Records the result dictionary of a finished configuration in its own transaction. The first recorded
+        result is kept if concurrent workers finish the same configuration."""
+        with self._connect() as connection:
+            connection.execute("INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                               (self.key(experiment, config, data_version), experiment, data_version,
+                                self._dumps(config), self._dumps(result), time.time()))
+
+    def results(self, experiment, data_version=None):
+        """Returns the recorded configurations and results of an experiment as DataFrame with one column per
+        configuration and result entry, in order of recording."""
+        query = "SELECT config, result FROM results WHERE experiment = ?"
+        parameters = (experiment,)
+        if data_version is not None:
+            query += " AND data_version = ?"
+            parameters += (data_version,)
+        with self._connect() as connection:
+            rows = connection.execute(query + " ORDER BY finished", parameters).fetchall()
+        return pd.DataFrame([dict(json.loads(config), **json.loads(result)) for config, result in rows])
+
+
+def test_rs():
+    if os.path.exists('test_results.sqlite'):
+        os.remove('test_results.sqlite')
+    store = ResultStore('test_results.sqlite')
+    data_version = 'v1'
+    config_1 = {'alpha': 0.5, 'x_max': 10, 'weighting': np.bool_(True)}
+    config_2 = {'x_max': 10, 'alpha': 0.5, 'weighting': True}  # Same configuration in other order.
+    store.record('glove', config_1, data_version, {'roc_auc': np.float64(0.8), 'training_loss': 0.1})
+    store.record('glove', config_2, data_version, {'roc_auc': 0.9, 'training_loss': 0.2})  # Ignored.
+    print(store.completed('glove', config_2, data_version), store.completed('glove', config_2, 'v2'),
+          store.completed('glove', {'alpha': 0.6, 'x_max': 10, 'weighting': True}, data_version), "\n")
+    result = store.results('glove')
+    print(result, "\n")
+    info(result)
+
+
+class WorkQueue(object):
+    """Queue of configuration tickets in a directory on a shared file system (e.g. NFS), for grid searches on several
+    nodes without a scheduler service. Tickets are JSON files in the subdirectories pending, running, done and failed
+    and are moved with os.rename, which is atomic within one file system. A worker claims a ticket by renaming it from
+    pending to running under its worker ID, of concurrent workers only one rename succeeds. The worker touches its
+    running ticket as heartbeat, tickets without heartbeat for lease_timeout seconds are moved back to pending by
+    reclaim(). lease_timeout must exceed the clock skew between the nodes and the file server.
+    Ticket files are named experiment.key.json (experiment.key.worker_id.json while running), so that coordinators
+    of several experiments can share the queue. The coordinator submits tickets and records the results from done in
+    a ResultStore with collect(...); the SQLite file of the ResultStore should not be on the shared file system."""
+
+    states = ['pending', 'running', 'done', 'failed']
+
+    def __init__(self, directory, lease_timeout=300):
+        self.directory = directory
+        self.lease_timeout = lease_timeout
+        self.random_states = {}  # {(worker_id, pid): np.random.RandomState}, forked workers must not share one.
+        for state in self.states + ['tmp']:
+            os.makedirs(os.path.join(directory, state), exist_ok=True)
+
+    def _path(self, state, name=''):
+        return os.path.join(self.directory, state, name)
+
+    def _write(self, path, ticket):
+        # Write to a unique temporary file first, so that a ticket appears atomically with its full content.
+        tmp_path = self._path('tmp', uuid.uuid4().hex)
+        with open(tmp_path, 'w') as file:
+            json.dump(ticket, file, default=lambda value: value.item())
+        os.rename(tmp_path, path)
+
+    @staticmethod
+    def _read(path):
+        with open(path) as file:
+            return json.load(file)
+
+    def _names(self, state, experiment=None):
+        # Ticket file names in a state, of one or all experiments.
+        return [name for name in os.listdir(self._path(state)) if name.endswith('.json') and
+                (experiment is None or name.split('.')[0] == experiment)]
+
+    def submit(self, experiment, configs, data_version):
+        """Submits a ticket for every configuration dictionary that is not pending, running or done yet, keyed like
+        ResultStore.key(...). Failed tickets are submitted again. Returns the number of submitted tickets."""
+        assert '.' not in experiment, "experiment name must not contain '.'."
+        queued = {name.split('.')[1] for state in ['pending', 'running', 'done'] for name in
+                  self._names(state, experiment)}
+        n_submitted = 0
+        for config in configs:
+            key = hashlib.sha1(ResultStore._dumps([experiment, config, data_version]).encode()).hexdigest()
+            if key in queued:
+                continue
+            try:
+                os.remove(self._path('failed', experiment + '.' + key + '.json'))
+            except OSError:
+                pass  # Not failed before.
+            self._write(self._path('pending', experiment + '.' + key + '.json'),
+                        {'key': key, 'experiment': experiment, 'config': config, 'data_version': data_version,
+                         'submitted': time.time()})
+            queued.add(key)
+            n_submitted += 1
+        return n_submitted
+
+    def claim(self, worker_id):
+        """Claims a pending ticket for the worker. Returns the ticket and the path of the running ticket file, which
+        is passed to heartbeat(...) and complete(...), or None if no ticket is pending."""
+        assert '.' not in worker_id, "worker ID must not contain '.'."
+        names = self._names('pending')
+        if (worker_id, os.getpid()) not in self.random_states:
+            seed = int(hashlib.sha1((worker_id + '.' + str(os.getpid())).encode()).hexdigest()[:8], 16)
+            self.random_states[(worker_id, os.getpid())] = np.random.RandomState(seed)
+        random_state = self.random_states[(worker_id, os.getpid())]
+        for ix in random_state.permutation(len(names)):  # Random order, so that concurrent workers rarely collide.
+            ticket_name = names[ix][:-len('.json')]
+            path = self._path('running', ticket_name + '.' + worker_id + '.json')
+            try:
+                os.rename(self._path('pending', names[ix]), path)
+            except OSError:
+                continue  # Claimed by another worker.
+            if os.path.exists(self._path('done', names[ix])):
+                # Finished by a worker that was reclaimed as dead, but came back.
+                os.remove(path)
+                continue
+            os.utime(path, None)
+            return self._read(path), path
+        return None
+
+    def heartbeat(self, path):
+        """Marks the running ticket as alive. Returns False if the ticket has been reclaimed."""
+        try:
+            os.utime(path, None)
+            return True
+        except OSError:
+            return False
+
+    def complete(self, ticket, path, result, failed=False):
+        """Writes the result dictionary of a claimed ticket to done (or failed) and removes the running ticket."""
+        ticket = dict(ticket, result=result, worker=os.path.basename(path).split('.')[2], finished=time.time())
+        self._write(self._path('failed' if failed else 'done', ticket['experiment'] + '.' + ticket['key'] + '.json'),
+                    ticket)
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Reclaimed in the meantime, the result is kept anyway.
+
+    def reclaim(self):
+        """Moves running tickets without heartbeat for lease_timeout seconds back to pending. Returns their number."""
+        n_reclaimed = 0
+        for name in self._names('running'):
+            path = self._path('running', name)
+            try:
+                if time.time() - os.path.getmtime(path) > self.lease_timeout:
+                    os.rename(path, self._path('pending', '.'.join(name.split('.')[:2]) + '.json'))
+                    n_reclaimed += 1
+            except OSError:
+                continue  # Completed or reclaimed concurrently.
+        return n_reclaimed
+
+    def cancel(self, experiment=None):
+        """Removes the pending tickets of the experiment (or all), e.g. for early stopping. Returns their number."""
+        n_cancelled = 0
+        for name in self._names('pending', experiment):
+            try:
+                os.remove(self._path('pending', name))
+                n_cancelled += 1
+            except OSError:
+                continue
+        return n_cancelled
+
+    def collect(self, result_store, experiment=None):
+        """Records the results of done tickets of the experiment (or all) in the result store and removes the
+        tickets. A result can also be a list of [configuration, result] pairs, e.g. of all post-processing variants
+        of one trained model, every pair is recorded. Returns the list of collected tickets with their results."""
+        tickets = []
+        for name in self._names('done', experiment):
+            path = self._path('done', name)
+            ticket = self._read(path)
+            if isinstance(ticket['result'], list):
+                for config, result in ticket['result']:
+                    result_store.record(ticket['experiment'], config, ticket['data_version'], result)
+            else:
+                result_store.record(ticket['experiment'], ticket['config'], ticket['data_version'], ticket['result'])
+            os.remove(path)
+            tickets.append(ticket)
+        return tickets
+
+    def failures(self, experiment=None):
+        """Returns the failed tickets of the experiment (or all), with the error as result."""
+        tickets = []
+        for name in self._names('failed', experiment):
+            try:
+                tickets.append(self._read(self._path('failed', name)))
+            except (OSError, ValueError):
+                continue  # Resubmitted concurrently.
+        return tickets
+
+    def status(self, experiment=None):
+        """Returns the number of tickets of the experiment (or all) per state."""
+        return {state: len(self._names(state, experiment)) for state in self.states}
+
+    def drain(self, result_store, experiment=None, poll_interval=5, stop=None, verbose=False):
+        """Coordinates the experiment (or all) until no ticket is pending or running: collects results, reclaims
+        tickets of dead workers and cancels the pending tickets once stop(result) returns True for a collected
+        result. Failed tickets are printed once and left in failed. Returns the status."""
+        reported = set()
+        while True:
+            for ticket in self.failures(experiment):
+                if ticket['key'] not in reported:
+                    print("Work queue: ticket", ticket['experiment'], ticket['config'], "failed on worker",
+                          ticket['worker'], "-", ticket['result']['error'])
+                    reported.add(ticket['key'])
+            tickets = self.collect(result_store, experiment)
+            if stop is not None and any(stop(ticket['result']) for ticket in tickets):
+                n_cancelled = self.cancel(experiment)
+                if verbose:
+                    print("Stop criterion met, cancelled", n_cancelled, "pending tickets.")
+            n_reclaimed = self.reclaim()
+            status = self.status(experiment)
+            if verbose:
+                print("Work queue:", status, "-", n_reclaimed, "tickets reclaimed.", end='\r')
+            if status['pending'] == 0 and status['running'] == 0 and status['done'] == 0:
+                return status
+            time.sleep(poll_interval)
+
+
+def run_worker(work_queue, handlers, data_versions=None, worker_id=None, heartbeat_interval=30, poll_interval=5,
+               max_idle=None, verbose=False):
+    """Runs a worker on the WorkQueue: claims tickets, runs handlers[experiment](config) while a heartbeat thread
+    touches the ticket, and completes the ticket with the returned result dictionary. Tickets whose data version
+    differs from data_versions[experiment] or whose handler raises fail with the error as result. The worker stops
+    when no ticket is pending or running anymore, or if max_idle is passed, after max_idle seconds without a
+    claimable ticket (e.g. for workers started before the coordinator submits).
+    Returns the number of processed tickets."""
+    if worker_id is None:
+        worker_id = socket.gethostname().replace('.', '-') + '-' + str(os.getpid())
+    n_processed = 0
+    idle_since = time.time()
+    while True:
+        claimed = work_queue.claim(worker_id)
+        if claimed is None:
+            status = work_queue.status()
+            if max_idle is None and status['pending'] == 0 and status['running'] == 0 or \
+                    max_idle is not None and time.time() - idle_since > max_idle:
+                return n_processed
+            time.sleep(poll_interval)
+            continue
+        ticket, path = claimed
+        stopped = threading.Event()
+
+        def beat():
+            while not stopped.wait(heartbeat_interval) and work_queue.heartbeat(path):
+                pass
+
+        heartbeat_thread = threading.Thread(target=beat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            if data_versions is not None:
+                assert ticket['data_version'] == data_versions.get(ticket['experiment']), \
+                    "data version of the ticket differs from the data of the worker."
+            if verbose:
+                print("Worker", worker_id, "running", ticket['experiment'], ticket['config'])
+            result = handlers[ticket['experiment']](ticket['config'])
+            failed = False
+        except Exception as error:
+            result = {'error': repr(error)}
+            failed = True
+        stopped.set()
+        heartbeat_thread.join()
+        work_queue.complete(ticket, path, result, failed=failed)
+        n_processed += 1
+        idle_since = time.time()
+
+
+def _test_wq_handler(config):
+    time.sleep(0.2)
+    if 'variants' in config:
+        # One trial evaluates several variants.
+        return [[{'x': config['x'], 'power': power}, {'result': config['x'] ** power}] for power in config['variants']]
+    return {'square': config['x'] ** 2}
+
+
+def test_wq():
+    if os.path.exists('test_queue'):
+        shutil.rmtree('test_queue')
+    if os.path.exists('test_results.sqlite'):
+        os.remove('test_results.sqlite')
+    store = ResultStore('test_results.sqlite')
+    work_queue = WorkQueue('test_queue', lease_timeout=2)
+    print(work_queue.submit('square', [{'x': x} for x in range(12)], 'v1'),
+          work_queue.submit('square', [{'x': x} for x in range(14)], 'v1'), "\n")  # 12, then 2 new tickets.
+    # A worker that dies after claiming a ticket, its ticket is reclaimed after lease_timeout.
+    ticket, path = work_queue.claim('dead-worker')
+    os.utime(path, (time.time() - 10, time.time() - 10))
+    # Local worker processes stand in for the nodes.
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=run_worker, args=(work_queue, {'square': _test_wq_handler}),
+                               kwargs={'data_versions': {'square': 'v1'}, 'worker_id': 'node' + str(i),
+                                       'heartbeat_interval': 0.5, 'poll_interval': 0.2})
+               for i in range(3)]
+    for worker in workers:
+        worker.start()
+    print(work_queue.drain(store, poll_interval=0.2), "\n")
+    for worker in workers:
+        worker.join()
+    result = store.results('square').sort_values('x')
+    print(result, "\n")  # Squares of 0 to 13, including the reclaimed ticket.
+    work_queue.submit('power', [{'x': x, 'variants': [1, 2, 3]} for x in range(2)], 'v1')
+    run_worker(work_queue, {'power': _test_wq_handler}, poll_interval=0.2)
+    work_queue.drain(store, 'power')
+    print(store.results('power'), "\n")
+    # A ticket without handler fails, it is reported by drain(...) and submitted again.
+    work_queue.submit('cube', [{'x': 2}], 'v1')
+    run_worker(work_queue, {}, poll_interval=0.2)
+    work_queue.drain(store, 'cube')
+    print(len(work_queue.failures('cube')), work_queue.submit('cube', [{'x': 2}], 'v1'),
+          len(work_queue.failures('cube')), "\n")  # 1, 1, 0.
+    info(result)
+
+
+class StageGraph(object):
+    """Pipeline declared as graph of stages. A stage is a function that gets the results of its dependency stages as
+    arguments, in the order of the dependencies. The scheduler runs all stages whose dependencies are done
+    concurrently on a thread pool (NumPy, scikit-learn and GloVe release the GIL in their heavy loops). Every stage
+    has a resource hint, e.g. the number of GloVe training workers, and stages are only started while the sum of the
+    resources of the running stages fits into the capacity. Stages must be added after their dependencies."""
+
+    def __init__(self):
+        self.stages = {}  # {name: (function, dependencies, resources)}, in order of adding.
+        self.timings = {}  # {name: (start, end)} in seconds since start of run(...).
+
+    def add(self, name, function, dependencies=(), resources=1):
+        """Adds a stage that runs function(*[results of dependencies]) and reserves resources while running."""
+        assert name not in self.stages, "stage already exists: " + name
+        for dependency in dependencies:
+            assert dependency in self.stages, "unknown dependency of stage " + name + ": " + dependency
+        self.stages[name] = (function, tuple(dependencies), resources)
+        return self
+
+    def critical_path(self):
+        """Returns the longest chain of stages by duration of the last run and its duration."""
+        finish = {}  # {name: (duration of longest chain ending with the stage, chain)}
+        for name, (function, dependencies, resources) in self.stages.items():
+            start, end = self.timings[name]
+            before = max([finish[dependency] for dependency in dependencies], key=lambda x: x[0], default=(0, []))
+            finish[name] = (before[0] + end - start, before[1] + [name])
+        duration, path = max(finish.values(), key=lambda x: x[0])
+        return path, duration
+
+    def run(self, capacity=None, max_workers=None, verbose=False):
+        """Runs all stages and returns the dictionary {name: result}. capacity defaults to the number of CPUs, a
+        stage with more resources than the capacity runs alone. Exceptions of stages are raised after the running
+        stages finished."""
+        capacity = capacity if capacity is not None else os.cpu_count() or 1
+        results = {}
+        waiting = list(self.stages.keys())
+        running = {}  # {future: name}
+        used = 0
+        start_run = time.time()
+
+        def timed(name, function, arguments):
+            start = time.time() - start_run
+            result = function(*arguments)
+            self.timings[name] = (start, time.time() - start_run)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_workers if max_workers is not None else capacity) as executor:
+            while waiting or running:
+                # Start ready stages in order of adding while resources are free.
+                for name in list(waiting):
+                    function, dependencies, resources = self.stages[name]
+                    if all(dependency in results for dependency in dependencies) and \
+                            (used + resources <= capacity or not running):
+                        if verbose:
+                            print("Starting stage", name, "\n")
+                        future = executor.submit(timed, name, function, [results[d] for d in dependencies])
+                        running[future] = name
+                        used += resources
+                        waiting.remove(name)
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    used -= self.stages[name][2]
+                    results[name] = future.result()
+        if verbose:
+            path, duration = self.critical_path()
+            print("Ran", len(self.stages), "stages in", round(time.time() - start_run, 2), "s (sum of stages",
+                  round(sum(end - start for start, end in self.timings.values()), 2), "s, critical path",
+                  round(duration, 2), "s:", " -> ".join(path) + ")\n")
+        return results
+
+
+def test_sg():
+    def stage(name, duration):
+        def function(*results):
+            time.sleep(duration)
+            return name + str(list(results))
+        return function
+
+    graph = StageGraph()
+    graph.add('load', stage('load', 0.2))
+    graph.add('items', stage('items', 0.4), ['load'], resources=2)
+    graph.add('authors', stage('authors', 0.3), ['load'], resources=2)
+    graph.add('evaluate', stage('evaluate', 0.1), ['items', 'authors'])
+    result_1 = graph.run(capacity=4, verbose=True)  # items and authors run concurrently.
+    result_2 = graph.run(capacity=2, verbose=True)  # items and authors do not fit concurrently.
+    print(result_1, "\n", result_2 == result_1, "\n")
+    info(result_1)
+
+
+MODEL_BUNDLE_VERSION = 1
+
+
+def save_model_bundle(directory, components, metadata=None):
+    """Writes the passed components needed for scoring into one directory of raw .npy arrays plus a JSON manifest.
+    components is a dict {name: component}, where a component can be an array, a DataFrame (e.g. term or item
+    vectors, written as values, index and columns) or a dict with scalar keys and scalar or vector values (e.g. a
+    vector dictionary or funk2gold). Strings are stored as fixed-width unicode arrays, so every array can be
+    memory-mapped. metadata (e.g. the parser config) must be JSON serializable. The bundle is written into a
+    temporary directory that replaces directory with two renames at the end, so readers never see a partially
+    written bundle. Between the renames directory does not exist, a reader loading at that moment fails and has to
+    retry. Leftovers of an interrupted save (directory.tmp, directory.old) are removed first."""
+    temp_directory = directory + '.tmp'
+    old_directory = directory + '.old'
+    for stale_directory in [temp_directory, old_directory]:
+        if os.path.isdir(stale_directory):
+            shutil.rmtree(stale_directory)
+    os.makedirs(temp_directory)
+    manifest = {'version': MODEL_BUNDLE_VERSION, 'created': time.time(), 'metadata': metadata or {},
+                'components': {}}
+
+    def save_array(name, part, array):
+        array = np.asarray(array)
+        if array.dtype == object:
+            array = array.astype(str)  # Object arrays can not be memory-mapped.
+        file_name = name + '.' + part + '.npy'
+        np.save(os.path.join(temp_directory, file_name), array, allow_pickle=False)
+        return file_name
+
+    for name, component in components.items():
+        if isinstance(component, pd.DataFrame):
+            entry = {'kind': 'frame', 'values': save_array(name, 'values', component.values),
+                     'index': save_array(name, 'index', component.index.values),
+                     'columns': save_array(name, 'columns', component.columns.values)}
+        elif isinstance(component, dict):
+            entry = {'kind': 'dict', 'keys': save_array(name, 'keys', list(component.keys())),
+                     'values': save_array(name, 'values', list(component.values()))}
+        else:
+            entry = {'kind': 'array', 'values': save_array(name, 'values', component)}
+        manifest['components'][name] = entry
+    with open(os.path.join(temp_directory, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=1, default=lambda value: value.item())
+    # Replace an existing bundle.
+    if os.path.isdir(directory):
+        os.replace(directory, old_directory)
+        os.replace(temp_directory, directory)
+        shutil.rmtree(old_directory)
+    else:
+        os.replace(temp_directory, directory)
+    return manifest
+
+
+def load_model_bundle(directory, mmap=True):
+    """Loads a bundle written by save_model_bundle(...). Arrays are memory-mapped read-only if mmap=True, so loading
+    takes milliseconds and several processes share the pages of the bundle instead of holding their own copies.
+    Returns the dict of components (DataFrames are backed by the memory-mapped values, dicts are rebuilt) and the
+    metadata."""
+    with open(os.path.join(directory, 'manifest.json')) as file:
+        manifest = json.load(file)
+    assert manifest['version'] == MODEL_BUNDLE_VERSION, \
+        "model bundle version " + str(manifest['version']) + " not supported."
+
+    def load_array(file_name):
+        return np.load(os.path.join(directory, file_name), mmap_mode='r' if mmap else None, allow_pickle=False)
+
+    components = {}
+    for name, entry in manifest['components'].items():
+        if entry['kind'] == 'frame':
+            components[name] = pd.DataFrame(load_array(entry['values']), index=load_array(entry['index']),
+                                            columns=load_array(entry['columns']), copy=False)
+        elif entry['kind'] == 'dict':
+            keys = load_array(entry['keys']).tolist()
+            values = load_array(entry['values'])
+            components[name] = dict(zip(keys, values.tolist() if values.ndim == 1 else values))
+        else:
+            components[name] = load_array(entry['values'])
+    return components, manifest['metadata']
+
+
+def test_mb():
+    term_vectors = pd.DataFrame(np.asarray([[0.6, 0.8], [1.0, 0.0], [0.0, 1.0]], dtype=np.float32),
+                                index=['technolog', 'situat', 'sir'])
+    components = {'term_vectors': term_vectors,
+                  'variable_ids': np.asarray([1, 4, 9]),
+                  'funk2gold': {101: 1, 102: 9},
+                  'vector_dict': {'technolog': [0.6, 0.8], 'situat': [1.0, 0.0]}}
+    metadata = {'parser_config': {'stemmer': 'porter2', 'lower': True}, 'dtm_processing': 'tfidf_l2'}
+    save_model_bundle('test_bundle', components, metadata=metadata)
+    # Leftovers of an interrupted save are removed.
+    os.makedirs(os.path.join('test_bundle.tmp', 'stale'), exist_ok=True)
+    os.makedirs('test_bundle.old', exist_ok=True)
+    save_model_bundle('test_bundle', components, metadata=metadata)  # Replaces the bundle.
+    print(os.path.exists('test_bundle.tmp'), os.path.exists('test_bundle.old'), "\n")  # False False
+    result_1, result_2 = load_model_bundle('test_bundle')
+    print(result_1, "\n", result_2, "\n")
+    print(type(result_1['variable_ids']), "\n")  # Memory-mapped.
+    info(result_1)
+    info(result_2)
+
+
+def resolve_construct_authors(funk_constructs, funk_papers, construct_ids=None):
+    """Resolves the authors of Funk's constructs with a single indexed merge of constructs to papers. Returns a Series
+    of int32 author group codes indexed by construct ID and the sorted array of unique author groups, so that
+    author_groups[codes] are the authors of the constructs. Constructs whose paper is missing or has no authors get
+    code -1. Uses the first paper of a construct and the first entry of a paper if IDs are duplicated."""
+    if construct_ids is None:
+        construct_ids = np.unique(funk_constructs['ConstructID'])
+    construct_papers = funk_constructs.drop_duplicates('ConstructID').set_index('ConstructID')['PaperID']
+    paper_authors = funk_papers.drop_duplicates('PaperID').set_index('PaperID')['Author']
+    # Missing constructs get a NaN PaperID, missing papers a NaN Author.
+    authors = paper_authors.reindex(construct_papers.reindex(construct_ids).values)
+    codes, author_groups = pd.factorize(authors.values, sort=True)
+    construct_author_codes = pd.Series(codes.astype(np.int32), index=construct_ids)
+    return construct_author_codes, np.asarray(author_groups)
+
+
+def test_rca():
+    funk_constructs = pd.DataFrame([[10, 1],
+                                    [11, 2],
+                                    [12, 1],
+                                    [13, 5]], columns=['ConstructID', 'PaperID'])
+    funk_papers = pd.DataFrame([[1, 'Davis; Venkatesh'],
+                                [2, 'Bagozzi'],
+                                [3, 'Davis']], columns=['PaperID', 'Author'])
+    construct_ids = [10, 11, 12, 13, 14]
+    result_1, result_2 = resolve_construct_authors(funk_constructs, funk_papers, construct_ids=construct_ids)
+    print(result_1, "\n", result_2, "\n")
+    info(result_1)
+    info(result_2)
+
+
+def gather_construct_similarity(group_similarity, construct_codes, construct_ids, condensed=False, dtype=np.float32):
+    """Gathers a construct similarity matrix DataFrame from a similarity matrix between constituent groups
+    (e.g. co-author groups), which can be a scipy sparse matrix. construct_codes holds the row of each construct's
+    group in group_similarity.
+    If condensed=True, gathers only the upper triangular into a CondensedSimilarity with the passed dtype."""
+    construct_codes = np.asarray(construct_codes)
+    if sp.issparse(group_similarity):
+        # Only the rows and columns of the constructs' groups are densified.
+        unique_codes, construct_codes = np.unique(construct_codes, return_inverse=True)
+        group_similarity = sp.csr_matrix(group_similarity)[unique_codes][:, unique_codes].toarray()
+    group_similarity = np.asarray(group_similarity)
+    if condensed:
+        n = len(construct_codes)
+        values = np.empty(n * (n - 1) // 2, dtype=dtype)
+        k = 0
+        for i in range(n - 1):
+            values[k:k + n - i - 1] = group_similarity[construct_codes[i], construct_codes[i + 1:]]
+            k += n - i - 1
+        return CondensedSimilarity(construct_ids, values, dtype=dtype)
+    construct_similarity = group_similarity[np.ix_(construct_codes, construct_codes)]
+    return pd.DataFrame(construct_similarity, index=construct_ids, columns=construct_ids)
+
+
+def test_gcs():
+    group_similarity = np.asarray([[1.0, 0.2, 0.0],
+                                   [0.2, 1.0, 0.5],
+                                   [0.0, 0.5, 1.0]])
+    construct_codes = [2, 0, 0, 1]
+    construct_ids = [1, 3, 4, 9]
+    result = gather_construct_similarity(group_similarity, construct_codes, construct_ids)
+    print(result, "\n")
+    result = gather_construct_similarity(group_similarity, construct_codes, construct_ids, condensed=True)
+    print(result, "\n", result.values, "\n")
+    result = gather_construct_similarity(sp.csr_matrix(group_similarity), construct_codes, construct_ids,
+                                         condensed=True)
+    print(result.values, "\n")
+    info(result)
+
+
+def parse_author_names(author_groups, separators=';'):
+    """Splits co-author group strings (e.g. 'Davis, F. D.; Venkatesh, V.') at the separators into individual
+    author names and normalizes them: lower case, punctuation and digits removed, white space collapsed. Returns
+    a list with the list of unique author names of every group."""
+    author_names = []
+    for group in author_groups:
+        group = str(group)
+        for separator in separators[1:]:
+            group = group.replace(separator, separators[0])
+        names = [''.join(c if c.isalpha() or c.isspace() else ' ' for c in name.lower()).split()
+                 for name in group.split(separators[0])]
+        author_names.append(list(dict.fromkeys(' '.join(name) for name in names if name)))
+    return author_names
+
+
+def author_graph(author_groups, separators=';'):
+    """Builds the sparse bipartite graph of co-author groups (e.g. corpus_authors, one group per unique author string
+    of Funk's papers) and individual authors from parse_author_names(...). Returns the binary incidence matrix
+    (groups x authors) as CSR matrix and the array of author names."""
+    author_names = parse_author_names(author_groups, separators=separators)
+    author_ix = {}
+    indices = []
+    indptr = [0]
+    for names in author_names:
+        indices += [author_ix.setdefault(name, len(author_ix)) for name in names]
+        indptr.append(len(indices))
+    incidence = sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(author_names), len(author_ix)))
+    return incidence, np.asarray(list(author_ix.keys()))
+
+
+def coauthor_similarity_graph(incidence, idf=True):
+    """Computes the cosine similarity of co-author groups from shared authors as sparse product of the L2
+    normalized incidence matrix from author_graph(...) with its transpose, only group pairs sharing an author are
+    stored. If idf=True, authors are weighted by their smoothed inverse group frequency, so prolific authors count
+    less."""
+    incidence = sp.csr_matrix(incidence, dtype=np.float64)
+    if idf:
+        degree = np.bincount(incidence.indices, minlength=incidence.shape[1])
+        incidence.data = incidence.data * (np.log((1 + incidence.shape[0]) / (1 + degree)) + 1)[incidence.indices]
+    incidence = Normalizer(copy=False, norm='l2').fit_transform(incidence)
+    return incidence.dot(incidence.T).tocsr()
+
+
+def author_graph_embedding(incidence, n_components=100, method='svd', n_steps=3, random_state=0):
+    """Embeds co-author groups from the author graph of author_graph(...) in time linear in the edges.
+    method='svd': truncated SVD of the degree normalized incidence matrix D_groups^-1/2 A D_authors^-1/2.
+    method='random_walk': very sparse random projection of the authors, propagated over n_steps random walk steps
+    group -> author -> group (FastRP, Chen et al., 2019), the L2 normalized steps are summed.
+    Returns the L2 normalized group vectors as array."""
+    incidence = sp.csr_matrix(incidence, dtype=np.float64)
+    group_degree = np.maximum(np.asarray(incidence.sum(axis=1)).ravel(), 1)
+    author_degree = np.maximum(np.asarray(incidence.sum(axis=0)).ravel(), 1)
+    if method == 'svd':
+        normalized = sp.diags(1 / np.sqrt(group_degree)).dot(incidence).dot(sp.diags(1 / np.sqrt(author_degree)))
+        n_components = min(n_components, min(incidence.shape) - 1)
+        vectors = TruncatedSVD(n_components=n_components, algorithm='randomized',
+                               random_state=random_state).fit_transform(normalized)
+    elif method == 'random_walk':
+        # Random projection with entries +-sqrt(3) with probability 1/6 each (Achlioptas, 2003).
+        random = np.random.RandomState(random_state)
+        projection = random.choice([-np.sqrt(3), 0, np.sqrt(3)], size=(incidence.shape[1], n_components),
+                                   p=[1 / 6, 2 / 3, 1 / 6])
+        # Transition probabilities group -> author and author -> group.
+        group_to_author = sp.diags(1 / group_degree).dot(incidence).tocsr()
+        author_to_group = sp.diags(1 / author_degree).dot(incidence.T).tocsr()
+        step = group_to_author.dot(projection)
+        vectors = Normalizer(norm='l2').fit_transform(step)
+        for _ in range(n_steps - 1):
+            step = group_to_author.dot(author_to_group.dot(step))
+            vectors = vectors + Normalizer(norm='l2').fit_transform(step)
+    else:
+        assert False, "chosen embedding method not implemented."
+    return Normalizer(norm='l2').fit_transform(vectors)
+
+
+def test_ag():
+    author_groups = np.asarray(['Bagozzi, R.', 'Davis, F. D.; Venkatesh, V.', 'Davis, F. D.; Bagozzi, R.',
+                                'Venkatesh, V.; Morris, M.', 'Gefen, D.', 'Morris, M.'])
+    result_1, result_2 = author_graph(author_groups)
+    print(result_1.toarray(), "\n", result_2, "\n")
+    result_3 = coauthor_similarity_graph(result_1)
+    print(np.round(result_3.toarray(), 3), "\n")
+    for method in ['svd', 'random_walk']:
+        vectors = author_graph_embedding(result_1, n_components=32, method=method)
+        print(method, "\n", np.round(vectors.dot(vectors.T), 3), "\n")
+    info(result_1)
+    info(result_3)
+
+
+def candidate_edges(construct_distances, max_editdistance=1):
+    """Extracts the sparse candidate edges between gold constructs (rows) and Funk's constructs (columns) from the
+    passed construct distance DataFrame. Returns arrays of gold IDs, Funk IDs and distances of all construct pairs
+    with distance <= max_editdistance."""
+    distances = np.asarray(construct_distances)
+    rows, cols = np.nonzero(distances <= max_editdistance)
+    return construct_distances.index.values[rows], construct_distances.columns.values[cols], distances[rows, cols]
+
+
+def qgram_candidates(names_1, names_2, max_editdistance=1, q=2):
+    """Blocking for edit distance linking with an inverted index over the q-grams of the names. Two names within
+    edit distance d differ in length by at most d (length filter) and share at least max(length) - q + 1 - d * q
+    q-grams, since every edit destroys at most q q-grams (count filter). Names too short for a positive bound are
+    compared with all short names. Returns the positions (i, j) of the name pairs passing both filters, only these
+    need to be evaluated."""
+    vocabulary = {}
+
+    def qgram_counts(names):
+        # Sparse q-gram count matrix (names x q-grams) with the shared vocabulary.
+        indices = []
+        indptr = [0]
+        for name in names:
+            indices += [vocabulary.setdefault(name[k:k + q], len(vocabulary)) for k in range(len(name) - q + 1)]
+            indptr.append(len(indices))
+        return sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(names), len(vocabulary)))
+
+    counts_1 = qgram_counts(names_1)
+    counts_2 = qgram_counts(names_2)
+    counts_1.resize(counts_1.shape[0], len(vocabulary))
+    counts_2.resize(counts_2.shape[0], len(vocabulary))
+    lengths_1 = np.asarray([len(name) for name in names_1])
+    lengths_2 = np.asarray([len(name) for name in names_2])
+    # Shared q-grams of all pairs with at least one shared q-gram. The product counts repeated q-grams more than
+    # once, which only makes the count filter less strict.
+    shared = counts_1.dot(counts_2.T).tocoo()
+    rows, cols, n_shared = shared.row, shared.col, shared.data
+    bound = np.maximum(lengths_1[rows], lengths_2[cols]) - q + 1 - max_editdistance * q
+    keep = n_shared >= bound
+    rows, cols = rows[keep], cols[keep]
+    # Pairs of short names can be within the distance without sharing any q-gram.
+    short_1 = np.flatnonzero(lengths_1 <= q - 1 + max_editdistance * q)
+    short_2 = np.flatnonzero(lengths_2 <= q - 1 + max_editdistance * q)
+    rows = np.concatenate([rows, np.repeat(short_1, len(short_2))])
+    cols = np.concatenate([cols, np.tile(short_2, len(short_1))])
+    pairs = np.unique(np.stack([rows, cols], axis=1), axis=0)
+    rows, cols = pairs[:, 0], pairs[:, 1]
+    keep = np.abs(lengths_1[rows] - lengths_2[cols]) <= max_editdistance
+    return rows[keep], cols[keep]
+
+
+def test_qc():
+    names_1 = ['perceived usefulness', 'ease of use', 'trust', 'it']
+    names_2 = ['perceived usefullness', 'perceived ease of use', 'trust', 'ir', 'enjoyment']
+    max_editdistance = 1
+    result_1, result_2 = qgram_candidates(names_1, names_2, max_editdistance=max_editdistance)
+    print(result_1, "\n", result_2, "\n")
+    # All pairs within the distance must be candidates.
+    within = [(i, j) for i in range(len(names_1)) for j in range(len(names_2))
+              if editdistance.eval(names_1[i], names_2[j]) <= max_editdistance]
+    print(within, "\n", set(within) <= set(zip(result_1, result_2)), "\n")
+    info(result_1)
+
+
+def link_constructs(gold_ids, funk_ids, distances, mode='assignment', max_candidates=None):
+    """Links Funk's constructs to gold constructs from sparse candidate edges (gold_ids[i], funk_ids[i], distances[i])
+    and returns the translation dictionaries funk2gold and gold2funk.
+    mode='assignment' solves the minimum-distance one-to-one assignment, which links as many constructs as possible.
+    The assignment is solved separately on every connected component of the candidate graph, which are small, so
+    the run time grows about linearly with the number of edges.
+    mode='ranked' keeps multiple matches and returns lists of candidate IDs sorted by distance,
+    optionally limited to max_candidates per construct."""
+    gold_ids = np.asarray(gold_ids)
+    funk_ids = np.asarray(funk_ids)
+    distances = np.asarray(distances, dtype=np.float64)
+    if mode == 'ranked':
+        funk2gold = {}
+        gold2funk = {}
+        for source_ids, target_ids, ranked in [(funk_ids, gold_ids, funk2gold), (gold_ids, funk_ids, gold2funk)]:
+            order = np.lexsort((distances, source_ids))  # Sort by source ID, then by distance.
+            for source_id, target_id in zip(source_ids[order], target_ids[order]):
+                candidates = ranked.setdefault(source_id, [])
+                if max_candidates is None or len(candidates) < max_candidates:
+                    candidates.append(target_id)
+        return funk2gold, gold2funk
+    assert mode == 'assignment', "chosen linking mode not implemented."
+    # Index gold and Funk IDs as nodes of the bipartite candidate graph and find its connected components.
+    gold_codes, gold_nodes = pd.factorize(gold_ids)
+    funk_codes, funk_nodes = pd.factorize(funk_ids)
+    graph = sp.csr_matrix((np.ones(len(distances)), (gold_codes, len(gold_nodes) + funk_codes)),
+                          shape=(len(gold_nodes) + len(funk_nodes),) * 2)
+    n_components, labels = connected_components(graph, directed=False)
+    edge_labels = labels[gold_codes]
+    order = np.argsort(edge_labels, kind='stable')
+    funk2gold = {}
+    for component in np.split(order, np.flatnonzero(np.diff(edge_labels[order])) + 1):
+        if len(component) == 1:
+            funk2gold[funk_ids[component[0]]] = gold_ids[component[0]]
+            continue
+        # Dense cost matrix of the component. Non-edges cost more than all edges together, so that the number of
+        # links is maximized first and the total distance second.
+        comp_gold_codes, comp_gold_ids = pd.factorize(gold_ids[component])
+        comp_funk_codes, comp_funk_ids = pd.factorize(funk_ids[component])
+        no_edge = distances[component].sum() + 1
+        cost = np.full([len(comp_gold_ids), len(comp_funk_ids)], no_edge)
+        cost[comp_gold_codes, comp_funk_codes] = distances[component]
+        rows, cols = linear_sum_assignment(cost)
+        for row, col in zip(rows, cols):
+            if cost[row, col] < no_edge:
+                funk2gold[comp_funk_ids[col]] = comp_gold_ids[row]
+    # Create mirrored ID translation dictionary for the other direction.
+    gold2funk = {g: f for f, g in funk2gold.items()}
+    return funk2gold, gold2funk
+
+
+def test_lc():
+    gold_ids = np.asarray([1, 1, 2, 2, 3, 4])
+    funk_ids = np.asarray([10, 11, 10, 12, 13, 13])
+    distances = np.asarray([0, 1, 1, 0, 1, 0])
+    for mode in ['assignment', 'ranked']:
+        result_1, result_2 = link_constructs(gold_ids, funk_ids, distances, mode=mode)
+        print(result_1, "\n", result_2, "\n")
+        info(result_1)
+        info(result_2)
+
+
+def load_data(prototype=False, max_editdistance=1, link_mode='assignment', blocking=True, deduplicate=True,
+              verbose=False):
     """Load data. construct_authors are indexed by the matching construct ID in Funk's dataset. Use funk2gold to
-    translate the IDs to matching gold IDs."""
+    translate the IDs to matching gold IDs. See link_constructs(...) for the linking modes, the rest of the
+    pipeline expects one-to-one links ('assignment'). construct_author_codes gives the position of each Funk
+    construct's authors in author_groups (-1 for constructs without known authors).
+    If blocking=True, edit distances are only evaluated for construct name pairs from qgram_candidates(...), all
+    other distances are inf. These distances are cached per max_editdistance. If deduplicate=True, edit distances
+    are evaluated once per pair of unique parsed construct names (see unique_index(...))."""
     # Load the dataset provided by (Larsen & Bong, 2016).
     file = r'LarsenBong2016GoldStandard.xls'
-    gold_standard = pd.read_excel(file, sheet_name='GoldStandard')
-    gold_items = pd.read_excel(file, sheet_name='Items')
+    gold_sheets = read_excel_cached(file, sheet_names=['GoldStandard', 'Items'], verbose=verbose)
+    gold_standard = gold_sheets['GoldStandard']
+    gold_items = gold_sheets['Items']
     if prototype:
         try:
             pool_ids = np.loadtxt('pool_ids_prototype.txt')
@@ -111,9 +1165,9 @@ def load_data(prototype=False, max_editdistance=1, verbose=False):
 
     # Load Funk's data on papers and constructs.
     file = r'datasetFunk/FunkPapers.xlsx'
-    funk_papers = pd.read_excel(file)
+    funk_papers = read_excel_cached(file, verbose=verbose)
     file = r'datasetFunk/FunkConstructs.xlsx'
-    funk_constructs = pd.read_excel(file)
+    funk_constructs = read_excel_cached(file, verbose=verbose)
 
     # Get unique construct IDs from Larsen's and Funk's dataset.
     gold_construct_ids = np.unique(gold_items['VariableId'])
@@ -122,8 +1176,10 @@ def load_data(prototype=False, max_editdistance=1, verbose=False):
     # Calculate construct distances between constructs in Larsen's and Funk's datasets.
     # TODO: unit testing
     # TODO: painfully slow, probably since it has to search in DataFrames every iteration.
+    distances_file = 'construct_editdistances_d' + str(max_editdistance) + '.df' if blocking else \
+        'construct_editdistances.df'
     try:
-        construct_distances = pd.read_pickle('construct_editdistances.df')
+        construct_distances = pd.read_pickle(distances_file)
     except FileNotFoundError:
         print("No construct editdistance file found. Creating new file...")
         if prototype:
@@ -137,71 +1193,88 @@ def load_data(prototype=False, max_editdistance=1, verbose=False):
                              for name in funk_constructs['ConstructName']]
         funk_constructs['ConstructNameParse'] = funk_names_parsed
 
-        # TODO: could create two dicts {ID: ConstructName} to try to speed this up.
-        # Evaluate distances and fill new DataFrame.
-        construct_distances = pd.DataFrame(np.zeros([len(gold_construct_ids), len(funk_construct_ids)]),
-                                           index=gold_construct_ids, columns=funk_construct_ids)
-        ctr = 0
-        for gold_id in gold_construct_ids:
-            for funk_id in funk_construct_ids:
-                # Get one gold construct name and one Funk construct name.
-                gold_name = gold_items.loc[gold_items['VariableId'] == gold_id, 'VariableNameParse'].iloc[0]
-                funk_name = funk_constructs.loc[funk_constructs['ConstructID'] == funk_id, 'ConstructNameParse'].iloc[0]
-                # Evaluate the distance between the construct names.
-                distance = editdistance.eval(gold_name, funk_name)
-                construct_distances[funk_id][gold_id] = distance  # DataFrames access columns first, then rows.
-            ctr += 1
-            if verbose and ctr % 30 == 0:
-                print("Relating gold constructs to Funk's constructs:", ctr / len(gold_construct_ids) * 100, "%",
-                      flush=True)
-        construct_distances.to_pickle('construct_editdistances.df')
+        if blocking or deduplicate:
+            # One parsed name per construct ID.
+            gold_names = gold_items.drop_duplicates('VariableId').set_index('VariableId')['VariableNameParse']
+            gold_names = np.asarray(gold_names.loc[gold_construct_ids])
+            funk_names = funk_constructs.drop_duplicates('ConstructID').set_index('ConstructID')['ConstructNameParse']
+            funk_names = np.asarray(funk_names.loc[funk_construct_ids])
+            start_time = time.time()
+            if deduplicate:
+                # Distances between unique names, mapped back to the construct IDs with the indices.
+                gold_names, gold_index = unique_index(gold_names)
+                funk_names, funk_index = unique_index(funk_names)
+            if blocking:
+                # Evaluate only the distances of candidate pairs.
+                rows, cols = qgram_candidates(gold_names, funk_names, max_editdistance=max_editdistance)
+                distances = np.full([len(gold_names), len(funk_names)], np.inf)
+            else:
+                rows, cols = np.divmod(np.arange(len(gold_names) * len(funk_names)), len(funk_names))
+                distances = np.zeros([len(gold_names), len(funk_names)])
+            distances[rows, cols] = [editdistance.eval(gold_names[i], funk_names[j]) for i, j in zip(rows, cols)]
+            if verbose and blocking:
+                n_pairs = len(gold_names) * len(funk_names)
+                print("Blocking:", len(rows), "candidate construct name pairs of", n_pairs, "-",
+                      round((1 - len(rows) / n_pairs) * 100, 2), "% pruned.")
+            if deduplicate:
+                distances = distances[np.ix_(gold_index, funk_index)]
+                if verbose:
+                    # Work is counted in name pairs.
+                    deduplication_report('construct name pairs', distances.size, len(gold_names) * len(funk_names),
+                                         time.time() - start_time, pairwise=False)
+            construct_distances = pd.DataFrame(distances, index=gold_construct_ids, columns=funk_construct_ids)
+        else:
+            # TODO: could create two dicts {ID: ConstructName} to try to speed this up.
+            # Evaluate distances and fill new DataFrame.
+            construct_distances = pd.DataFrame(np.zeros([len(gold_construct_ids), len(funk_construct_ids)]),
+                                               index=gold_construct_ids, columns=funk_construct_ids)
+            ctr = 0
+            for gold_id in gold_construct_ids:
+                for funk_id in funk_construct_ids:
+                    # Get one gold construct name and one Funk construct name.
+                    gold_name = gold_items.loc[gold_items['VariableId'] == gold_id, 'VariableNameParse'].iloc[0]
+                    funk_name = funk_constructs.loc[funk_constructs['ConstructID'] == funk_id,
+                                                    'ConstructNameParse'].iloc[0]
+                    # Evaluate the distance between the construct names.
+                    distance = editdistance.eval(gold_name, funk_name)
+                    construct_distances[funk_id][gold_id] = distance  # DataFrames access columns first, then rows.
+                ctr += 1
+                if verbose and ctr % 30 == 0:
+                    print("Relating gold constructs to Funk's constructs:", ctr / len(gold_construct_ids) * 100, "%",
+                          flush=True)
+        construct_distances.to_pickle(distances_file)
 
-    # Create construct ID translation dictionary between Larsen' and Funk's datasets. Simply uses the first match.
-    # TODO: deal with multiple matches.
-    funk2gold = {}
-    ctr = 0
-    for funk_id in funk_construct_ids:
-        for gold_id in gold_construct_ids:
-            # Check whether the gold_id has already been linked to a funk_id. This can happen with multiple matches.
-            if gold_id in funk2gold.values():
-                continue
-            try:
-                if construct_distances[funk_id][gold_id] <= max_editdistance:
-                    funk2gold[funk_id] = gold_id
-                    # Break to go to the next funk_id (outer loop), so that every ID gets only matched once.
-                    break
-            except KeyError:
-                print("KeyError: Check whether editdistances were created on prototype or full dataset.")
-                raise
-        ctr += 1
-        if verbose and ctr % 200 == 0:
-            print("Creating construct ID translation dictionary:", ctr / len(funk_construct_ids) * 100, "%",
-                  flush=True)
+    # Create construct ID translation dictionaries between Larsen' and Funk's datasets from the candidate matches.
+    try:
+        construct_distances = construct_distances.loc[gold_construct_ids, funk_construct_ids]
+    except KeyError:
+        print("KeyError: Check whether editdistances were created on prototype or full dataset.")
+        raise
+    edge_gold_ids, edge_funk_ids, edge_distances = candidate_edges(construct_distances,
+                                                                   max_editdistance=max_editdistance)
+    funk2gold, gold2funk = link_constructs(edge_gold_ids, edge_funk_ids, edge_distances, mode=link_mode)
     if verbose:
         print("Related", len(funk_construct_ids), "Funk constructs to", len(gold_construct_ids), "gold constructs.")
         print(len(funk2gold), "matches found with Levenshtein distance <=", max_editdistance, "\n")
-    # Create mirrored ID translation dictionary for the other direction.
-    gold2funk = {g: f for f, g in funk2gold.items()}
 
-    # Get authors of the constructs in Funk's dataset.
-    # Implementation checked 4 July.
-    construct_authors = {}
-    for construct_id in funk_construct_ids:
-        # Get PaperID related to a specific ConstructID.
-        paper_id = funk_constructs.loc[funk_constructs['ConstructID'].isin([construct_id])]['PaperID']
-        # Get authors of specific PaperID.
-        authors = funk_papers.loc[funk_papers['PaperID'].isin([paper_id])]['Author']
-        construct_authors[construct_id] = np.asarray(authors)[0]
+    # Get authors of the constructs in Funk's dataset with a single merge of constructs to papers.
+    construct_author_codes, author_groups = resolve_construct_authors(funk_constructs, funk_papers,
+                                                                      construct_ids=funk_construct_ids)
+    construct_authors = {construct_id: author_groups[code] for construct_id, code in construct_author_codes.items()
+                         if code >= 0}
+    if verbose and len(construct_authors) < len(funk_construct_ids):
+        print(len(funk_construct_ids) - len(construct_authors), "Funk constructs without known authors.\n")
 
     return gold_items, pool_ids, variable_ids, construct_identity_gold, funk_papers, funk_constructs, \
-           construct_authors, construct_distances, funk2gold, gold2funk
+           construct_authors, construct_distances, funk2gold, gold2funk, construct_author_codes, author_groups
 
 
 def test_ld():
     prototype = False
     verbose = True
     gold_items, pool_ids, variable_ids, construct_identity_gold, funk_papers, funk_constructs, \
-    construct_authors, construct_distances, funk2gold, gold2funk = load_data(prototype=prototype, verbose=verbose)
+    construct_authors, construct_distances, funk2gold, gold2funk, construct_author_codes, author_groups = \
+        load_data(prototype=prototype, verbose=verbose)
 
     for i in np.unique(gold_items['VariableId'].head(200)):
         try:
@@ -283,39 +1356,56 @@ def test_pt():
     info(result_2)
 
 
-def document_term_cooccurrence(corpus, processing='tfidf_l2'):
+def document_term_cooccurrence(corpus, processing='tfidf_l2', min_df=1, max_features=None, sparse=False, unique=True,
+                               verbose=False):
     """Creates and returns a document-term matrix DataFrame with the specified processing method.
     Also returns the feature names (terms) extracted by the vectorizer. Available processing methods are
-    'count', 'l2', 'tfidf_l2' and 'log_l2'."""
+    'count', 'l2', 'tfidf_l2', 'log_l2', 'bm25_l2' and 'ppmi_l2' (see weight_document_term_matrix(...)). If a list
+    of processing methods is passed, a dict {processing: DataFrame} is returned, all weightings are computed from
+    one counting pass. The vocabulary can be pruned to terms in at least min_df documents and to the max_features
+    most frequent terms. If sparse=True, the DataFrame holds a sparse matrix (see plan_memory(...)), use
+    dtm_values(...) to get it as scipy CSR matrix.
+    If unique=True, identical documents are counted once and their count rows are repeated for the duplicates, the
+    vocabulary is pruned on the repeated counts like by the CountVectorizer."""
     # Implementation checked superficially 28 June.
-    count_vectorizer = CountVectorizer(stop_words=None, lowercase=False, dtype='int32')
-    dt_matrix = count_vectorizer.fit_transform(corpus).toarray()
-    terms = count_vectorizer.get_feature_names()
-    if processing == 'count':
-        return pd.DataFrame(dt_matrix, index=corpus, columns=terms), terms
-    if processing == 'l2':
-        dt_matrix_l2 = Normalizer(copy=True, norm='l2').fit_transform(dt_matrix)
-        return pd.DataFrame(dt_matrix_l2, index=corpus, columns=terms), terms
-    if processing == 'tfidf_l2':
-        tfidf_vectorizer = TfidfVectorizer(stop_words=None, lowercase=False, norm='l2', use_idf=True, smooth_idf=True)
-        dt_matrix_tfidf_l2 = tfidf_vectorizer.fit_transform(corpus)
-        dt_matrix_tfidf_l2 = dt_matrix_tfidf_l2.toarray()
-        return pd.DataFrame(dt_matrix_tfidf_l2, index=corpus, columns=terms), terms
-    if processing == 'log_l2':
-        # Apply log entropy and L2 normalization to count matrix.
-        # https://radimrehurek.com/gensim/models/logentropy_model.html
-        # Implementation checked manually.
-        local_weight_matrix = np.log(dt_matrix + 1)
-        p_matrix = np.divide(dt_matrix, np.tile(np.sum(dt_matrix, axis=0), (len(dt_matrix), 1)))
-        log_p_matrix = np.log(p_matrix + 1)  # +1 ? reduced performance slightly, not included in source.
-        log_p_matrix[np.isneginf(log_p_matrix)] = 0  # Deal with inf produced by zero log
-        global_weight_matrix = np.tile(1 + np.divide(np.sum(np.multiply(p_matrix, log_p_matrix),
-                                                            axis=0), np.log(len(dt_matrix) + 1)), (len(dt_matrix), 1))
-        final_weight_matrix = np.multiply(local_weight_matrix, global_weight_matrix)
-        dt_matrix_log = np.multiply(dt_matrix, final_weight_matrix)
-        dt_matrix_log_l2 = Normalizer(copy=True, norm='l2').fit_transform(dt_matrix_log)
-        return pd.DataFrame(dt_matrix_log_l2, index=corpus, columns=terms), terms
-    assert False, "chosen processing method not implemented."
+    if unique:
+        start_time = time.time()
+        unique_docs, doc_index = unique_index(corpus)
+        count_vectorizer = CountVectorizer(stop_words=None, lowercase=False, dtype='int32')
+        dt_counts = count_vectorizer.fit_transform(unique_docs)[doc_index]
+        terms = np.asarray(count_vectorizer.get_feature_names())
+        # Prune the vocabulary like CountVectorizer(min_df=min_df, max_features=max_features) on the full corpus.
+        doc_frequency = np.bincount(dt_counts.indices, minlength=dt_counts.shape[1])
+        keep = doc_frequency >= (min_df if isinstance(min_df, numbers.Integral) else min_df * dt_counts.shape[0])
+        if not keep.any():
+            raise ValueError("After pruning, no terms remain. Try a lower min_df.")
+        if max_features is not None and keep.sum() > max_features:
+            term_frequency = np.asarray(dt_counts.sum(axis=0)).ravel()
+            top = np.where(keep)[0][(-term_frequency[keep]).argsort()[:max_features]]
+            keep = np.zeros(len(keep), dtype=bool)
+            keep[top] = True
+        dt_counts = dt_counts[:, np.where(keep)[0]]
+        terms = terms[keep].tolist()
+        if verbose:
+            deduplication_report('documents', len(corpus), len(unique_docs), time.time() - start_time,
+                                 pairwise=False)
+    else:
+        count_vectorizer = CountVectorizer(stop_words=None, lowercase=False, dtype='int32', min_df=min_df,
+                                           max_features=max_features)
+        dt_counts = count_vectorizer.fit_transform(corpus)
+        terms = count_vectorizer.get_feature_names()
+    processings = [processing] if isinstance(processing, str) else list(processing)
+    dt_matrices = weight_document_term_matrices(dt_counts, processings=processings)
+    for key, dt_matrix in dt_matrices.items():
+        if sparse:
+            # Fill value 0, else pandas fills absent terms with NaN when the frame is densified.
+            dt_matrices[key] = pd.DataFrame.sparse.from_spmatrix(dt_matrix, index=corpus, columns=terms).astype(
+                pd.SparseDtype(dt_matrix.dtype, 0))
+        else:
+            dt_matrices[key] = pd.DataFrame(dt_matrix.toarray(), index=corpus, columns=terms)
+    if isinstance(processing, str):
+        return dt_matrices[processing], terms
+    return dt_matrices, terms
 
 
 def test_dtc():
@@ -333,6 +1423,347 @@ def test_dtc():
     info(result_3)
 
 
+def read_item_chunks(file_name, column='Text', chunk_size=4096, sheet_name=0):
+    """Reads the passed text column of an item source in chunks of rows and yields each chunk as a NumPy array.
+    Supports Excel ('.xlsx', '.xls'), CSV ('.csv') and JSON lines ('.jsonl') files. '.xlsx' workbooks are streamed
+    row by row with openpyxl in read-only mode. The legacy '.xls' format can not be streamed, so the sheet is read
+    once and chunked afterwards."""
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == '.csv':
+        for chunk in pd.read_csv(file_name, usecols=[column], chunksize=chunk_size):
+            yield np.asarray(chunk[column], dtype=object)
+    elif extension in ('.jsonl', '.json'):
+        for chunk in pd.read_json(file_name, lines=True, chunksize=chunk_size):
+            yield np.asarray(chunk[column], dtype=object)
+    elif extension == '.xlsx':
+        import openpyxl  # Only needed for streaming Excel files.
+        workbook = openpyxl.load_workbook(file_name, read_only=True)
+        try:
+            if isinstance(sheet_name, int):
+                sheet = workbook.worksheets[sheet_name]
+            else:
+                sheet = workbook[sheet_name]
+            rows = sheet.iter_rows(values_only=True)
+            col_ix = list(next(rows)).index(column)  # First row holds the column names.
+            chunk = []
+            for row in rows:
+                chunk.append(row[col_ix])
+                if len(chunk) == chunk_size:
+                    yield np.asarray(chunk, dtype=object)
+                    chunk = []
+            if chunk:
+                yield np.asarray(chunk, dtype=object)
+        finally:
+            workbook.close()
+    elif extension == '.xls':
+        texts = np.asarray(pd.read_excel(file_name, sheet_name=sheet_name, usecols=[column])[column], dtype=object)
+        for start in range(0, len(texts), chunk_size):
+            yield texts[start:start + chunk_size]
+    else:
+        assert False, "file type not supported: " + extension
+
+
+def term_statistics(dt_counts):
+    """Computes the statistics of a sparse document-term count matrix that the global and local term weights of
+    weight_document_term_matrix(...) are based on, each as one vector: document frequency and global count of every
+    term, length (sum of counts) of every document."""
+    dt_counts = sp.csr_matrix(dt_counts, dtype=np.float64)
+    return {'n_docs': dt_counts.shape[0],
+            'doc_freq': np.bincount(dt_counts.indices, minlength=dt_counts.shape[1]),
+            'global_freq': np.bincount(dt_counts.indices, weights=dt_counts.data, minlength=dt_counts.shape[1]),
+            'doc_lengths': np.asarray(dt_counts.sum(axis=1)).ravel()}
+
+
+def weight_document_term_matrix(dt_counts, processing='tfidf_l2', statistics=None, k1=1.2, b=0.75):
+    """Applies the specified processing method to a sparse document-term count matrix and returns a sparse CSR
+    matrix. Global term weights are computed as one vector of length n terms (from term_statistics(...), which can
+    be passed to reuse them) and broadcast to the non-zero counts, the matrix is never densified. Methods:
+    - 'count': raw counts,
+    - 'l2': L2 normalized counts,
+    - 'tfidf_l2': smoothed idf as TfidfVectorizer(smooth_idf=True), L2 normalized,
+    - 'log_l2': log entropy (https://radimrehurek.com/gensim/models/logentropy_model.html), L2 normalized,
+    - 'bm25_l2': Okapi BM25 with parameters k1 and b, L2 normalized,
+    - 'ppmi_l2': positive pointwise mutual information of documents and terms, L2 normalized."""
+    if processing == 'count':
+        return sp.csr_matrix(dt_counts)
+    dt_counts = sp.csr_matrix(dt_counts, dtype=np.float64)
+    if statistics is None:
+        statistics = term_statistics(dt_counts)
+    n_docs = statistics['n_docs']
+    term_ix = dt_counts.indices
+    doc_ix = np.repeat(np.arange(n_docs), np.diff(dt_counts.indptr))  # Row of every non-zero count.
+    weighted = dt_counts.copy()
+    if processing == 'l2':
+        pass
+    elif processing == 'tfidf_l2':
+        idf = np.log((1 + n_docs) / (1 + statistics['doc_freq'])) + 1
+        weighted.data = dt_counts.data * idf[term_ix]
+    elif processing == 'log_l2':
+        # p = count / global term count. log(p + 1) as in the original implementation, not included in source.
+        p_values = dt_counts.data / statistics['global_freq'][term_ix]
+        entropy = np.bincount(term_ix, weights=p_values * np.log(p_values + 1), minlength=dt_counts.shape[1])
+        global_weights = 1 + entropy / np.log(n_docs + 1)
+        weighted.data = dt_counts.data * np.log(dt_counts.data + 1) * global_weights[term_ix]
+    elif processing == 'bm25_l2':
+        doc_freq = statistics['doc_freq']
+        idf = np.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        doc_lengths = statistics['doc_lengths']
+        length_norm = 1 - b + b * doc_lengths / max(np.mean(doc_lengths), 1e-12)
+        weighted.data = idf[term_ix] * dt_counts.data * (k1 + 1) / (dt_counts.data + k1 * length_norm[doc_ix])
+    elif processing == 'ppmi_l2':
+        total = np.sum(statistics['doc_lengths'])
+        pmi = np.log(dt_counts.data * total / (statistics['doc_lengths'][doc_ix] * statistics['global_freq'][term_ix]))
+        weighted.data = np.maximum(pmi, 0)
+        weighted.eliminate_zeros()
+    else:
+        assert False, "chosen processing method not implemented."
+    return Normalizer(copy=False, norm='l2').fit_transform(weighted)
+
+
+def weight_document_term_matrices(dt_counts, processings=('count', 'l2', 'tfidf_l2', 'log_l2', 'bm25_l2', 'ppmi_l2')):
+    """Returns a dict {processing: weighted CSR matrix} with all requested processing methods of
+    weight_document_term_matrix(...), the term statistics are computed once for all of them."""
+    statistics = term_statistics(dt_counts)
+    return {processing: weight_document_term_matrix(dt_counts, processing=processing, statistics=statistics)
+            for processing in processings}
+
+
+def test_wdtm():
+    corpus = np.asarray(['it technolog advanc situat',
+                         "mari don't like situat",
+                         'technolog great',
+                         'yes sir sir that question'])
+    dt_counts = CountVectorizer(stop_words=None, lowercase=False).fit_transform(corpus)
+    result = weight_document_term_matrices(dt_counts)
+    for processing, dt_matrix in result.items():
+        print(processing, "\n", np.round(dt_matrix.toarray(), 3), "\n")
+    # Compare to the vectorizer of scikit-learn.
+    tfidf_vectorizer = TfidfVectorizer(stop_words=None, lowercase=False, norm='l2', use_idf=True, smooth_idf=True)
+    print("tfidf_l2 equal to TfidfVectorizer:",
+          np.allclose(result['tfidf_l2'].toarray(), tfidf_vectorizer.fit_transform(corpus).toarray()))
+    info(result)
+
+
+def document_term_stream(chunks, parser_config=None, processing='tfidf_l2', n_features=None, return_documents=False,
+                         verbose=False):
+    """Creates a sparse document-term matrix from an iterable of raw document chunks, e.g. from read_item_chunks(...).
+    Every chunk is parsed with parse_text(...) using the passed parser_config and appended to the count matrix, so
+    only one chunk of text is held in memory at a time. The vocabulary grows with the chunks. If n_features is passed,
+    terms are hashed into n_features columns instead and no vocabulary is kept (terms are then the column indices).
+    Returns the weighted CSR matrix and the terms. If return_documents=True, the parsed documents are kept and
+    returned in between, their memory then grows with the corpus."""
+    if parser_config is None:
+        parser_config = {}
+    analyzer = CountVectorizer(stop_words=None, lowercase=False).build_analyzer()
+    if n_features is not None:
+        hashing_vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None,
+                                               lowercase=False, stop_words=None)
+    vocabulary = {}
+    documents = []
+    n_documents = 0
+    dt_chunks = []
+    for chunk in chunks:
+        corpus_chunk = parse_text(np.asarray(chunk, dtype=object), **parser_config)
+        if n_features is not None:
+            dt_chunk = hashing_vectorizer.transform(corpus_chunk)
+        else:
+            # Index the terms of the chunk, new terms are appended to the vocabulary.
+            indices = []
+            indptr = [0]
+            for doc in corpus_chunk:
+                indices += [vocabulary.setdefault(term, len(vocabulary)) for term in analyzer(doc)]
+                indptr.append(len(indices))
+            dt_chunk = sp.csr_matrix((np.ones(len(indices), dtype='int32'), indices, indptr),
+                                     shape=(len(corpus_chunk), len(vocabulary)))
+            dt_chunk.sum_duplicates()
+        dt_chunks.append(dt_chunk)
+        n_documents += len(corpus_chunk)
+        if return_documents:
+            documents += list(corpus_chunk)
+        if verbose:
+            print("Streamed", n_documents, "documents,", len(vocabulary), "terms.", end='\r', flush=True)
+    n_terms = n_features if n_features is not None else len(vocabulary)
+    # Earlier chunks have fewer columns, since the vocabulary kept growing.
+    dt_counts = sp.vstack([sp.csr_matrix((m.data, m.indices, m.indptr), shape=(m.shape[0], n_terms))
+                           for m in dt_chunks], format='csr')
+    if n_features is not None:
+        terms = np.arange(n_features)
+    else:
+        # Sort terms alphabetically like CountVectorizer.
+        terms = np.asarray(list(vocabulary.keys()))
+        order = np.argsort(terms)
+        terms = terms[order]
+        dt_counts = dt_counts[:, order]
+    if verbose:
+        print("Created sparse document-term matrix with", dt_counts.nnz, "non-zero entries.")
+    if return_documents:
+        return weight_document_term_matrix(dt_counts, processing=processing), np.asarray(documents), terms
+    return weight_document_term_matrix(dt_counts, processing=processing), terms
+
+
+def test_dts():
+    documents = np.asarray(['It\'s a technologically advanced situation.',
+                            'I (Mary) don\'t like the system in this situation.',
+                            'I am technological.',
+                            '000 Technological greatness in a system is something.',
+                            'Yes, sir (no, sir?): That\'s the question.'])
+    chunks = [documents[0:2], documents[2:4], documents[4:5]]
+    parser_config = {'stemmer': 'porter2', 'lower': True, 'remove_stop_words': True,
+                     'ignore_chars': '''.,:;"'!?-/()[]{}0123456789'''}
+    result_1, result_2, result_3 = document_term_stream(chunks, parser_config=parser_config, processing='tfidf_l2',
+                                                        return_documents=True, verbose=True)
+    print(result_1.toarray(), "\n", result_2, "\n", result_3, "\n")
+    # Compare to document_term_cooccurrence(...), which fits the whole corpus at once.
+    dt_matrix, terms = document_term_cooccurrence(result_2, processing='tfidf_l2')
+    print("Equal to document_term_cooccurrence:", np.allclose(result_1.toarray(), np.asarray(dt_matrix)))
+    result_1, result_2 = document_term_stream(chunks, parser_config=parser_config, processing='count', n_features=16)
+    print(result_1.toarray(), "\n")
+    info(result_1)
+    info(result_2)
+
+
+class IncrementalVectorizer(object):
+    """Document-term matrix that grows when new documents are appended. Keeps the counts, the vocabulary and the
+    per-term statistics (document frequencies, global counts and log entropies), so that only new documents are
+    parsed with parse_text(...) and counted. New terms are appended to the vocabulary. The counts of every
+    add(...) are kept as a block and the blocks are stacked once when the matrix is requested, so adding does not
+    copy the existing counts. Global weights of the processing methods of document_term_cooccurrence(...) are
+    recomputed lazily when the matrix is requested, log entropies only for terms that occurred in the new documents."""
+
+    def __init__(self, parser_config=None, processing='tfidf_l2'):
+        assert processing in ('count', 'l2', 'tfidf_l2', 'log_l2'), "chosen processing method not implemented."
+        self.parser_config = parser_config if parser_config is not None else {}
+        self.processing = processing
+        self.analyzer = CountVectorizer(stop_words=None, lowercase=False).build_analyzer()
+        self.vocabulary = {}  # {term: column}, columns in order of first occurrence.
+        self.documents = []
+        self.count_blocks = []  # CSR count matrices of the added documents, with the vocabulary size at adding.
+        self.doc_freq = np.zeros(0, dtype=np.int64)
+        self.global_freq = np.zeros(0, dtype=np.float64)
+        self.entropy = np.zeros(0, dtype=np.float64)
+        self.changed = np.zeros(0, dtype=bool)  # Terms with outdated log entropy.
+        self.weighted = None  # Cached weighted matrix, None if outdated.
+
+    def add(self, documents, parsed=False):
+        """Parses and counts new raw documents (or already parsed documents if parsed=True) and appends them."""
+        corpus = np.asarray(documents) if parsed else parse_text(np.asarray(documents, dtype=object),
+                                                                 **self.parser_config)
+        indices = []
+        indptr = [0]
+        for doc in corpus:
+            indices += [self.vocabulary.setdefault(term, len(self.vocabulary)) for term in self.analyzer(doc)]
+            indptr.append(len(indices))
+        n_terms = len(self.vocabulary)
+        new_counts = sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(corpus), n_terms))
+        new_counts.sum_duplicates()
+        # Grow the statistics for new terms and update them with the new documents only.
+        n_new_terms = n_terms - len(self.doc_freq)
+        self.doc_freq = np.append(self.doc_freq, np.zeros(n_new_terms, dtype=np.int64))
+        self.global_freq = np.append(self.global_freq, np.zeros(n_new_terms))
+        self.entropy = np.append(self.entropy, np.zeros(n_new_terms))
+        self.changed = np.append(self.changed, np.zeros(n_new_terms, dtype=bool))
+        self.doc_freq += np.bincount(new_counts.indices, minlength=n_terms)
+        self.global_freq += np.bincount(new_counts.indices, weights=new_counts.data, minlength=n_terms)
+        self.changed[new_counts.indices] = True
+        self.count_blocks.append(new_counts)
+        self.documents += list(corpus)
+        self.weighted = None
+        return self
+
+    @property
+    def counts(self):
+        """CSR count matrix of all documents. Blocks added since the last request are stacked, with the columns of
+        older blocks padded to the current vocabulary."""
+        n_terms = len(self.vocabulary)
+        if len(self.count_blocks) != 1 or self.count_blocks[0].shape[1] != n_terms:
+            blocks = [sp.csr_matrix((block.data, block.indices, block.indptr), shape=(block.shape[0], n_terms))
+                      for block in self.count_blocks]
+            self.count_blocks = [sp.vstack(blocks, format='csr') if blocks else
+                                 sp.csr_matrix((0, n_terms), dtype=np.float64)]
+        return self.count_blocks[0]
+
+    def global_weights(self):
+        """Returns the global weight of every term for the processing method, or None for 'count' and 'l2'."""
+        n_docs = len(self.documents)
+        if self.processing == 'tfidf_l2':
+            # Same smoothed idf as TfidfVectorizer(smooth_idf=True), depends on all document frequencies and n docs.
+            return np.log((1 + n_docs) / (1 + self.doc_freq)) + 1
+        if self.processing == 'log_l2':
+            # Recompute the log entropy of the changed terms, p = count / global term count.
+            changed = np.flatnonzero(self.changed)
+            if len(changed) > 0:
+                changed_counts = self.counts[:, changed].tocsc()
+                p_values = changed_counts.data / np.repeat(self.global_freq[changed], np.diff(changed_counts.indptr))
+                self.entropy[changed] = np.add.reduceat(np.append(p_values * np.log(p_values + 1), 0),
+                                                        changed_counts.indptr[:-1])
+                self.changed[:] = False
+            return 1 + self.entropy / np.log(n_docs + 1)
+        return None
+
+    def transform(self):
+        """Returns the weighted CSR document-term matrix with columns in order of the vocabulary."""
+        if self.weighted is None:
+            weights = self.global_weights()
+            if self.processing == 'count':
+                self.weighted = self.counts.copy()
+            elif self.processing == 'l2':
+                self.weighted = Normalizer(copy=True, norm='l2').fit_transform(self.counts)
+            elif self.processing == 'tfidf_l2':
+                self.weighted = Normalizer(copy=True, norm='l2').fit_transform(self.counts.multiply(weights).tocsr())
+            else:
+                dt_log = self.counts.copy()
+                dt_log.data = self.counts.data * np.log(self.counts.data + 1) * weights[self.counts.indices]
+                self.weighted = Normalizer(copy=True, norm='l2').fit_transform(dt_log)
+        return self.weighted
+
+    def document_term_matrix(self, sparse=False):
+        """Returns the document-term matrix DataFrame and the terms like document_term_cooccurrence(...), with terms
+        sorted alphabetically."""
+        terms = np.asarray(list(self.vocabulary.keys()))
+        order = np.argsort(terms)
+        dt_matrix = self.transform()[:, order]
+        terms = terms[order].tolist()
+        if sparse:
+            # Fill value 0 like document_term_cooccurrence(...), else absent terms densify to NaN.
+            return pd.DataFrame.sparse.from_spmatrix(dt_matrix, index=self.documents, columns=terms).astype(
+                pd.SparseDtype(dt_matrix.dtype, 0)), terms
+        return pd.DataFrame(dt_matrix.toarray(), index=self.documents, columns=terms), terms
+
+
+def test_iv():
+    corpus = np.asarray(['it technolog advanc situat',
+                         "mari don't like situat",
+                         'technolog great',
+                         'yes sir sir that question'])
+    for processing in ['count', 'l2', 'tfidf_l2', 'log_l2']:
+        vectorizer = IncrementalVectorizer(processing=processing)
+        vectorizer.add(corpus[:2], parsed=True)
+        result_1, result_2 = vectorizer.document_term_matrix()
+        vectorizer.add(corpus[2:], parsed=True)  # Grows the vocabulary.
+        result_1, result_2 = vectorizer.document_term_matrix()
+        dt_matrix, terms = document_term_cooccurrence(corpus, processing=processing)
+        print(processing, "equal to document_term_cooccurrence:",
+              np.allclose(np.asarray(result_1), np.asarray(dt_matrix)), result_2 == list(terms))
+    print(result_1, "\n")
+    vectorizer = IncrementalVectorizer(parser_config={'stemmer': 'porter2'})
+    vectorizer.add(np.asarray(['It\'s a technologically advanced situation.']))
+    vectorizer.add(np.asarray(['Technological greatness.']))  # Only the new document is parsed.
+    result_1, result_2 = vectorizer.document_term_matrix(sparse=True)
+    print(result_1, "\n", result_2, "\n")
+    print("Sparse equal to dense:",
+          np.array_equal(np.asarray(result_1), np.asarray(vectorizer.document_term_matrix()[0])), "\n")
+    info(result_1)
+    info(result_2)
+
+
+def dtm_values(dt_matrix):
+    """Returns the values of a document-term matrix DataFrame as scipy CSR matrix if the DataFrame is sparse
+    (see document_term_cooccurrence(...)), else as array."""
+    if hasattr(dt_matrix, 'sparse'):  # The sparse accessor is only available for sparse DataFrames.
+        return dt_matrix.sparse.to_coo().tocsr()
+    return np.asarray(dt_matrix)
+
+
 def term_term_cooccurrence(dt_matrix, verbose=False):
     """Creates a sparse term-term cooccurrence dictionary from dot product of passed document-term matrix.
     # Indexes terms in corpus and returns both {index: term} and {term: index} to translate in both directions."""
@@ -341,23 +1772,16 @@ def term_term_cooccurrence(dt_matrix, verbose=False):
     # Index terms and create translation dictionaries.
     dict_ix_term = {i: terms[i] for i in range(len(terms))}
     dict_term_ix = {v: k for k, v in dict_ix_term.items()}
-    terms_ix = [dict_term_ix[term] for term in terms]
-    # Create term-term co-occurrence matrix as the dot product of the document-term matrix.
-    tt_matrix = np.asarray(dt_matrix).T.dot(np.asarray(dt_matrix))
-    tt_matrix = pd.DataFrame(tt_matrix, index=terms_ix, columns=terms_ix)
+    # Create sparse term-term co-occurrence matrix as the dot product of the document-term matrix.
+    dt_matrix = sp.csr_matrix(dtm_values(dt_matrix))
+    tt_matrix = dt_matrix.T.dot(dt_matrix).tocoo()
     # Convert term-term co-occurrence matrix to sparse term-term co-occurrence dictionary.
-    tt_dict = {i: {} for i in range(len(terms_ix))}
-    ctr = 0
-    for i in terms_ix:
-        for k in terms_ix:
-            if tt_matrix[i][k] != 0:
-                try:
-                    tt_dict[i][k] += float(tt_matrix[i][k])
-                except KeyError:
-                    tt_dict[i][k] = float(tt_matrix[i][k])
-        ctr += 1
-        if verbose and ctr % 300 == 0:
-            print("Building term-term cooccurrence dictionary:", ctr / len(terms_ix) * 100, "%", flush=True)
+    tt_dict = {i: {} for i in range(len(terms))}
+    for i, k, value in zip(tt_matrix.row.tolist(), tt_matrix.col.tolist(), tt_matrix.data.astype(float).tolist()):
+        if value != 0:
+            tt_dict[i][k] = value
+    if verbose:
+        print("Built term-term cooccurrence dictionary with", tt_matrix.nnz, "non-zero entries.")
     return tt_dict, dict_term_ix, dict_ix_term
 
 
@@ -378,6 +1802,189 @@ def test_ttc():
     info(result_3)
 
 
+def count_window_cooccurrence(documents, n_terms, window=10, weighting='harmonic'):
+    """Counts the co-occurrences of term indices within window positions in every document of the passed list of
+    term index arrays. Co-occurrences at distance d are weighted 1 / d ('harmonic') or 1 ('uniform'), both
+    directions are counted. Returns the summed co-occurrences of the chunk as COO arrays (rows, cols, values), so
+    memory scales with the distinct term pairs."""
+    rows = []
+    cols = []
+    values = []
+    for term_ix in documents:
+        for distance in range(1, min(window, len(term_ix) - 1) + 1):
+            weight = 1 / distance if weighting == 'harmonic' else 1.0
+            rows += [term_ix[:-distance], term_ix[distance:]]
+            cols += [term_ix[distance:], term_ix[:-distance]]
+            values.append(np.full(2 * (len(term_ix) - distance), weight))
+    if not values:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    # Sum duplicate pairs of the chunk, the CSR shape only allocates the row pointers.
+    chunk = sp.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(n_terms, n_terms)).tocoo()
+    return chunk.row, chunk.col, chunk.data
+
+
+def _count_window_cooccurrence(arguments):
+    # Unpacks the arguments for worker processes.
+    return count_window_cooccurrence(*arguments)
+
+
+def window_cooccurrence(corpus, terms=None, window=10, weighting='harmonic', chunk_size=1024, workers=1,
+                        verbose=False):
+    """Creates a sparse term-term cooccurrence dictionary by streaming a sliding window over the parsed documents,
+    in contrast to the document-level product of term_term_cooccurrence(...), which ignores word order.
+    Tokens are split like in document_term_cooccurrence(...). If terms (e.g. the columns of the document-term matrix)
+    are passed, only these are counted and indexed in their order, else all terms are indexed alphabetically.
+    Chunks of chunk_size documents are counted with count_window_cooccurrence(...) by workers processes (if the
+    'fork' start method is available) and merged into one sparse matrix per chunk. Forking a multi-threaded process
+    can deadlock, so the chunks are counted serially if other threads (e.g. of a StageGraph) are running.
+    Returns the same tt_dict, {term: index} and {index: term} as term_term_cooccurrence(...), which
+    train_vectors_glove(...) and train_vectors_ppmi(...) take."""
+    analyzer = CountVectorizer(stop_words=None, lowercase=False).build_analyzer()
+    if terms is None:
+        terms = np.unique([term for doc in corpus for term in analyzer(doc)]).tolist()
+    dict_ix_term = {i: term for i, term in enumerate(terms)}
+    dict_term_ix = {term: i for i, term in dict_ix_term.items()}
+    n_terms = len(terms)
+
+    def chunks():
+        # Term index arrays of chunks of documents, terms not in the vocabulary are dropped.
+        for start in range(0, len(corpus), chunk_size):
+            yield ([np.asarray([dict_term_ix[term] for term in analyzer(doc) if term in dict_term_ix], dtype=np.int64)
+                    for doc in corpus[start:start + chunk_size]], n_terms, window, weighting)
+
+    tt_matrix = sp.csr_matrix((n_terms, n_terms))
+    if workers > 1 and threading.active_count() > 1:
+        warnings.warn("window_cooccurrence(...) called from a multi-threaded process, counting serially.")
+        workers = 1
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        chunk_results = pool.imap(_count_window_cooccurrence, chunks())
+    else:
+        pool = None
+        chunk_results = map(_count_window_cooccurrence, chunks())
+    try:
+        ctr = 0
+        for rows, cols, values in chunk_results:
+            tt_matrix = tt_matrix + sp.csr_matrix((values, (rows, cols)), shape=(n_terms, n_terms))
+            ctr += 1
+            if verbose:
+                print("Counting window co-occurrences:", min(ctr * chunk_size, len(corpus)), "of", len(corpus),
+                      "documents.", end='\r')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    tt_matrix = tt_matrix.tocoo()
+    tt_dict = {i: {} for i in range(n_terms)}
+    for i, k, value in zip(tt_matrix.row.tolist(), tt_matrix.col.tolist(), tt_matrix.data.tolist()):
+        tt_dict[i][k] = value
+    if verbose:
+        print("Built term-term cooccurrence dictionary with", tt_matrix.nnz, "non-zero entries.")
+    return tt_dict, dict_term_ix, dict_ix_term
+
+
+def test_wc():
+    corpus = np.asarray(['it technolog advanc situat',
+                         "mari don't like situat",
+                         'technolog great',
+                         'yes sir sir that question'])
+    result_1, result_2, result_3 = window_cooccurrence(corpus, window=2, chunk_size=2, verbose=True)
+    print(result_1, "\n", result_2, "\n", result_3, "\n")
+    serial = window_cooccurrence(corpus, window=2, chunk_size=1, workers=1)[0]
+    pooled = window_cooccurrence(corpus, window=2, chunk_size=1, workers=2)[0]
+    print("Equal with 2 workers:", pooled == serial, pooled == result_1)
+    info(result_1)
+    info(result_2)
+    info(result_3)
+
+
+def corpus_statistics(corpus):
+    """Counts the statistics of a parsed corpus that determine the memory of the pipeline stages, with one pass of a
+    sparse count vectorizer: n documents, n terms, n non-zero document-term entries, the upper bound of non-zero
+    term-term co-occurrences (sum of squared unique terms per document) and the document frequency of every term."""
+    dt_counts = CountVectorizer(stop_words=None, lowercase=False, dtype='int32').fit_transform(corpus).tocsr()
+    unique_terms = np.diff(dt_counts.indptr)
+    return {'n_documents': dt_counts.shape[0], 'n_terms': dt_counts.shape[1], 'n_nonzeros': dt_counts.nnz,
+            'n_cooccurrences': int(min(np.sum(unique_terms.astype(np.int64) ** 2), dt_counts.shape[1] ** 2)),
+            'document_frequencies': np.bincount(dt_counts.indices, minlength=dt_counts.shape[1])}
+
+
+def plan_memory(statistics, n_constructs, memory_budget, n_components=300, similarity_dtype=np.float32,
+                verbose=False):
+    """Plans the representations of the pipeline for the passed memory budget in bytes from corpus_statistics(...).
+    Estimates the memory per stage (float64 values, int32 sparse indices) and chooses:
+    - sparse instead of dense document-term matrix, if the dense matrix takes more than a quarter of the budget,
+    - min_df and max_features for document_term_cooccurrence(...), if term-term co-occurrences or the term
+      similarity matrix of aggregate_item_similarity(...) would take more than half of the budget,
+    - block_size for CondensedSimilarity.from_vectors(...) and construct_similarity_from_vectors(...), so that a
+      tile of item similarities takes at most an eighth of the budget.
+    Returns a dictionary with the choices, the estimated bytes per stage and the expected peak."""
+    n_docs = statistics['n_documents']
+    doc_freq = np.sort(statistics['document_frequencies'])[::-1]
+    # Vocabulary pruning: keep the most frequent terms so that V x V float64 fits into half of the budget.
+    max_terms = int(np.sqrt(memory_budget / 2 / 8))
+    if len(doc_freq) > max_terms:
+        max_features = max_terms
+        min_df = int(doc_freq[max_terms])  # Terms in fewer documents than the term at the cut are dropped.
+        min_df = max(min_df + 1 if np.sum(doc_freq >= min_df) > max_terms else min_df, 1)
+    else:
+        max_features = None
+        min_df = 1
+    n_terms = min(len(doc_freq), max_terms)
+    n_nonzeros = int(statistics['n_nonzeros'] * np.sum(doc_freq[:n_terms]) / max(np.sum(doc_freq), 1))
+    n_cooccurrences = min(statistics['n_cooccurrences'], n_terms ** 2)
+    dtm_dense = n_docs * n_terms * 8
+    dtm_sparse = n_nonzeros * (8 + 4) + (n_docs + 1) * 4
+    sparse = dtm_dense > memory_budget / 4
+    dtm = dtm_sparse if sparse else dtm_dense
+    block_size = int(np.clip(memory_budget / 8 / 8 / max(n_docs, 1), 64, max(n_docs, 64)))
+    similarity_size = np.dtype(similarity_dtype).itemsize
+    # Memory of the live data per stage, the document-term matrix is kept throughout.
+    stages = {'document-term matrix': dtm,
+              'term-term co-occurrence': dtm + n_cooccurrences * (8 + 4 + 4) * 2,  # COO matrix and dictionary
+              'term similarity (aggregation)': dtm + n_terms ** 2 * 8,
+              'vectors': dtm + (n_docs + n_terms) * n_components * 8,
+              'item similarity tiles': dtm + n_docs * n_components * 8 + block_size * n_docs * 8,
+              'construct similarity': dtm + n_docs * n_components * 8 +
+                                      n_constructs * (n_constructs - 1) // 2 * similarity_size}
+    plan = {'sparse': bool(sparse), 'min_df': min_df, 'max_features': max_features, 'block_size': block_size,
+            'stages': stages, 'peak': max(stages.values())}
+    if verbose:
+        print("Memory plan for budget of", memory_budget / 1024 ** 3, "GiB:")
+        print("Document-term matrix:", "sparse" if sparse else "dense", "- vocabulary", n_terms, "of",
+              len(doc_freq), "terms (min_df =", min_df, ", max_features =", max_features, ") - block size",
+              block_size)
+        for stage, size in stages.items():
+            print("   ", stage, ":", round(size / 1024 ** 2, 1), "MiB")
+        print("Expected peak:", round(plan['peak'] / 1024 ** 2, 1), "MiB",
+              "(exceeds budget)" if plan['peak'] > memory_budget else "", "\n")
+    return plan
+
+
+def test_pm():
+    corpus = np.asarray(['it technolog advanc situat',
+                         "mari don't like situat",
+                         'technolog great',
+                         'yes sir sir that question'])
+    statistics = corpus_statistics(corpus)
+    print(statistics, "\n")
+    for memory_budget in [1024 ** 3, 800]:
+        result = plan_memory(statistics, n_constructs=3, memory_budget=memory_budget, n_components=2, verbose=True)
+        print(result, "\n")
+        dt_matrix, terms = document_term_cooccurrence(corpus, min_df=result['min_df'],
+                                                      max_features=result['max_features'], sparse=result['sparse'])
+        print(dt_matrix, "\n")
+    # The sparse plan gives the same matrix and item similarities as the dense one.
+    dt_matrix, terms = document_term_cooccurrence(corpus)
+    dt_matrix_sparse, terms = document_term_cooccurrence(corpus, sparse=True)
+    term_vectors = pd.DataFrame(np.random.RandomState(0).randn(len(terms), 3), index=terms)
+    print("Sparse equal to dense:", np.array_equal(np.asarray(dt_matrix_sparse), np.asarray(dt_matrix)),
+          np.allclose(aggregate_item_similarity(dt_matrix_sparse, term_vectors),
+                      aggregate_item_similarity(dt_matrix, term_vectors)), "\n")
+    info(result)
+
+
 def term_vectors_from_dict(vector_dict, target_terms, normalize=True, verbose=False):
     """Creates a matrix DataFrame with term vectors of the passed terms from the passed vector dictionary.
     Sets term vectors for out-of-vocabulary terms to 0."""
@@ -418,21 +2025,53 @@ def test_tvfd():
     info(result)
 
 
+class LSAModel(object):
+    """LSA (truncated SVD) of a document-term matrix DataFrame, decomposed once at max_components. The components of
+    a truncated SVD are ordered by singular value and every smaller rank is a prefix of them, so term and document
+    vectors of any rank <= max_components are served by slicing: a sweep over ranks costs one decomposition."""
+
+    def __init__(self, dt_matrix, max_components=300, random_state=None):
+        assert len(dt_matrix) >= max_components, \
+            "n docs must be >= n components. " + str(len(dt_matrix)) + " < " + str(max_components)
+        self.max_components = max_components
+        self.documents = dt_matrix.index.values
+        self.terms = dt_matrix.columns.values
+        self.t_svd = TruncatedSVD(n_components=max_components, algorithm='randomized', random_state=random_state)
+        self.doc_vectors_ = self.t_svd.fit_transform(dtm_values(dt_matrix))  # U * Sigma
+        self.components_ = self.t_svd.components_  # V^T, ranks x terms
+
+    def _rank(self, n_components):
+        n_components = self.max_components if n_components is None else n_components
+        assert n_components <= self.max_components, "n components must be <= max_components of the model."
+        return n_components
+
+    def vector_dict(self, n_components=None):
+        """Returns the term vectors of the rank as dictionary {term: vector}, like train_vectors_lsa(...)."""
+        n_components = self._rank(n_components)
+        return pd.DataFrame(self.components_[:n_components], columns=self.terms).to_dict(orient='list')
+
+    def term_vectors(self, n_components=None):
+        """Returns the term vectors of the rank as DataFrame (terms x components)."""
+        return pd.DataFrame(self.components_[:self._rank(n_components)].T, index=self.terms)
+
+    def doc_vectors(self, n_components=None):
+        """Returns the document vectors of the rank as DataFrame (documents x components)."""
+        return pd.DataFrame(self.doc_vectors_[:, :self._rank(n_components)], index=self.documents)
+
+    def transform(self, dt_matrix, n_components=None):
+        """Projects new documents (document-term matrix DataFrame over the same terms) to document vectors of the
+        rank."""
+        vectors = sp.csr_matrix(dtm_values(dt_matrix)).dot(self.components_[:self._rank(n_components)].T)
+        return pd.DataFrame(vectors, index=dt_matrix.index.values)
+
+
 def train_vectors_lsa(dt_matrix, n_components=300, return_doc_vectors=False):
-    """Train term and item vectors with SVD a.k.a. LSA. Both term and document vectors are naturally normalized."""
+    """Train term and item vectors with SVD a.k.a. LSA. Both term and document vectors are naturally normalized.
+    For several ranks use one LSAModel instead."""
     # Implementation checked 28 June.
-    assert len(dt_matrix) >= n_components, \
-        "n docs must be >= n components. " + str(len(dt_matrix)) + " < " + str(n_components)
-    # Train LSA and get document vectors.
-    documents = dt_matrix.index.values
-    terms = dt_matrix.columns.values
-    t_svd = TruncatedSVD(n_components=n_components, algorithm='randomized')
-    doc_vectors = t_svd.fit_transform(np.asarray(dt_matrix))
-    doc_vectors = pd.DataFrame(doc_vectors, index=documents)
-    # Get term vectors and pack them into a dictionary.
-    source_term_vectors = t_svd.components_
-    source_term_vectors = pd.DataFrame(source_term_vectors, columns=terms)
-    vector_dict = source_term_vectors.to_dict(orient='list')
+    lsa_model = LSAModel(dt_matrix, max_components=n_components)
+    vector_dict = lsa_model.vector_dict()
+    doc_vectors = lsa_model.doc_vectors()
     if return_doc_vectors:
         return vector_dict, doc_vectors
     else:
@@ -456,15 +2095,24 @@ def test_ttvlsa():
     result_1, result_2 = train_vectors_lsa(dt_matrix, n_components=n_components,
                                            return_doc_vectors=return_doc_vectors)
     print(result_1, "\n", result_2, "\n")
+    # Smaller ranks are prefixes of one decomposition.
+    lsa_model = LSAModel(dt_matrix, max_components=n_components, random_state=0)
+    print(lsa_model.doc_vectors(2), "\n", lsa_model.transform(dt_matrix.iloc[:2], 2), "\n",
+          lsa_model.vector_dict(2)['technolog'], "\n")
     info(result_1)
     info(result_2)
 
 
-def load_term_vectors_glove(file_name, target_terms, new_reduce_dict=False, verbose=False):
+def load_term_vectors_glove(file_name, target_terms, new_reduce_dict=False, parser_config=None, verbose=False):
     """Loads pre-trained GloVe term vectors from file. If no HDFStore is found, creates a new HDFStore with all
     terms starting with a letter of the standard alphabet. This allows for the use of files larger than RAM.
     If option new_reduce_dict=True, load full dictionary and
-    reduce it to the passed target_terms, save reduced dict to .npy file."""
+    reduce it to the passed target_terms, save reduced dict to .npy file.
+    If the parser_config of the (stemmed) target terms is passed, the vectors are looked up in the stem-keyed index
+    of load_stem_vector_index(...) instead, so stemmed terms are found."""
+    if parser_config is not None:
+        stem_terms_ix, stem_vectors = load_stem_vector_index(file_name, parser_config, verbose=verbose)
+        return {term: np.asarray(stem_vectors[stem_terms_ix[term]]) for term in target_terms if term in stem_terms_ix}
     file_name_hdf = file_name[:-4] + '.h5'
     if not new_reduce_dict:
         vector_dict = np.load(file_name).item()
@@ -577,6 +2225,87 @@ def test_ltvg():
     gc.collect()
 
 
+def stem_terms(terms, parser_config):
+    """Applies a parser configuration of parse_text(...) to single terms, e.g. the vocabulary of pre-trained vectors.
+    Returns the list of parsed terms, with '' for terms that are removed or split into several terms by the parser."""
+    stemmer = {'porter2': stem_porter2, 'paicehusk': stem_paicehusk}.get(parser_config['stemmer'])
+    ignore_table = {ord(c): ' ' for c in parser_config['ignore_chars']}
+    parsed_terms = []
+    for term in terms:
+        words = str(term).translate(ignore_table).split()
+        if len(words) != 1:
+            parsed_terms.append('')
+            continue
+        word = words[0].lower() if parser_config['lower'] else words[0]
+        if parser_config['remove_stop_words'] and word in stop_words.ENGLISH_STOP_WORDS:
+            parsed_terms.append('')
+            continue
+        if stemmer is not None:
+            try:
+                word = stemmer(word)
+            except ValueError:
+                pass  # ValueError occurs when stemming certain words, see parse_text(...).
+        parsed_terms.append(word)
+    return parsed_terms
+
+
+def load_stem_vector_index(file_name, parser_config, chunk_size=64 * 1024, verbose=False):
+    """Loads the stem-keyed index of a pre-trained GloVe vector file for the passed parser_config of parse_text(...).
+    If no index is found, it is built in one pass over the vector file: all surface forms are parsed with
+    stem_terms(...) and the vectors of forms with the same stem are aggregated to a frequency-weighted mean.
+    GloVe files hold no counts but are sorted by descending frequency, so frequencies are estimated from the rank
+    with Zipf's law (weight 1 / rank). The index is saved as two .npy files named by a hash of the parser_config.
+    Returns a dictionary {stem: row} and the memory-mapped float32 matrix of stem vectors."""
+    config_hash = hashlib.sha1(json.dumps(parser_config, sort_keys=True).encode()).hexdigest()[:10]
+    file_name_index = file_name[:-4] + '_stems_' + config_hash
+    if not os.path.isfile(file_name_index + '_vectors.npy'):
+        if verbose:
+            print("No stem vector index found. Creating new index from full vector file...")
+        vector_sums = None
+        rank = 0
+        for chunk in pd.read_table(file_name, chunksize=chunk_size, sep=' ', index_col=0, header=None,
+                                   quoting=csv.QUOTE_NONE, keep_default_na=False, na_filter=False):
+            weights = 1 / np.arange(rank + 1, rank + len(chunk) + 1)
+            rank += len(chunk)
+            stems = np.asarray(stem_terms(chunk.index.values, parser_config))
+            keep = stems != ''
+            # Sum weighted vectors and weights per stem, then add them to the sums of the previous chunks.
+            chunk_sums = pd.DataFrame(np.asarray(chunk, dtype=np.float64)[keep] * weights[keep][:, None])
+            chunk_sums['weight'] = weights[keep]
+            chunk_sums = chunk_sums.groupby(stems[keep]).sum()
+            vector_sums = chunk_sums if vector_sums is None else vector_sums.add(chunk_sums, fill_value=0)
+            if verbose:
+                print("Indexed", rank, "pre-trained vectors,", len(vector_sums), "stems.", end='\r', flush=True)
+        stem_vectors = np.asarray(vector_sums.drop(columns='weight')) / np.asarray(vector_sums['weight'])[:, None]
+        np.save(file_name_index + '_terms.npy', np.asarray(vector_sums.index.values, dtype=str))
+        np.save(file_name_index + '_vectors.npy', stem_vectors.astype(np.float32))
+        if verbose:
+            print("Saved stem vector index with", len(stem_vectors), "stems to", file_name_index)
+    stems = np.load(file_name_index + '_terms.npy')
+    stem_terms_ix = {stem: ix for ix, stem in enumerate(stems.tolist())}
+    stem_vectors = np.load(file_name_index + '_vectors.npy', mmap_mode='r')
+    return stem_terms_ix, stem_vectors
+
+
+def test_lsvi():
+    with open('test_vectors.txt', 'w') as file:
+        file.write('the 0.1 0.2 0.3\n'
+                   'technology 0.7 -0.9 -0.2\n'
+                   'situation 0.2 0.4 -0.1\n'
+                   'technological 0.6 -0.9 0.0\n'
+                   'situations 0.3 0.6 0.8\n'
+                   'null 0.5 0.5 0.5\n')
+    parser_config = {'stemmer': 'porter2', 'lower': True, 'remove_stop_words': True,
+                     'ignore_chars': '''.,:;"'!?_-/()[]{}&%0123456789'''}
+    verbose = True
+    result_1, result_2 = load_stem_vector_index('test_vectors.txt', parser_config, chunk_size=2, verbose=verbose)
+    print(result_1, "\n", np.asarray(result_2), "\n")
+    target_terms = ['technolog', 'situat', 'null', 'advanc']
+    result = load_term_vectors_glove('test_vectors.txt', target_terms, parser_config=parser_config, verbose=verbose)
+    print(result, "\n")
+    info(result)
+
+
 def train_vectors_glove(tt_dict, n_components=300, alpha=0.75, x_max=100.0, step_size=0.05, n_epochs=25,
                         batch_size=64, workers=2, verbose=False):
     """Trains vector dictionary from the passed term-term dictionary with the passed hyperparameters.
@@ -625,21 +2354,155 @@ def test_tvg():
     info(result)
 
 
+def train_vectors_ppmi(tt_dict, n_components=300, shift=1.0, context_smoothing=0.75, eigenvalue_weighting=0.5,
+                       verbose=False):
+    """Trains term vectors in closed form from the passed term-term dictionary as fast and deterministic alternative
+    to train_vectors_glove(...): the co-occurrences are turned into a sparse shifted positive pointwise mutual
+    information matrix max(PMI - log(shift), 0), with context counts smoothed by the exponent context_smoothing, and
+    factorized with randomized truncated SVD. Term vectors are U * S^eigenvalue_weighting (Levy et al., 2015).
+    Self co-occurrences on the diagonal are ignored. Returns the vector dictionary {term index: vector} like
+    train_vectors_glove(...)."""
+    rows = []
+    cols = []
+    data = []
+    for i, row in tt_dict.items():
+        for k, value in row.items():
+            if i != k:
+                rows.append(i)
+                cols.append(k)
+                data.append(value)
+    n_terms = max(tt_dict.keys()) + 1
+    cooccurrence = sp.csr_matrix((np.asarray(data, dtype=np.float64), (rows, cols)), shape=(n_terms, n_terms))
+    # PMI of the non-zero co-occurrences with smoothed context probabilities.
+    term_freq = np.asarray(cooccurrence.sum(axis=1)).ravel()
+    context_freq = np.asarray(cooccurrence.sum(axis=0)).ravel() ** context_smoothing
+    coo = cooccurrence.tocoo()
+    # P(w, c) / (P(w) * P(c)) with P(w, c) = x / total, P(w) = term freq / total, P(c) = context freq / sum.
+    pmi = np.log(coo.data * np.sum(context_freq) / (term_freq[coo.row] * context_freq[coo.col])) - np.log(shift)
+    ppmi = sp.csr_matrix((np.maximum(pmi, 0), (coo.row, coo.col)), shape=(n_terms, n_terms))
+    ppmi.eliminate_zeros()
+    if verbose:
+        print("PPMI matrix with", ppmi.nnz, "non-zero entries of", coo.nnz, "co-occurrences.")
+    # Randomized truncated SVD with fixed seed.
+    n_components = min(n_components, n_terms - 1)
+    t_svd = TruncatedSVD(n_components=n_components, algorithm='randomized', random_state=0)
+    vectors = t_svd.fit_transform(ppmi)  # U * S
+    singular_values = t_svd.singular_values_
+    vectors = vectors * np.where(singular_values > 0, singular_values, 1) ** (eigenvalue_weighting - 1)
+    vector_dict = {ix: list(vectors[ix]) for ix in tt_dict.keys()}
+    return vector_dict
+
+
+def test_tvp():
+    tt_dict = {0: {0: 1, 2: 1, 5: 1, 6: 1}, 1: {1: 1, 6: 1}, 2: {0: 1, 2: 1, 5: 1, 6: 1},
+               3: {3: 1, 4: 2, 7: 1, 8: 1}, 4: {3: 2, 4: 4, 7: 2, 8: 2}, 5: {0: 1, 2: 1, 5: 1, 6: 1},
+               6: {0: 1, 1: 1, 2: 1, 5: 1, 6: 2}, 7: {3: 1, 4: 2, 7: 1, 8: 1}, 8: {3: 1, 4: 2, 7: 1, 8: 1}}
+    n_components = 4
+    verbose = True
+    result = train_vectors_ppmi(tt_dict, n_components=n_components, verbose=verbose)
+    print(result, "\n")
+    print("Deterministic:", result == train_vectors_ppmi(tt_dict, n_components=n_components), "\n")
+    info(result)
+
+
+class QuantizedVectors(object):
+    """Quantized matrix of (normalized) term or item vectors. Dot product similarities are computed directly on the
+    codes, which needs 4-8x less memory and bandwidth than float64 vectors.
+    method='int8': symmetric scalar quantization, every vector is scaled by its maximum absolute value to int8 codes.
+    Products of codes are exact in float32, so similarities are only affected by the rounding of the codes.
+    method='pq': product quantization, the dimensions are split into n_subspaces and every sub-vector is replaced by the
+    index of the nearest of n_centroids k-means centroids (one byte per subspace). Similarities are looked up in
+    tables of centroid inner products per subspace."""
+
+    def __init__(self, vectors, method='int8', n_subspaces=50, n_centroids=256, random_state=0):
+        self.index = vectors.index.values if isinstance(vectors, pd.DataFrame) else np.arange(len(vectors))
+        self.method = method
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if method == 'int8':
+            self.scales = np.max(np.abs(vectors), axis=1) / 127
+            self.codes = np.round(vectors / np.where(self.scales > 0, self.scales, 1)[:, None]).astype(np.int8)
+        elif method == 'pq':
+            self.subspaces = np.array_split(np.arange(vectors.shape[1]), n_subspaces)
+            self.codebooks = []
+            self.codes = np.zeros([len(vectors), len(self.subspaces)], dtype=np.uint8)
+            for m, dims in enumerate(self.subspaces):
+                k_means = KMeans(n_clusters=min(n_centroids, 256, len(vectors)), n_init=1, random_state=random_state)
+                self.codes[:, m] = k_means.fit_predict(vectors[:, dims])
+                self.codebooks.append(k_means.cluster_centers_.astype(np.float32))
+            # Inner products between all centroids of a subspace.
+            self.tables = [codebook.dot(codebook.T) for codebook in self.codebooks]
+        else:
+            assert False, "chosen quantization method not implemented."
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        """Returns the quantized vectors of the passed rows (slice or index array), sharing the codebooks."""
+        subset = object.__new__(QuantizedVectors)
+        subset.__dict__.update(self.__dict__)
+        subset.index = self.index[key]
+        subset.codes = self.codes[key]
+        if self.method == 'int8':
+            subset.scales = self.scales[key]
+        return subset
+
+    @property
+    def nbytes(self):
+        """Memory of the codes and scales or codebooks in bytes."""
+        if self.method == 'int8':
+            return self.codes.nbytes + self.scales.nbytes
+        return self.codes.nbytes + sum(codebook.nbytes + table.nbytes
+                                       for codebook, table in zip(self.codebooks, self.tables))
+
+    def similarity(self, other):
+        """Returns the matrix of dot products between these and the other quantized vectors, computed on the codes."""
+        if self.method == 'int8':
+            return self.codes.astype(np.float32).dot(other.codes.astype(np.float32).T) * \
+                   np.outer(self.scales, other.scales)
+        similarity = np.zeros([len(self), len(other)])
+        for m, table in enumerate(self.tables):
+            similarity += table[self.codes[:, m][:, None], other.codes[:, m][None, :]]
+        return similarity
+
+    def decode(self):
+        """Returns the approximate float vectors as DataFrame."""
+        if self.method == 'int8':
+            vectors = self.codes * self.scales[:, None]
+        else:
+            vectors = np.hstack([codebook[self.codes[:, m]] for m, codebook in enumerate(self.codebooks)])
+        return pd.DataFrame(vectors, index=self.index)
+
+
+def test_qv():
+    vectors = pd.DataFrame(Normalizer(norm='l2').fit_transform([[0.2, 0.4, -0.1, 0.3],
+                                                                [0.7, -0.9, -0.2, 0.1],
+                                                                [0.6, -0.9, 0, 0.2],
+                                                                [-0.6, -0.5, -0.4, 0.8],
+                                                                [0.3, 0.6, 0.8, -0.1]]),
+                           index=['it', 'technolog', 'advanc', 'green', 'lime'])
+    print(np.asarray(vectors).dot(np.asarray(vectors).T), "\n")
+    for method in ['int8', 'pq']:
+        result = QuantizedVectors(vectors, method=method, n_subspaces=2, n_centroids=4)
+        print(method, result.nbytes, "bytes\n", result.similarity(result), "\n", result.decode(), "\n")
+        print(result[1:3].similarity(result), "\n")
+    info(result)
+
+
 def vector_average(dt_matrix, term_vectors, weighting=False, normalize=True):
     """Compute the vector centroid of term vectors to form item vectors. If weighting=True,
     weighted vector centroid is computed with the entries of the passed dt_matrix."""
     # Implementation checked 13 July.
-    doc_vectors = pd.DataFrame(np.zeros([len(dt_matrix), len(term_vectors.iloc[0])]), index=dt_matrix.index.values)
-    for i in range(len(dt_matrix)):
-        # Get the vectors of the terms in the current document.
-        doc_term_vectors = term_vectors.loc[dt_matrix.columns.values[dt_matrix.iloc[i] > 0]]
-        if weighting:
-            # Weight the term vectors.
-            weights = dt_matrix.iloc[i][dt_matrix.iloc[i] > 0]
-            for w_ix in weights.index.values:
-                doc_term_vectors.loc[w_ix] = np.asarray(doc_term_vectors.loc[w_ix]) * float(weights.loc[w_ix])
-        # Take the simple mean of the term vectors to form a document vector.
-        doc_vectors.iloc[i] = np.mean(np.asarray(doc_term_vectors), axis=0)
+    # Vectors of the terms in the documents, in the order of the document-term matrix columns.
+    doc_term_vectors = np.asarray(term_vectors.loc[dt_matrix.columns.values])
+    dt_values = sp.csr_matrix(dtm_values(dt_matrix))
+    dt_present = (dt_values > 0).astype(np.float64)
+    # Sum the (weighted) term vectors of every document and take the simple mean to form a document vector.
+    # Documents without terms get nan vectors.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        doc_vectors = (dt_values.multiply(dt_present) if weighting else dt_present).dot(doc_term_vectors) / \
+                      np.asarray(dt_present.sum(axis=1))
+    doc_vectors = pd.DataFrame(doc_vectors, index=dt_matrix.index.values)
     if normalize:
         # TODO: some nan values in the doc-vectors.
         doc_vectors = pd.DataFrame(Normalizer(norm='l2', copy=True).fit_transform(np.nan_to_num(doc_vectors)),
@@ -683,10 +2546,49 @@ def test_va():
     info(result)
 
 
-def aggregate_item_similarity(dt_matrix, term_vectors, n_similarities=2, verbose=False):
+def candidate_item_pairs(dt_matrix, term_vectors=None, n_neighbours=0, block_size=4096, verbose=False):
+    """Blocking for item pair comparisons with an inverted index over terms (like word_dict of the LSA class in
+    playground_LSA.py): only pairs of items that share at least one term are candidates. If term vectors (rows in
+    the order of the document-term matrix columns, e.g. from term_vectors_from_dict(...)) and n_neighbours are
+    passed, the terms of every item are expanded with the n_neighbours most similar terms of each term, so that items
+    sharing near terms are candidates as well. The join over the index is computed as sparse matrix product.
+    Returns the positions (rows, cols) with rows < cols of the candidate item pairs."""
+    presence = (sp.csr_matrix(dtm_values(dt_matrix)) != 0).astype(np.float64)
+    expanded = presence
+    if term_vectors is not None and n_neighbours > 0:
+        vectors = np.nan_to_num(np.asarray(term_vectors, dtype=np.float64))  # OOV terms have nan vectors.
+        n_neighbours = min(n_neighbours, len(vectors) - 1)
+        neighbours = []
+        for start in range(0, len(vectors), block_size):
+            similarity_block = vectors[start:start + block_size].dot(vectors.T)
+            similarity_block[np.arange(len(similarity_block)), np.arange(start, start + len(similarity_block))] = \
+                -np.inf  # A term is not its own neighbour.
+            neighbours.append(np.argpartition(-similarity_block, n_neighbours - 1, axis=1)[:, :n_neighbours])
+        neighbours = np.concatenate(neighbours).ravel()
+        # Term-neighbour matrix (terms x terms), expanded item terms are the union of terms and their neighbours.
+        neighbour_matrix = sp.csr_matrix((np.ones(len(neighbours)), neighbours,
+                                          np.arange(0, len(neighbours) + 1, n_neighbours)),
+                                         shape=(len(vectors), len(vectors)))
+        expanded = ((presence + presence.dot(neighbour_matrix)) != 0).astype(np.float64)
+    shared = expanded.dot(presence.T)
+    shared = sp.triu(shared + shared.T, k=1).tocoo()
+    if verbose:
+        n_pairs = presence.shape[0] * (presence.shape[0] - 1) // 2
+        print("Blocking:", shared.nnz, "candidate item pairs of", n_pairs, "-", round((1 - shared.nnz / max(n_pairs, 1))
+                                                                                      * 100, 2), "% pruned.")
+    return shared.row, shared.col
+
+
+def aggregate_item_similarity(dt_matrix, term_vectors, n_similarities=2, candidates=None, default_similarity=0.0,
+                              unique=True, verbose=False):
     """Computes item similarities from term vectors. To aggregate term cosine similarity to item
     similarity, the average similarity of the two most similar terms between each item pair is taken. This is
-    the same concept as established by (Larsen & Bong, 2016) for aggregating construct similarity."""
+    the same concept as established by (Larsen & Bong, 2016) for aggregating construct similarity.
+    If candidates (rows, cols) from candidate_item_pairs(...) are passed, only these item pairs are compared and all
+    other pairs get default_similarity.
+    If unique=True, similarities are aggregated once per pair of unique document-term rows and mapped back to the
+    items, pairs of identical items are aggregated like any other pair. A sparse document-term matrix
+    (document_term_cooccurrence(..., sparse=True)) is never densified."""
     # Implementation checked 28 June.
     # Compute cosine term similarity as matrix.
     term_similarity = np.asarray(np.asmatrix(term_vectors) * np.asmatrix(term_vectors).T)
@@ -696,42 +2598,74 @@ def aggregate_item_similarity(dt_matrix, term_vectors, n_similarities=2, verbose
 
     # Aggregate item similarity from term similarities.
     items = dt_matrix.index.values
-    dt_matrix = np.asarray(dt_matrix)
-    item_similarity = np.zeros([len(dt_matrix), len(dt_matrix)])
-    n_fields = (len(item_similarity) ** 2 - len(item_similarity)) / 2  # n fields in upper triu for print
+    dt_matrix = dtm_values(dt_matrix)
+    start_time = time.time()
+    if sp.issparse(dt_matrix):
+        dt_matrix.eliminate_zeros()
+        dt_matrix.sort_indices()
+        if unique:
+            # Rows are identical if their term indices and values are.
+            row_keys = np.asarray([dt_matrix.indices[start:end].tobytes() + dt_matrix.data[start:end].tobytes()
+                                   for start, end in zip(dt_matrix.indptr[:-1], dt_matrix.indptr[1:])], dtype=object)
+            item_index = unique_index(row_keys)[1]
+            dt_matrix = dt_matrix[np.unique(item_index, return_index=True)[1]]
+        else:
+            item_index = np.arange(dt_matrix.shape[0])
+        term_indices = np.split(dt_matrix.indices, dt_matrix.indptr[1:-1])
+    else:
+        if unique:
+            dt_matrix, item_index = unique_index(dt_matrix, axis=0)
+        else:
+            item_index = np.arange(len(dt_matrix))
+        term_indices = [np.where(row != 0)[0] for row in dt_matrix]
+    n_unique = len(term_indices)
+    # Pairs of identical items are on the diagonal of the unique items.
+    duplicated = np.bincount(item_index, minlength=n_unique) > 1
+    item_similarity = np.full([n_unique, n_unique], default_similarity, dtype=np.float64)
+    if candidates is None:
+        pairs = ((ind_1, ind_2) for ind_1 in range(n_unique)
+                 for ind_2 in range(ind_1 + 1 - duplicated[ind_1], n_unique))
+        n_fields = (len(item_similarity) ** 2 - len(item_similarity)) / 2  # n fields in upper triu for print
+    else:
+        rows, cols = item_index[np.asarray(candidates[0])], item_index[np.asarray(candidates[1])]
+        pairs = np.unique(np.stack([np.minimum(rows, cols), np.maximum(rows, cols)], axis=1), axis=0)
+        n_fields = len(pairs)
     ctr = 0  # counter for print
     ctr_one = 0  # counter for item-relationships with only one non-zero term similarity (OOV words)
     ctr_none = 0  # counter for item-relationships with no non-zero term similarity (OOV words)
-    for ind_1 in range(len(dt_matrix) - 1):  # rows
-        for ind_2 in range(ind_1 + 1, len(dt_matrix)):  # columns
-            # Implementation checked manually, excluding exception handling.
-            # Get term similarities between the items.
-            term_indices_1 = np.where(dt_matrix[ind_1] != 0)[0]
-            term_indices_2 = np.where(dt_matrix[ind_2] != 0)[0]
-            term_indices_all = []
-            for i1 in term_indices_1:
-                term_indices_all += [(i1, i2) for i2 in term_indices_2]
-            term_sim_sub = [term_similarity[i] for i in term_indices_all]
-            try:  # Deals with zero vectors caused by out of vocabulary words.
-                # Compute item similarity from average of n highest term similarities.
-                sim_avg = np.average(np.sort(term_sim_sub, axis=None)[-np.max([n_similarities, 2]):])
-            except ValueError:
-                if np.count_nonzero(term_sim_sub) != 0:
-                    sim_avg = np.sort(term_sim_sub, axis=None)[-1]
-                    ctr_one += 1
-                else:
-                    sim_avg = 0
-                    ctr_none += 1
-            item_similarity[ind_1, ind_2] = sim_avg
-            ctr += 1
-            if verbose and ctr % 100000 == 0:
-                print("Aggregating term to item similarity...", ctr / n_fields * 100, "%", end='\r')
+    for ind_1, ind_2 in pairs:  # rows, columns
+        # Implementation checked manually, excluding exception handling.
+        # Get term similarities between the items.
+        term_indices_1 = term_indices[ind_1]
+        term_indices_2 = term_indices[ind_2]
+        term_indices_all = []
+        for i1 in term_indices_1:
+            term_indices_all += [(i1, i2) for i2 in term_indices_2]
+        term_sim_sub = [term_similarity[i] for i in term_indices_all]
+        try:  # Deals with zero vectors caused by out of vocabulary words.
+            # Compute item similarity from average of n highest term similarities.
+            sim_avg = np.average(np.sort(term_sim_sub, axis=None)[-np.max([n_similarities, 2]):])
+        except ValueError:
+            if np.count_nonzero(term_sim_sub) != 0:
+                sim_avg = np.sort(term_sim_sub, axis=None)[-1]
+                ctr_one += 1
+            else:
+                sim_avg = 0
+                ctr_none += 1
+        item_similarity[min(ind_1, ind_2), max(ind_1, ind_2)] = sim_avg
+        ctr += 1
+        if verbose and ctr % 100000 == 0:
+            print("Aggregating term to item similarity...", ctr / n_fields * 100, "%", end='\r')
     if verbose:
         print("Number of item-relationships with only one non-zero term similarity due to OOV:", ctr_one)
         print("Number of item-relationships with no non-zero term similarity due to OOV:", ctr_none, "\n")
-    # Mirror to lower triangular and fill diagonal of the matrix.
-    item_similarity = np.add(item_similarity, item_similarity.T)
+    # Mirror to lower triangular, map back to the items and fill diagonal of the matrix.
+    upper = np.triu(item_similarity, 1)
+    item_similarity = np.add(upper, upper.T) + np.diag(np.diag(item_similarity))
+    item_similarity = item_similarity[np.ix_(item_index, item_index)]
     np.fill_diagonal(item_similarity, 1)
+    if verbose and unique:
+        deduplication_report('items', len(items), n_unique, time.time() - start_time)
     item_similarity = pd.DataFrame(item_similarity, index=items, columns=items)
     return item_similarity
 
@@ -769,22 +2703,53 @@ def test_ais():
     verbose = True
     result = aggregate_item_similarity(dt_matrix, term_vectors, n_similarities=n_similarities, verbose=verbose)
     print(result, "\n")
+    # Duplicate items are aggregated once.
+    dt_matrix_dup = pd.concat([dt_matrix, dt_matrix.iloc[[2, 0]]])
+    print(aggregate_item_similarity(dt_matrix_dup, term_vectors, n_similarities=n_similarities, verbose=verbose), "\n")
+    # Only compare item pairs sharing terms or neighbour terms.
+    candidates = candidate_item_pairs(dt_matrix, term_vectors=term_vectors, n_neighbours=1, verbose=verbose)
+    print(aggregate_item_similarity(dt_matrix, term_vectors, n_similarities=n_similarities, candidates=candidates,
+                                    verbose=verbose), "\n")
     info(result)
 
 
 def aggregate_construct_similarity(constituent_similarity, gold_items, variable_ids, construct_authors=None,
-                                   n_similarities=2, verbose=False):
+                                   n_similarities=2, condensed=False, dtype=None, aggregation='top_n',
+                                   item_vectors=None, weights=None, normalize=True, verbose=False):
     """Computes construct similarities from item vectors. To aggregate constituent
     cosine similarity to construct similarity, the average similarity of the two most similar constituents
     between each construct pair is taken, as established by (Larsen & Bong, 2016) with items.
     Creates upper triangular with zero diagonal for efficiency.
+    The constituent similarity can be passed as DataFrame or CondensedSimilarity. If condensed=True, returns a
+    CondensedSimilarity with the passed dtype (float32 if None) instead of the upper triangular float64 DataFrame,
+    which is computed in float64 unless another dtype is passed.
+    If aggregation='centroid', constructs are compared by the cosine similarity of their centroids from
+    construct_centroids(...) of the item vectors (rows in the order of gold_items, optionally weighted by weights and
+    normalized) instead, constituent_similarity is not used and can be None.
     Some legacy support for author aggregation, but better to use centroids and cosine similarity."""
     # Implementation checked 4 July.
-    authors = constituent_similarity.index.values
-    constituent_similarity = np.asarray(constituent_similarity)
+    if dtype is None:
+        dtype = np.float32 if condensed else np.float64
+    if aggregation == 'centroid':
+        assert item_vectors is not None, "centroid aggregation needs the item vectors."
+        construct_similarity = construct_similarity_from_vectors(item_vectors, gold_items['VariableId'], variable_ids,
+                                                                 aggregation='centroid', weights=weights,
+                                                                 normalize=normalize, dtype=dtype, verbose=verbose)
+        if condensed:
+            return construct_similarity
+        variable_ids = construct_similarity.ids
+        construct_similarity = np.triu(np.asarray(construct_similarity.to_square(diagonal=0), dtype=np.float64))
+        return pd.DataFrame(construct_similarity, index=variable_ids, columns=variable_ids)
+    assert aggregation == 'top_n', "chosen aggregation not implemented."
+    if isinstance(constituent_similarity, CondensedSimilarity):
+        authors = constituent_similarity.ids
+    else:
+        authors = constituent_similarity.index.values
+        constituent_similarity = np.asarray(constituent_similarity)
     variable_ids = np.sort(variable_ids)
-    construct_similarity = np.zeros([len(variable_ids), len(variable_ids)])
-    n_fields = (len(construct_similarity) ** 2 - len(construct_similarity)) / 2  # n fields in upper triu for print
+    construct_similarity = CondensedSimilarity(variable_ids, np.zeros(len(variable_ids) * (len(variable_ids) - 1) // 2),
+                                               dtype=dtype)
+    n_fields = len(construct_similarity.values)  # n fields in upper triu for print
     ctr = 0  # counter for print
     for ind_1 in range(len(variable_ids) - 1):  # rows
         for ind_2 in range(ind_1 + 1, len(variable_ids)):  # columns
@@ -795,26 +2760,36 @@ def aggregate_construct_similarity(constituent_similarity, gold_items, variable_
                     constit_ix_2 = np.where(authors == construct_authors[gold2funk[variable_ids[ind_2]]])[0]
                 except KeyError:
                     # Set construct similarity to 0 for constructs with unknown author.
-                    construct_similarity[ind_1, ind_2] = 0
+                    construct_similarity.values[construct_similarity.pair_index(ind_1, ind_2)] = 0
                     break
             # Following implementation checked manually.
             else:
                 # Get item similarity indices between the constructs.
                 constit_ix_1 = np.where(gold_items['VariableId'] == variable_ids[ind_1])[0]
                 constit_ix_2 = np.where(gold_items['VariableId'] == variable_ids[ind_2])[0]
-            # Combine item-indices so they fill the upper triangular of the construct similarity matrix.
-            item_indices_all = []
-            for i1 in constit_ix_1:
-                item_indices_all += [(i1, i2) for i2 in constit_ix_2]
-            item_sim_sub = [constituent_similarity[i] for i in item_indices_all]
+            if isinstance(constituent_similarity, CondensedSimilarity):
+                # Look up the item pairs in the condensed vector.
+                item_sim_sub = constituent_similarity.values[
+                    constituent_similarity.pair_index(np.repeat(constit_ix_1, len(constit_ix_2)),
+                                                      np.tile(constit_ix_2, len(constit_ix_1)))].astype(np.float64)
+            else:
+                # Combine item-indices so they fill the upper triangular of the construct similarity matrix.
+                item_indices_all = []
+                for i1 in constit_ix_1:
+                    item_indices_all += [(i1, i2) for i2 in constit_ix_2]
+                item_sim_sub = [constituent_similarity[i] for i in item_indices_all]
             # Compute construct similarity from average of n highest item similarities.
             sim_avg = np.average(np.sort(item_sim_sub, axis=None)[-np.max([n_similarities, 2]):])
-            construct_similarity[ind_1, ind_2] = sim_avg
+            construct_similarity.values[construct_similarity.pair_index(ind_1, ind_2)] = sim_avg
             ctr += 1
             if verbose and ctr % 10000 == 0:
                 print("Aggregating constituent to construct similarity...", ctr / n_fields * 100, "%", end='\r')
     # Set nan values to 0. Origin unknown.
-    construct_similarity = np.nan_to_num(construct_similarity)
+    construct_similarity.values[np.isnan(construct_similarity.values)] = 0
+    if condensed:
+        return construct_similarity
+    # Upper triangular DataFrame with zero diagonal.
+    construct_similarity = np.triu(np.asarray(construct_similarity.to_square(diagonal=0), dtype=np.float64))
     construct_similarity = pd.DataFrame(construct_similarity, index=variable_ids, columns=variable_ids)
     return construct_similarity
 
@@ -843,11 +2818,469 @@ def test_acs():
     info(result)
 
 
-def evaluate(construct_similarity, construct_identity_gold):
-    """Evaluates construct similarity matrix against the (Larsen & Bong, 2016) gold standard with ROC AUC."""
+def top_n_group_mean(similarity_block, col_groups, n_similarities=2):
+    """Reduces a block of item similarities between the items of one construct (rows) and the items of other
+    constructs (columns) to the average of the n_similarities highest similarities per construct. col_groups holds
+    the construct code of every column and must be sorted. Returns the unique construct codes and their averages."""
+    similarity_block = np.asarray(similarity_block)
+    if len(similarity_block) > n_similarities:
+        # The n highest similarities of a construct pair are among the n highest of each column.
+        similarity_block = -np.partition(-similarity_block, n_similarities - 1, axis=0)[:n_similarities]
+    values = similarity_block.T.ravel()  # Values of a column are contiguous, columns are sorted by construct.
+    groups = np.repeat(col_groups, len(similarity_block))
+    order = np.lexsort((-values, groups))
+    values = values[order]
+    unique_groups, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+    # Rank of every value within its construct, keep the n highest.
+    top = np.arange(len(values)) - np.repeat(starts, counts) < n_similarities
+    sums = np.bincount(np.repeat(np.arange(len(unique_groups)), counts)[top], weights=values[top],
+                       minlength=len(unique_groups))
+    return unique_groups, sums / np.minimum(counts, n_similarities)
+
+
+def test_tngm():
+    similarity_block = np.asarray([[0.9, 0.1, 0.4, 0.3, 0.8],
+                                   [0.2, 0.7, 0.5, 0.6, 0.1],
+                                   [0.3, 0.2, 0.9, 0.1, 0.0]])
+    col_groups = np.asarray([2, 2, 5, 5, 7])
+    n_similarities = 2
+    result_1, result_2 = top_n_group_mean(similarity_block, col_groups, n_similarities=n_similarities)
+    print(result_1, "\n", result_2, "\n")  # Expected [2 5 7], [0.8 0.75 0.45]
+    info(result_1)
+    info(result_2)
+
+
+def construct_centroids(item_vectors, item_constructs, variable_ids, weights=None, normalize=True):
+    """Computes one vector per construct as (weighted) mean of its item vectors with one sparse matrix product.
+    item_constructs holds the construct ID of every item vector, weights an optional weight per item (e.g. the
+    number of terms of the item). Centroids are L2 normalized if normalize=True, constructs without items get zero
+    vectors. Returns a DataFrame with one row per ID in sorted variable_ids."""
+    variable_ids = np.sort(variable_ids)
+    codes = pd.Index(variable_ids).get_indexer(np.asarray(item_constructs))
+    weights = np.ones(len(codes)) if weights is None else np.asarray(weights, dtype=np.float64)
+    known = codes >= 0  # Items of constructs not in variable_ids are dropped.
+    membership = sp.csr_matrix((weights[known], (codes[known], np.where(known)[0])),
+                               shape=(len(variable_ids), len(codes)))
+    centroids = membership.dot(np.asarray(item_vectors, dtype=np.float64))
+    totals = np.asarray(membership.sum(axis=1)).ravel()
+    centroids = centroids / np.where(totals != 0, totals, 1)[:, None]
+    if normalize:
+        centroids = Normalizer(norm='l2').fit_transform(centroids)
+    return pd.DataFrame(centroids, index=variable_ids)
+
+
+def test_cc():
+    item_vectors = np.asarray([[1.0, 0.0], [0.0, 1.0], [0.6, 0.8], [1.0, 1.0]])
+    item_constructs = np.asarray([4, 4, 1, 7])
+    variable_ids = [4, 1, 9]
+    result = construct_centroids(item_vectors, item_constructs, variable_ids, normalize=False)
+    print(result, "\n")  # Expected 1: [0.6, 0.8], 4: [0.5, 0.5], 9: [0, 0].
+    print(construct_centroids(item_vectors, item_constructs, variable_ids, weights=[3, 1, 1, 1]), "\n")
+    info(result)
+
+
+def construct_similarity_from_vectors(item_vectors, item_constructs, variable_ids, n_similarities=2, clip=False,
+                                      block_size=4096, dtype=np.float32, unique=True, aggregation='top_n',
+                                      weights=None, normalize=True, verbose=False):
+    """Computes construct similarities directly from (normalized) item vectors. Gives the same result as the dot
+    product item similarity matrix passed to aggregate_construct_similarity(...), but the item similarity matrix is
+    never created. item_constructs holds the construct ID of every item vector. Items are sorted by construct, then
+    the similarities between the items of one construct and the items of all following constructs are computed in
+    tiles of about block_size items, reduced to the average of the n highest similarities per construct pair with
+    top_n_group_mean(...) and discarded. Negative item similarities are set to 0 if clip=True.
+    Item vectors can also be passed as QuantizedVectors, similarities are then computed on the codes.
+    If unique=True, each tile is computed between the unique item vectors of its rows and columns (identical items,
+    e.g. of identical item texts) and mapped back to the items.
+    If aggregation='centroid', constructs are compared by the dot product of their centroids from
+    construct_centroids(...) with weights and normalize, in blocks of block_size constructs: O(constructs²) instead
+    of O(items²) products.
+    Returns a CondensedSimilarity with the passed dtype, memory is O(constructs²) instead of O(items²)."""
+    variable_ids = np.sort(variable_ids)
+    if aggregation == 'centroid':
+        if isinstance(item_vectors, QuantizedVectors):
+            item_vectors = item_vectors.decode()
+        centroids = construct_centroids(item_vectors, item_constructs, variable_ids, weights=weights,
+                                        normalize=normalize)
+        return CondensedSimilarity.from_vectors(centroids, dtype=dtype, clip=clip, block_size=block_size)
+    assert aggregation == 'top_n', "chosen aggregation not implemented."
+    n_similarities = np.max([n_similarities, 2])  # Same as aggregate_construct_similarity(...).
+    # Sort item vectors by construct code, items of constructs not in variable_ids are dropped.
+    codes = pd.Index(variable_ids).get_indexer(np.asarray(item_constructs))
+    order = np.argsort(codes, kind='stable')[np.sum(codes < 0):]
+    if isinstance(item_vectors, QuantizedVectors):
+        vectors = item_vectors[order]
+    else:
+        vectors = np.asarray(item_vectors)[order]
+    codes = codes[order]
+    bounds = np.searchsorted(codes, np.arange(len(variable_ids) + 1))  # Item range of every construct.
+    start_time = time.time()
+    unique = unique and not isinstance(vectors, QuantizedVectors)
+    if unique:
+        vectors, item_index = unique_index(vectors, axis=0)
+    else:
+        item_index = np.arange(len(vectors))
+    construct_similarity = CondensedSimilarity(variable_ids, np.zeros(len(variable_ids) * (len(variable_ids) - 1) // 2),
+                                               dtype=dtype)
+    for code in range(len(variable_ids) - 1):
+        start = bounds[code + 1]
+        while start < len(item_index):
+            # Extend the tile to the end of the construct at its border, so no construct is split between tiles.
+            end = codes[min(start + block_size, len(item_index)) - 1] + 1
+            end = bounds[end]
+            if unique:
+                rows, row_index = np.unique(item_index[bounds[code]:bounds[code + 1]], return_inverse=True)
+                cols, col_index = np.unique(item_index[start:end], return_inverse=True)
+                similarity_block = vectors[rows].dot(vectors[cols].T)[np.ix_(np.ravel(row_index), np.ravel(col_index))]
+            elif isinstance(vectors, QuantizedVectors):
+                similarity_block = vectors[bounds[code]:bounds[code + 1]].similarity(vectors[start:end])
+            else:
+                similarity_block = vectors[bounds[code]:bounds[code + 1]].dot(vectors[start:end].T)
+            if clip:
+                similarity_block = similarity_block.clip(min=0)
+            if len(similarity_block) > 0:
+                col_codes, sim_avg = top_n_group_mean(similarity_block, codes[start:end],
+                                                      n_similarities=n_similarities)
+                construct_similarity.values[construct_similarity.pair_index(code, col_codes)] = sim_avg
+            start = end
+        if verbose and code % 100 == 0:
+            print("Computing construct similarity from item vectors...", code / len(variable_ids) * 100, "%",
+                  end='\r')
+    # Set nan values to 0, like aggregate_construct_similarity(...).
+    construct_similarity.values[np.isnan(construct_similarity.values)] = 0
+    if verbose and unique:
+        deduplication_report('item vectors', len(item_index), len(vectors), time.time() - start_time)
+    return construct_similarity
+
+
+def test_csfv():
+    item_vectors = Normalizer(norm='l2').fit_transform(np.asarray([[0.9, 0.1, 0.0],
+                                                                  [0.7, 0.6, 0.1],
+                                                                  [0.1, 0.9, 0.2],
+                                                                  [0.0, 0.3, 0.9],
+                                                                  [0.8, 0.0, 0.5]]))
+    item_constructs = np.asarray([4, 1, 1, 9, 4])
+    variable_ids = [4, 1, 9]
+    n_similarities = 2
+    result = construct_similarity_from_vectors(item_vectors, item_constructs, variable_ids,
+                                               n_similarities=n_similarities, block_size=2, verbose=True)
+    print(result, "\n", result.values, "\n")
+    print(construct_similarity_from_vectors(item_vectors, item_constructs, variable_ids, n_similarities=n_similarities,
+                                            block_size=2, unique=False).values, "\n")
+    # Compare to the item similarity matrix aggregated by aggregate_construct_similarity(...).
+    item_similarity = pd.DataFrame(item_vectors.dot(item_vectors.T))
+    gold_items = pd.DataFrame(item_constructs, columns=['VariableId'])
+    print(aggregate_construct_similarity(item_similarity, gold_items, variable_ids, n_similarities=n_similarities))
+    # Centroid aggregation.
+    print(construct_similarity_from_vectors(item_vectors, item_constructs, variable_ids, aggregation='centroid').values)
+    print(aggregate_construct_similarity(None, gold_items, variable_ids, aggregation='centroid',
+                                         item_vectors=item_vectors), "\n")
+    info(result)
+
+
+class LazyConstructSimilarity(object):
+    """Construct similarity from item vectors that computes the similarity row of a construct only when it is
+    requested, as the average of the n_similarities highest item similarities like
+    construct_similarity_from_vectors(...). A row costs O(items of the construct x items) instead of O(items²) for
+    the full matrix. Recently requested rows are kept in an LRU cache of cache_size rows, batches of rows are computed
+    in tiles of about block_size x block_size items. Item vectors can also be passed as QuantizedVectors."""
+
+    def __init__(self, item_vectors, item_constructs, variable_ids, n_similarities=2, clip=False, cache_size=256,
+                 block_size=4096, dtype=np.float32):
+        self.variable_ids = np.sort(variable_ids)
+        self.n_similarities = np.max([n_similarities, 2])  # Same as aggregate_construct_similarity(...).
+        self.clip = clip
+        self.cache_size = cache_size
+        self.block_size = block_size
+        self.dtype = dtype
+        # Sort item vectors by construct code like construct_similarity_from_vectors(...).
+        codes = pd.Index(self.variable_ids).get_indexer(np.asarray(item_constructs))
+        order = np.argsort(codes, kind='stable')[np.sum(codes < 0):]
+        if isinstance(item_vectors, QuantizedVectors):
+            self.vectors = item_vectors[order]
+        else:
+            self.vectors = np.asarray(item_vectors)[order]
+        self.codes = codes[order]
+        self.bounds = np.searchsorted(self.codes, np.arange(len(self.variable_ids) + 1))
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.variable_ids)
+
+    def _similarity(self, item_ix, start, end):
+        # Similarities between the passed items and the items start to end.
+        if isinstance(self.vectors, QuantizedVectors):
+            similarity_block = self.vectors[item_ix].similarity(self.vectors[start:end])
+        else:
+            similarity_block = self.vectors[item_ix].dot(self.vectors[start:end].T)
+        if self.clip:
+            similarity_block = similarity_block.clip(min=0)
+        return similarity_block
+
+    def _compute_rows(self, codes):
+        # Items of the requested constructs are stacked into row tiles of about block_size items, the columns are
+        # tiled like in construct_similarity_from_vectors(...), one product per pair of tiles.
+        rows = {}
+        tile = []
+        for i, code in enumerate(codes):
+            tile.append(code)
+            n_items = sum(self.bounds[c + 1] - self.bounds[c] for c in tile)
+            if n_items < self.block_size and i < len(codes) - 1:
+                continue
+            for c in tile:
+                rows[c] = np.zeros(len(self.variable_ids), dtype=self.dtype)
+            item_ix = np.concatenate([np.arange(self.bounds[c], self.bounds[c + 1]) for c in tile])
+            start = 0
+            while start < len(self.codes):
+                # Extend the column tile to the end of the construct at its border.
+                end = self.bounds[self.codes[min(start + self.block_size, len(self.codes)) - 1] + 1]
+                similarity_tile = self._similarity(item_ix, start, end)
+                offset = 0
+                for c in tile:
+                    n_rows = self.bounds[c + 1] - self.bounds[c]
+                    if n_rows > 0:
+                        col_codes, sim_avg = top_n_group_mean(similarity_tile[offset:offset + n_rows],
+                                                              self.codes[start:end],
+                                                              n_similarities=self.n_similarities)
+                        rows[c][col_codes] = sim_avg
+                    offset += n_rows
+                start = end
+            for c in tile:
+                rows[c][np.isnan(rows[c])] = 0
+                rows[c][c] = 1  # Diagonal like CondensedSimilarity.to_square().
+            tile = []
+        return rows
+
+    def rows(self, ids):
+        """Returns the similarity rows of the passed construct IDs as DataFrame (ids x all constructs). Rows not in
+        the cache are computed together and added to the cache, least recently used rows are evicted."""
+        codes = pd.Index(self.variable_ids).get_indexer(np.asarray(ids).ravel()).tolist()
+        assert min(codes, default=0) >= 0, "ids not contained in construct similarity."
+        missing = [code for code in dict.fromkeys(codes) if code not in self.cache]
+        self.hits += len(codes) - len(missing)
+        self.misses += len(missing)
+        computed = self._compute_rows(missing)
+        result = []
+        for code in codes:
+            if code in computed:
+                row = computed[code]
+            else:
+                row = self.cache[code]
+            # Insert or mark as most recently used.
+            self.cache[code] = row
+            self.cache.move_to_end(code)
+            result.append(row)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return pd.DataFrame(np.vstack(result) if result else np.zeros([0, len(self.variable_ids)], dtype=self.dtype),
+                            index=np.asarray(ids).ravel(), columns=self.variable_ids)
+
+    def row(self, variable_id):
+        """Returns the similarity row of one construct as Series."""
+        return self.rows([variable_id]).iloc[0]
+
+    def neighbours(self, variable_id, n=10):
+        """Returns the n most similar other constructs of a construct as Series, most similar first."""
+        row = self.row(variable_id).drop(variable_id)
+        return row.iloc[np.argsort(-row.values, kind='stable')[:n]]
+
+    def materialize(self, verbose=False):
+        """Computes the full construct similarity in tiles with construct_similarity_from_vectors(...), returns a
+        CondensedSimilarity. The cache is not touched."""
+        item_constructs = self.variable_ids[self.codes]
+        return construct_similarity_from_vectors(self.vectors, item_constructs, self.variable_ids,
+                                                 n_similarities=self.n_similarities, clip=self.clip,
+                                                 block_size=self.block_size, dtype=self.dtype, verbose=verbose)
+
+
+def test_lcs():
+    item_vectors = Normalizer(norm='l2').fit_transform(np.asarray([[0.9, 0.1, 0.0],
+                                                                  [0.7, 0.6, 0.1],
+                                                                  [0.1, 0.9, 0.2],
+                                                                  [0.0, 0.3, 0.9],
+                                                                  [0.8, 0.0, 0.5]]))
+    item_constructs = np.asarray([4, 1, 1, 9, 4])
+    variable_ids = [4, 1, 9]
+    result = LazyConstructSimilarity(item_vectors, item_constructs, variable_ids, cache_size=2, block_size=2)
+    print(result.row(4), "\n")
+    print(result.rows([9, 4, 1]), "\n")
+    print(result.neighbours(1, n=1), "\n")
+    print(list(result.cache.keys()), result.hits, result.misses, "\n")  # Cached codes [1, 0], 2 hits, 3 misses.
+    print(result.materialize().to_square(), "\n")
+    info(result)
+
+
+def construct_knn_graph(vectors, variable_ids, item_constructs=None, k=10, threshold=0.0, n_similarities=2, clip=False,
+                        block_size=4096, verbose=False):
+    """Builds a sparse k-nearest-neighbour graph of constructs: for every construct only the k most similar other
+    constructs with similarity >= threshold are kept. If item_constructs holds the construct ID of every item vector,
+    construct similarity is the average of the n_similarities highest item similarities as in
+    construct_similarity_from_vectors(...), else the passed vectors are construct vectors in order of variable_ids.
+    Similarities are computed in tiles of about block_size items (or constructs) and discarded after selecting the
+    neighbours, so memory is O(constructs * k) instead of O(constructs²).
+    Returns the directed graph as scipy CSR matrix of similarities with rows and columns in order of the sorted
+    variable_ids."""
+    rows = []
+    cols = []
+    data = []
+
+    def add_neighbours(row, col_codes, similarities):
+        # Keep the k highest similarities above threshold, nan similarities are dropped.
+        keep = similarities >= threshold
+        col_codes = col_codes[keep]
+        similarities = similarities[keep]
+        if len(similarities) > k:
+            top = np.argpartition(-similarities, k - 1)[:k]
+            col_codes = col_codes[top]
+            similarities = similarities[top]
+        rows.append(np.full(len(col_codes), row))
+        cols.append(col_codes)
+        data.append(similarities)
+
+    if item_constructs is None:
+        order = np.argsort(variable_ids)
+        variable_ids = np.asarray(variable_ids)[order]
+        vectors = np.asarray(vectors)[order]
+        for start in range(0, len(vectors), block_size):
+            similarity_block = vectors[start:start + block_size].dot(vectors.T)
+            if clip:
+                similarity_block = similarity_block.clip(min=0)
+            for r in range(len(similarity_block)):
+                similarity_block[r, start + r] = np.nan  # No self-loops.
+                add_neighbours(start + r, np.arange(len(vectors)), similarity_block[r])
+    else:
+        variable_ids = np.sort(variable_ids)
+        n_similarities = np.max([n_similarities, 2])  # Same as construct_similarity_from_vectors(...).
+        codes = pd.Index(variable_ids).get_indexer(np.asarray(item_constructs))
+        order = np.argsort(codes, kind='stable')[np.sum(codes < 0):]
+        vectors = np.asarray(vectors)[order]
+        codes = codes[order]
+        bounds = np.searchsorted(codes, np.arange(len(variable_ids) + 1))  # Item range of every construct.
+        for code in range(len(variable_ids)):
+            if bounds[code] == bounds[code + 1]:
+                continue  # Construct without items.
+            col_codes = []
+            similarities = []
+            # Tiles over the items of all other constructs, extended to the end of the construct at their border.
+            for range_start, range_end in [(0, bounds[code]), (bounds[code + 1], len(vectors))]:
+                start = range_start
+                while start < range_end:
+                    end = bounds[codes[min(start + block_size, range_end) - 1] + 1]
+                    similarity_block = vectors[bounds[code]:bounds[code + 1]].dot(vectors[start:end].T)
+                    if clip:
+                        similarity_block = similarity_block.clip(min=0)
+                    tile_codes, sim_avg = top_n_group_mean(similarity_block, codes[start:end],
+                                                           n_similarities=n_similarities)
+                    col_codes.append(tile_codes)
+                    similarities.append(sim_avg)
+                    start = end
+            if col_codes:
+                add_neighbours(code, np.concatenate(col_codes), np.concatenate(similarities))
+            if verbose and code % 100 == 0:
+                print("Building construct k-NN graph...", code / len(variable_ids) * 100, "%", end='\r')
+    knn_graph = sp.csr_matrix((np.concatenate(data) if data else [],
+                               (np.concatenate(rows) if rows else [], np.concatenate(cols) if cols else [])),
+                              shape=(len(variable_ids), len(variable_ids)))
+    if verbose:
+        print("Built construct k-NN graph with", knn_graph.nnz, "edges for", len(variable_ids), "constructs.")
+    return knn_graph
+
+
+def synonym_clusters(knn_graph, variable_ids, mutual=False):
+    """Extracts candidate sets of identical constructs as connected components of the k-NN graph from
+    construct_knn_graph(...) (union-find over its edges). If mutual=True, only edges between constructs that are
+    among the neighbours of each other are used, which prevents chaining of clusters through hub constructs.
+    Returns a Series of cluster labels indexed by the sorted variable_ids, labels are ordered by cluster size."""
+    graph = sp.csr_matrix(knn_graph) != 0
+    if mutual:
+        graph = graph.multiply(graph.T)
+    n_clusters, labels = connected_components(graph, directed=True, connection='weak')
+    # Relabel clusters by descending size.
+    sizes = np.bincount(labels)
+    ranks = np.empty(n_clusters, dtype=np.int64)
+    ranks[np.argsort(-sizes, kind='stable')] = np.arange(n_clusters)
+    return pd.Series(ranks[labels], index=np.sort(variable_ids))
+
+
+def cluster_recall(clusters, construct_identity_gold, knn_graph=None, verbose=False):
+    """Checks candidate synonym clusters from synonym_clusters(...) against the pools of the gold standard: recall
+    is the share of identical construct pairs (same pool) in the same cluster, precision the share of pairs in
+    clusters that are identical. If the k-NN graph is passed, the share of identical pairs connected by an edge is
+    reported as well. Only constructs contained in clusters and gold standard are evaluated."""
+    ids = np.intersect1d(clusters.index.values, construct_identity_gold.index.values)
+    gold = np.asarray(construct_identity_gold.loc[ids, ids]) > 0
+    rows, cols = np.nonzero(np.triu(gold, 1))  # Identical pairs.
+    labels = np.asarray(clusters.loc[ids])
+    same_cluster = labels[rows] == labels[cols]
+    sizes = np.bincount(labels)
+    n_cluster_pairs = int(np.sum(sizes * (sizes - 1) // 2))
+    result = {'n_clusters': int(np.sum(sizes > 1)), 'n_cluster_pairs': n_cluster_pairs,
+              'n_identical_pairs': len(rows),
+              'recall': np.mean(same_cluster) if len(rows) > 0 else np.nan,
+              'precision': np.sum(same_cluster) / n_cluster_pairs if n_cluster_pairs > 0 else np.nan}
+    if knn_graph is not None:
+        positions = pd.Index(clusters.index.values).get_indexer(ids)
+        graph = sp.csr_matrix(knn_graph) != 0
+        graph = (graph + graph.T)[positions][:, positions]
+        result['edge_recall'] = np.mean(np.asarray(graph[rows, cols]).ravel()) if len(rows) > 0 else np.nan
+    if verbose:
+        print("Synonym clusters:", result['n_clusters'], "clusters with", n_cluster_pairs, "candidate pairs.",
+              "Recall of identical pairs =", result['recall'], "- precision =", result['precision'],
+              "- k-NN edge recall =", result.get('edge_recall'), "\n")
+    return result
+
+
+def test_ckg():
+    item_vectors = Normalizer(norm='l2').fit_transform(np.asarray([[0.9, 0.1, 0.0],
+                                                                  [0.7, 0.6, 0.1],
+                                                                  [0.1, 0.9, 0.2],
+                                                                  [0.0, 0.3, 0.9],
+                                                                  [0.8, 0.0, 0.5],
+                                                                  [0.1, 0.2, 0.9]]))
+    item_constructs = np.asarray([4, 1, 1, 9, 4, 7])
+    variable_ids = [4, 1, 9, 7]
+    result_1 = construct_knn_graph(item_vectors, variable_ids, item_constructs=item_constructs, k=1, threshold=0.5,
+                                   block_size=2, verbose=True)
+    print(result_1.toarray(), "\n")
+    # Compare to the condensed construct similarity.
+    print(construct_similarity_from_vectors(item_vectors, item_constructs, variable_ids).to_square(), "\n")
+    result_2 = synonym_clusters(result_1, variable_ids, mutual=False)
+    print(result_2, "\n", synonym_clusters(result_1, variable_ids, mutual=True), "\n")
+    construct_identity_gold = pd.DataFrame([[1, 0, 0, 0],
+                                            [0, 1, 0, 1],
+                                            [0, 0, 1, 1],
+                                            [0, 1, 1, 1]], index=[1, 4, 7, 9], columns=[1, 4, 7, 9])
+    result_3 = cluster_recall(result_2, construct_identity_gold, knn_graph=result_1, verbose=True)
+    construct_vectors = item_vectors[:4]
+    print(construct_knn_graph(construct_vectors, variable_ids, k=2).toarray(), "\n")
+    info(result_1)
+    info(result_2)
+    info(result_3)
+
+
+def evaluate(construct_similarity, construct_identity_gold, compare=None):
+    """Evaluates construct similarity matrix against the (Larsen & Bong, 2016) gold standard with ROC AUC.
+    Accepts matrices, flattened upper triangulars or CondensedSimilarity objects.
+    compare can be a dict {label: construct similarity} of alternative similarities, e.g. of a quantized or otherwise
+    approximated method. Their ROC AUC is printed side by side with the evaluated one and the change to it."""
+    if compare is not None:
+        roc_auc = evaluate(construct_similarity, construct_identity_gold)[2]
+        roc_aucs = {label: evaluate(similarity, construct_identity_gold)[2] for label, similarity in compare.items()}
+        comparison = pd.DataFrame({'roc_auc': [roc_auc] + list(roc_aucs.values())},
+                                  index=['evaluated'] + list(roc_aucs.keys()))
+        comparison['change'] = comparison['roc_auc'] - roc_auc
+        print(comparison, "\n")
     # Implementation checked 4 July.
     # Unwrap upper triangular of similarity and identity matrix, excluding diagonal.
     # Calculate Receiver Operating Characteristic (ROC) curve.
+    if isinstance(construct_similarity, CondensedSimilarity):
+        # Use the condensed pairs directly, gold standard reduced to the same constructs.
+        if not isinstance(construct_identity_gold, CondensedSimilarity):
+            construct_identity_gold = CondensedSimilarity.from_square(
+                construct_identity_gold.loc[construct_similarity.ids, construct_similarity.ids], dtype=np.int8)
+        construct_similarity = construct_similarity.values
+        construct_identity_gold = construct_identity_gold.values
     construct_similarity = np.asarray(construct_similarity)
     construct_identity_gold = np.asarray(construct_identity_gold)
     triu_indices = np.triu_indices(len(construct_similarity), k=1)
@@ -885,169 +3318,718 @@ def test_e():
 prototype = False
 stemmer = 'porter2'
 ignore_chars = '''.,:;"'!?_-/()[]{}&%0123456789'''
-dtm_processing = 'tfidf_l2'  # 'count', 'l2', 'tfidf_l2', 'log_l2'
+dtm_processing = 'tfidf_l2'  # 'count', 'l2', 'tfidf_l2', 'log_l2', 'bm25_l2', 'ppmi_l2'
 glove_pretrained_filename = 'glove-pre-trained/glove.6B.300d.txt'
 glove_new_reduce_dict = True
+glove_stem_index = True  # Look up stemmed item terms in a stem-keyed index of the pre-trained GloVe vectors.
+similarity_dtype = np.float32  # dtype of condensed item and construct similarities, np.float32 or np.float16
+similarity_block_size = 4096  # n items per tile in construct_similarity_from_vectors(...)
+result_store_filename = 'results.sqlite'  # SQLite file of the grid search results, shared by parallel workers.
+grid_queue_dir = None  # Shared directory (e.g. on NFS) of the distributed GloVe grid searches, None for local search.
+grid_worker = False  # Run as grid search worker on grid_queue_dir instead of the pipeline, on any number of nodes.
+grid_lease_timeout = 300  # Seconds without heartbeat after which the tickets of dead workers are reclaimed.
+cooccurrence_window = None  # Window size for item term co-occurrences, None for the document-level dt.T @ dt.
+cooccurrence_weighting = 'harmonic'  # Distance weighting of window co-occurrences, see count_window_cooccurrence(...)
+cooccurrence_workers = 1  # Worker processes counting window co-occurrences.
+blocking_neighbours = 5  # n embedding neighbours per term added to the inverted index for blocking item pairs.
+lsa_ranks = [50, 100, 200, 300]  # LSA ranks evaluated on the item corpus, all sliced from one decomposition.
+knn_k = 10  # n neighbours per construct in the construct k-NN graph.
+knn_threshold = 0.5  # Minimum similarity of construct k-NN graph edges.
+knn_mutual = True  # Cluster only mutual k-NN edges.
+model_bundle_dir = None  # Directory of the exported model bundle, e.g. 'model_bundle'. None for no export.
+pipeline_capacity = None  # Resources (CPUs) for concurrent pipeline stages, None for the number of CPUs.
+memory_budget = None  # Memory budget in bytes for plan_memory(...), e.g. 8 * 1024 ** 3. None for no planning.
+quantization = None  # Quantization of pre-trained GloVe term and item vectors: None, 'int8' or 'pq'
 verbose = True
 
 # Load data.
 print("Loading data...")
 gold_items, pool_ids, variable_ids, construct_identity_gold, funk_papers, funk_constructs, construct_authors, \
-construct_editdistances, funk2gold, gold2funk = load_data(prototype=prototype, max_editdistance=1, verbose=verbose)
-var_ids_authors = np.sort(list(gold2funk.keys()))
+construct_editdistances, funk2gold, gold2funk, construct_author_codes, author_groups = \
+    load_data(prototype=prototype, max_editdistance=1, verbose=verbose)
+# Constructs linked to Funk's dataset with known authors, and the row of their co-author group in corpus_authors.
+var_ids_authors = np.sort([gold_id for gold_id, funk_id in gold2funk.items() if funk_id in construct_authors])
+var_author_codes = np.asarray(construct_author_codes.loc[[gold2funk[gold_id] for gold_id in var_ids_authors]])
 construct_identity_gold_authors = construct_identity_gold.loc[var_ids_authors, var_ids_authors]
-triu_indices = np.triu_indices(len(var_ids_authors), k=1)
 
 # Process corpus texts.
 print("Parsing texts...")
-corpus_items = parse_text(np.asarray(gold_items['Text']), stemmer=stemmer, lower=True,
-                          remove_stop_words=True, return_config=False,
-                          ignore_chars=ignore_chars, verbose=verbose)
+corpus_items, parser_config_items = parse_text(np.asarray(gold_items['Text']), stemmer=stemmer, lower=True,
+                                               remove_stop_words=True, return_config=True,
+                                               ignore_chars=ignore_chars, verbose=verbose)
 # corpus_abstracts = parse_text(np.asarray(funk_papers['Abstract']), stemmer=stemmer, lower=True,
 #                               remove_stop_words=True, return_config=False,
 #                               ignore_chars=ignore_chars, verbose=True)
-corpus_authors = np.unique(list(construct_authors.values()))
+corpus_authors = author_groups  # Sorted unique co-author groups.
 # corpus_ authors = parse_text(np.unique(list(construct_authors.values())), stemmer=None, lower=True,
 #                              remove_stop_words=False, return_config=False,
 #                              ignore_chars=ignore_chars, verbose=True)
 
-# Create document-term matrices and term-term dictionary.
-print("Creating document-term matrices (docs x terms)...")
-dtm_items, terms_items = document_term_cooccurrence(corpus_items, processing=dtm_processing)
-# dtm_abstracts, terms_abstracts = document_term_cooccurrence(corpus_abstracts, processing=dtm_processing)
-dtm_authors, terms_authors = document_term_cooccurrence(corpus_authors, processing=dtm_processing)
-ttd_items, dict_term_ix_items, dict_ix_term_items = term_term_cooccurrence(dtm_items, verbose=verbose)
-ttd_authors, dict_term_ix_authors, dict_ix_term_authors = term_term_cooccurrence(dtm_authors, verbose=verbose)
-
-# Compute construct similarity matrix with LSA on item corpus.
-print("Computing construct similarity matrix with LSA...")
-use_doc_vectors_lsa = True
-lsa_aggregation = False
-vector_dict_lsa, item_vectors_lsa = train_vectors_lsa(dtm_items, n_components=300, return_doc_vectors=True)
-if use_doc_vectors_lsa:
-    # Use document-vectors.
-    item_similarity_lsa = pd.DataFrame(np.asmatrix(item_vectors_lsa) * np.asmatrix(item_vectors_lsa).T,
-                                       index=gold_items, columns=gold_items)
-else:
-    term_vectors_lsa = term_vectors_from_dict(vector_dict_lsa, terms_items, normalize=True, verbose=verbose)
-    if lsa_aggregation:
-        # Term to item vector aggregation.
-        item_similarity_lsa = aggregate_item_similarity(dtm_items, term_vectors_lsa, n_similarities=2, verbose=verbose)
+# Plan sparse or dense representations, vocabulary pruning and tile sizes for the memory budget.
+dtm_options = {}
+if memory_budget is not None:
+    memory_plan = plan_memory(corpus_statistics(corpus_items), n_constructs=len(variable_ids),
+                              memory_budget=memory_budget, similarity_dtype=similarity_dtype, verbose=verbose)
+    dtm_options = {'min_df': memory_plan['min_df'], 'max_features': memory_plan['max_features'],
+                   'sparse': memory_plan['sparse']}
+    similarity_block_size = memory_plan['block_size']
+
+# Declare the pipeline after loading and parsing as stage graph for the item and the author branch:
+# document-term matrix -> co-occurrence -> vectors -> similarity -> evaluate. Stages whose dependencies are done run
+# concurrently, stages training GloVe reserve their workers.
+# Results are recorded in the result store as soon as a grid search configuration is finished and skipped on restart.
+result_store = ResultStore(result_store_filename)
+# The vocabulary pruning of the memory plan changes the item document-term matrix, so it is part of the data version.
+dtm_pruning = {key: value for key, value in dtm_options.items() if key in ('min_df', 'max_features')}
+data_version_items = hashlib.sha1(('\n'.join(corpus_items) +
+                                   (ResultStore._dumps(dtm_pruning) if dtm_pruning else '')).encode()).hexdigest()
+data_version_authors = hashlib.sha1('\n'.join(corpus_authors).encode()).hexdigest()
+
+
+def stage_dtm_items():
+    if 'dtm items' in precounted_items:
+        return precounted_items['dtm items']
+    print("Creating document-term matrices (docs x terms)...")
+    return document_term_cooccurrence(corpus_items, processing=dtm_processing, verbose=verbose, **dtm_options)
+
+
+def stage_dtm_authors():
+    # dtm_abstracts, terms_abstracts = document_term_cooccurrence(corpus_abstracts, processing=dtm_processing)
+    return document_term_cooccurrence(corpus_authors, processing=dtm_processing)
+
+
+def stage_cooccurrence(dtm):
+    return term_term_cooccurrence(dtm[0], verbose=verbose)
+
+
+def stage_cooccurrence_items(dtm):
+    if 'co-occurrence items' in precounted_items:
+        return precounted_items['co-occurrence items']
+    if cooccurrence_window is None:
+        return term_term_cooccurrence(dtm[0], verbose=verbose)
+    # Sliding-window co-occurrence over the parsed items, indexed like the document-term matrix columns.
+    return window_cooccurrence(corpus_items, terms=dtm[1], window=cooccurrence_window,
+                               weighting=cooccurrence_weighting, workers=cooccurrence_workers, verbose=verbose)
+
+
+def stage_lsa_items(dtm):
+    dtm_items, terms_items = dtm
+    # Compute construct similarity matrix with LSA on item corpus.
+    print("Computing construct similarity matrix with LSA...")
+    use_doc_vectors_lsa = True
+    lsa_aggregation = False
+    # Decompose once at the largest rank, the rank sweep and the rank 300 vectors are slices of it.
+    lsa_model_items = LSAModel(dtm_items, max_components=max(lsa_ranks + [300]))
+    for rank in lsa_ranks:
+        lsa_rank_config = {'dtm_processing': dtm_processing, 'n_components': rank}
+        roc_auc_rank = evaluate(construct_similarity_from_vectors(lsa_model_items.doc_vectors(rank),
+                                                                  gold_items['VariableId'], variable_ids,
+                                                                  n_similarities=2, block_size=similarity_block_size,
+                                                                  dtype=similarity_dtype),
+                                construct_identity_gold)[2]
+        print("ROC AUC LSA rank", rank, "=", roc_auc_rank)
+        result_store.record('lsa_rank_items', lsa_rank_config, data_version_items, {'roc_auc': roc_auc_rank})
+    vector_dict_lsa, item_vectors_lsa = lsa_model_items.vector_dict(300), lsa_model_items.doc_vectors(300)
+    if use_doc_vectors_lsa:
+        # Use document-vectors. Item similarities are reduced to construct similarities blockwise.
+        construct_similarity_lsa = construct_similarity_from_vectors(item_vectors_lsa, gold_items['VariableId'],
+                                                                     variable_ids, n_similarities=2,
+                                                                     block_size=similarity_block_size,
+                                                                     dtype=similarity_dtype, verbose=verbose)
+    else:
+        term_vectors_lsa = term_vectors_from_dict(vector_dict_lsa, terms_items, normalize=True, verbose=verbose)
+        if lsa_aggregation:
+            # Term to item vector aggregation.
+            item_similarity_lsa = aggregate_item_similarity(dtm_items, term_vectors_lsa, n_similarities=2,
+                                                            verbose=verbose)
+            construct_similarity_lsa = aggregate_construct_similarity(item_similarity_lsa, gold_items, variable_ids,
+                                                                      n_similarities=2, condensed=True,
+                                                                      dtype=similarity_dtype, verbose=verbose)
+        else:
+            # Term vector averaging.
+            item_vectors_lsa_avg = vector_average(dtm_items, term_vectors_lsa, weighting=False)
+            construct_similarity_lsa = construct_similarity_from_vectors(item_vectors_lsa_avg, gold_items['VariableId'],
+                                                                         variable_ids, n_similarities=2,
+                                                                         block_size=similarity_block_size,
+                                                                         dtype=similarity_dtype, verbose=verbose)
+    return vector_dict_lsa, item_vectors_lsa, construct_similarity_lsa
+
+
+def stage_preglove_items(dtm):
+    dtm_items, terms_items = dtm
+    # Compute construct similarity matrix with pre-trained GloVe on item corpus.
+    print("Computing construct similarity matrix with pre-trained GloVe...")
+    vector_dict_preglove = load_term_vectors_glove(file_name=glove_pretrained_filename,
+                                                   target_terms=terms_items,
+                                                   new_reduce_dict=glove_new_reduce_dict,
+                                                   parser_config=parser_config_items if glove_stem_index else None,
+                                                   verbose=verbose)
+    term_vectors_preglove = term_vectors_from_dict(vector_dict_preglove, terms_items, normalize=True, verbose=verbose)
+    item_vectors_preglove = vector_average(dtm_items, term_vectors_preglove, weighting=False)
+    # Compute construct similarity from item similarity. Set negative values to 0, unknown source.
+    construct_similarity_preglove = construct_similarity_from_vectors(item_vectors_preglove, gold_items['VariableId'],
+                                                                      variable_ids, n_similarities=2, clip=True,
+                                                                      block_size=similarity_block_size,
+                                                                      dtype=similarity_dtype, verbose=verbose)
+    # item_similarity_preglove = aggregate_item_similarity(dtm_items, term_vectors_preglove, n_similarities=2,
+    #                                                      verbose=verbose)
+    return term_vectors_preglove, item_vectors_preglove, construct_similarity_preglove
+
+
+def trial_glove_items(glove_config, dtm, ttd):
+    # Train GloVe on the item corpus once with the training parameters of one grid search configuration, then
+    # evaluate all post-processing variants in glove_config['variants'] on the trained vectors: weighting of the
+    # vector average, top-n or centroid construct aggregation, clip and n_similarities. Returns the list of
+    # [configuration, result] of every variant. Run by the local grid search and by the distributed grid search.
+    dtm_items, terms_items = dtm
+    ttd_items, dict_term_ix_items, dict_ix_term_items = ttd
+    training_config = {key: value for key, value in glove_config.items() if key != 'variants'}
+    print("alpha =", glove_config['alpha'], "x_max =", glove_config['x_max'], "step_size =",
+          glove_config['step_size'], "n_epochs =", glove_config['n_epochs'])
+    vector_dict_trglove, loss_glove_items = train_vectors_glove(ttd_items, n_components=glove_config['n_components'],
+                                                                alpha=glove_config['alpha'],
+                                                                x_max=glove_config['x_max'],
+                                                                step_size=glove_config['step_size'],
+                                                                n_epochs=glove_config['n_epochs'],
+                                                                batch_size=glove_config['batch_size'],
+                                                                workers=2, verbose=verbose)  # Train vectors.
+    # Check for nan results. If present, go to next configuration.
+    if np.sum(np.isnan(loss_glove_items)) > 0:
+        print("Encountered nan loss with following parameters:")
+        print(training_config, "\n")
+        return [[dict(training_config, **variant), {'roc_auc': None, 'training_loss': None}]
+                for variant in glove_config['variants']]
+    vector_dict_trglove = {dict_ix_term_items[key]: value for key, value in
+                           vector_dict_trglove.items()}  # Translate indices.
+    term_vectors_trglove = term_vectors_from_dict(vector_dict_trglove, terms_items, normalize=True, verbose=verbose)
+    item_vectors_trglove = {}  # Vector averages per weighting, shared by the variants.
+    results = []
+    for variant in glove_config['variants']:
+        if variant['weighting'] not in item_vectors_trglove:
+            item_vectors_trglove[variant['weighting']] = vector_average(dtm_items, term_vectors_trglove,
+                                                                        weighting=variant['weighting'])
+        construct_similarity_trglove = construct_similarity_from_vectors(
+            item_vectors_trglove[variant['weighting']], gold_items['VariableId'], variable_ids,
+            n_similarities=variant['n_similarities'], clip=variant['clip'],
+            aggregation=variant['construct_aggregation'], block_size=similarity_block_size, dtype=similarity_dtype)
+        fpr_trglove, tpr_trglove, roc_auc_trglove = evaluate(construct_similarity_trglove, construct_identity_gold)
+        print("Result for GloVe with", variant, "ROC AUC =", roc_auc_trglove)
+        results.append([dict(training_config, **variant),
+                        {'roc_auc': roc_auc_trglove, 'training_loss': loss_glove_items[-1]}])
+    print("GloVe training loss =", loss_glove_items[-1], "\n")
+    return results
+
+
+def stage_search_glove_items(dtm, ttd):
+    # Perform grid search on GloVe self-trained on item corpus with vector average for speed.
+    # You can train GloVe with best parameters and item similarity aggregation instead of vector average afterwards.
+    # Every training configuration is trained once, the post-processing variants are evaluated on its vectors.
+    search_alpha = [0.4, 0.5, 0.55, 0.6, 0.7, 0.8]
+    search_x_max = [10, 40, 60, 80, 100]
+    search_step_size = [0.001, 0.0075, 0.02, 0.075, 0.2]
+    search_n_epochs = [50]
+    # The co-occurrence mode is part of the configuration, GloVe is trained on different input per mode.
+    search_training = [{'dtm_processing': dtm_processing, 'cooccurrence_window': cooccurrence_window,
+                        'cooccurrence_weighting': cooccurrence_weighting if cooccurrence_window is not None else None,
+                        'n_components': 300, 'alpha': alpha, 'x_max': x_max,
+                        'step_size': step_size, 'n_epochs': n_epochs, 'batch_size': 64}
+                       for alpha in search_alpha for x_max in search_x_max for step_size in search_step_size
+                       for n_epochs in search_n_epochs]
+    search_weighting = [False, True]
+    search_construct_aggregation = ['top_n', 'centroid']
+    search_clip = [False, True]
+    search_n_similarities = [2, 3]
+    search_variants = [{'weighting': weighting, 'construct_aggregation': aggregation, 'clip': clip,
+                        'n_similarities': n_similarities}
+                       for weighting in search_weighting for aggregation in search_construct_aggregation
+                       for clip in search_clip for n_similarities in search_n_similarities
+                       if aggregation == 'top_n' or n_similarities == search_n_similarities[0]]
+    search_early_stopping = 0.99  # ROC AUC for early stopping of grid search.
+    # Training configurations with their variants not recorded yet, trained configurations are skipped on restart.
+    search_grid = []
+    for training_config in search_training:
+        variants = [variant for variant in search_variants if not result_store.completed(
+            'glove_items', dict(training_config, **variant), data_version_items)]
+        if variants:
+            search_grid.append(dict(training_config, variants=variants))
+    print("Performing grid search on GloVe self-trained on item corpus:", len(search_grid), "of",
+          len(search_training), "trainings left with", len(search_variants), "variants each...\n")
+    if grid_queue_dir is not None:
+        # Distributed grid search: the configurations are claimed by workers on all nodes (grid_worker = True).
+        grid_queue = WorkQueue(grid_queue_dir, lease_timeout=grid_lease_timeout)
+        grid_queue.submit('glove_items', search_grid, data_version_items)
+        grid_queue.drain(result_store, 'glove_items', verbose=verbose,
+                         stop=lambda results: max((result['roc_auc'] or 0) for config, result in results) >=
+                         search_early_stopping)
+        failures = grid_queue.failures('glove_items')
+        if failures:
+            print(len(failures), "of", len(search_grid),
+                  "trainings failed, they are submitted again on the next run:")
+            for ticket in failures:
+                print(ticket['config'], "-", ticket['result']['error'])
     else:
-        # Term vector averaging.
-        item_vectors_lsa_avg = vector_average(dtm_items, term_vectors_lsa, weighting=False)
-        item_similarity_lsa = pd.DataFrame(np.asarray(
-            np.asmatrix(item_vectors_lsa_avg) * np.asmatrix(item_vectors_lsa_avg).T),
-            index=item_vectors_lsa_avg.index.values, columns=item_vectors_lsa_avg.index.values)
-construct_similarity_lsa = aggregate_construct_similarity(item_similarity_lsa, gold_items, variable_ids,
-                                                          n_similarities=2, verbose=verbose)
-fpr_lsa, tpr_lsa, roc_auc_lsa = evaluate(construct_similarity_lsa, construct_identity_gold)
-print("ROC AUC LSA =", roc_auc_lsa, "\n")
+        ctr = 0
+        for glove_config in search_grid:
+            try:
+                results = trial_glove_items(glove_config, dtm, ttd)
+                for config, result in results:
+                    result_store.record('glove_items', config, data_version_items, result)
+                ctr += 1
+                print("Grid search on GloVe.", ctr / len(search_grid) * 100, "%\n")
+                roc_auc_max = max((result['roc_auc'] or 0) for config, result in results)
+                if roc_auc_max >= search_early_stopping:
+                    print("Early stopping: ROC AUC", roc_auc_max, ">=", search_early_stopping)
+                    break
+            except:
+                print("Encountered some error. Continuing search with next parameter set...\n")
+                continue
+    print("Grid search results:")
+    glove_results = result_store.results('glove_items', data_version_items)
+    # Only results of the current co-occurrence mode.
+    for key in ['cooccurrence_window', 'cooccurrence_weighting']:
+        values = glove_results.get(key, pd.Series(np.nan, index=glove_results.index))
+        glove_results = glove_results.loc[values.isna() if search_training[0][key] is None else
+                                          values == search_training[0][key]]
+    glove_results = glove_results.dropna(subset=['roc_auc', 'training_loss'])[
+        ['alpha', 'x_max', 'step_size', 'n_epochs', 'weighting', 'construct_aggregation', 'clip', 'n_similarities',
+         'roc_auc', 'training_loss']]
+    glove_results = glove_results.astype({column: float for column in glove_results.columns
+                                          if column != 'construct_aggregation'})
+    print(glove_results)
+    # Print best GloVe configuration.
+    glove_results_best = glove_results.loc[glove_results['roc_auc'] == glove_results['roc_auc'].max()]
+    print("Best result:")
+    print(glove_results_best, "\n")
+    # Save grid search results.
+    glove_results.to_csv('GloVe_search_results.csv')  # Export of the result store.
+
+    return glove_results
+
+
+def stage_trglove_items(dtm, ttd):
+    dtm_items, terms_items = dtm
+    ttd_items, dict_term_ix_items, dict_ix_term_items = ttd
+    # Compute construct similarity matrix with self-trained GloVe on item corpus.
+    print("Computing construct similarity matrix with self-trained GloVe...")
+    glove_aggregation = False
+    vector_dict_trglove, loss_glove_items = train_vectors_glove(ttd_items, n_components=300, alpha=0.4, x_max=10.0,
+                                                                step_size=0.2, n_epochs=50, batch_size=64, workers=2,
+                                                                verbose=verbose)  # Train vectors.
+    vector_dict_trglove = {dict_ix_term_items[key]: value for key, value in
+                           vector_dict_trglove.items()}  # Translate indices.
+    term_vectors_trglove = term_vectors_from_dict(vector_dict_trglove, terms_items, normalize=True, verbose=verbose)
+    if glove_aggregation:
+        item_similarity_trglove = aggregate_item_similarity(dtm_items, term_vectors_trglove, n_similarities=2,
+                                                            verbose=verbose)
+        construct_similarity_trglove = aggregate_construct_similarity(item_similarity_trglove, gold_items, variable_ids,
+                                                                      n_similarities=2, condensed=True,
+                                                                      dtype=similarity_dtype, verbose=verbose)
+    else:
+        item_vectors_trglove = vector_average(dtm_items, term_vectors_trglove, weighting=False)
+        # Compute construct similarity from item similarity. Set negative values to 0, unknown source.
+        construct_similarity_trglove = construct_similarity_from_vectors(item_vectors_trglove, gold_items['VariableId'],
+                                                                         variable_ids, n_similarities=2, clip=True,
+                                                                         block_size=similarity_block_size,
+                                                                         dtype=similarity_dtype, verbose=verbose)
+    return construct_similarity_trglove
+
+
+def stage_ppmi_items(dtm, ttd):
+    # Compute construct similarity matrix with PPMI + truncated SVD term vectors on item corpus.
+    dtm_items, terms_items = dtm
+    ttd_items, dict_term_ix_items, dict_ix_term_items = ttd
+    vector_dict_ppmi = train_vectors_ppmi(ttd_items, n_components=300, verbose=verbose)
+    vector_dict_ppmi = {dict_ix_term_items[key]: value for key, value in vector_dict_ppmi.items()}
+    term_vectors_ppmi = term_vectors_from_dict(vector_dict_ppmi, terms_items, normalize=True, verbose=verbose)
+    item_vectors_ppmi = vector_average(dtm_items, term_vectors_ppmi, weighting=False)
+    return construct_similarity_from_vectors(item_vectors_ppmi, gold_items['VariableId'], variable_ids,
+                                             n_similarities=2, clip=True, block_size=similarity_block_size,
+                                             dtype=similarity_dtype, verbose=verbose)
+
+
+def stage_bow_authors(dtm):
+    dtm_authors, terms_authors = dtm
+    # Compute construct similarity based on normalized author co-occurrence matrix (BOW) without creating a
+    # semantic space.
+    coauthor_similarity = np.asarray(dtm_authors).dot(np.asarray(dtm_authors).T)
+    coauthor_similarity = pd.DataFrame(coauthor_similarity, index=corpus_authors, columns=corpus_authors)
+    # Gather construct similarity matrix from coauthor group similarities.
+    construct_similarity_authors = gather_construct_similarity(coauthor_similarity, var_author_codes, var_ids_authors,
+                                                               condensed=True, dtype=similarity_dtype)
+    return construct_similarity_authors
+
+
+def stage_graph_authors():
+    # Sparse bipartite graph of co-author groups and individual authors.
+    return author_graph(corpus_authors)
+
+
+def stage_graph_bow_authors(graph):
+    # Construct similarity from shared authors, computed with sparse matrix products.
+    return gather_construct_similarity(coauthor_similarity_graph(graph[0]), var_author_codes, var_ids_authors,
+                                       condensed=True, dtype=similarity_dtype)
+
+
+def stage_graph_embedding_authors(method):
+    def graph_embedding_stage(graph):
+        # Construct similarity from group embeddings, without the groups x groups similarity matrix.
+        group_vectors = author_graph_embedding(graph[0], n_components=100, method=method)
+        return CondensedSimilarity.from_vectors(group_vectors[var_author_codes], ids=var_ids_authors,
+                                                dtype=similarity_dtype, block_size=similarity_block_size)
+    return graph_embedding_stage
+
+
+def stage_lsa_authors(dtm):
+    dtm_authors, terms_authors = dtm
+    # Compute construct similarity matrix with LSA on author corpus.
+    lsa_model_authors = LSAModel(dtm_authors, max_components=100)
+    vector_dict_lsa_authors = lsa_model_authors.vector_dict()
+    author_vectors_lsa = term_vectors_from_dict(vector_dict_lsa_authors, terms_authors, normalize=True, verbose=verbose)
+    coauthor_vectors_lsa = vector_average(dtm_authors, author_vectors_lsa, weighting=False)
+    coauthor_similarity_lsa = pd.DataFrame(np.asarray(coauthor_vectors_lsa).dot(coauthor_vectors_lsa.T),
+                                           index=coauthor_vectors_lsa.index.values,
+                                           columns=coauthor_vectors_lsa.index.values)
+    # coauthor_doc_vectors_lsa = lsa_model_authors.doc_vectors()
+    # coauthor_similarity_lsa = pd.DataFrame(np.asmatrix(coauthor_doc_vectors_lsa) *
+    #                                        np.asmatrix(coauthor_doc_vectors_lsa).T,
+    #                                        index=coauthor_doc_vectors_lsa.index.values,
+    #                                        columns=coauthor_doc_vectors_lsa.index.values)
+    # Gather construct similarity matrix from coauthor group similarities.
+    construct_similarity_lsa_authors = gather_construct_similarity(coauthor_similarity_lsa, var_author_codes,
+                                                                   var_ids_authors, condensed=True,
+                                                                   dtype=similarity_dtype)
+    return construct_similarity_lsa_authors
+
+
+def trial_glove_authors(glove_config, dtm, ttd):
+    # Train GloVe on the author corpus once with the training parameters of one grid search configuration, then
+    # evaluate all post-processing variants in glove_config['variants'] on the trained vectors: weighting of the
+    # vector average and clip of the co-author group similarities. Returns the list of [configuration, result] of
+    # every variant. Run by the local grid search and by the distributed grid search.
+    dtm_authors, terms_authors = dtm
+    ttd_authors, dict_term_ix_authors, dict_ix_term_authors = ttd
+    training_config = {key: value for key, value in glove_config.items() if key != 'variants'}
+    print("n_comp=", glove_config['n_components'], "alpha =", glove_config['alpha'], "x_max =", glove_config['x_max'],
+          "step_size =", glove_config['step_size'], "n_epochs =", glove_config['n_epochs'])
+    vector_dict_glove_authors, loss_glove_auth = train_vectors_glove(ttd_authors,
+                                                                     n_components=glove_config['n_components'],
+                                                                     alpha=glove_config['alpha'],
+                                                                     x_max=glove_config['x_max'],
+                                                                     step_size=glove_config['step_size'],
+                                                                     n_epochs=glove_config['n_epochs'],
+                                                                     batch_size=glove_config['batch_size'], workers=2,
+                                                                     verbose=verbose)  # Train vectors.
+    # Check for nan results. If present, go to next configuration.
+    if np.sum(np.isnan(loss_glove_auth)) > 0:
+        print("Encountered nan loss with following parameters:")
+        print(training_config, "\n")
+        return [[dict(training_config, **variant), {'roc_auc': None, 'training_loss': None}]
+                for variant in glove_config['variants']]
+    vector_dict_glove_authors = {dict_ix_term_authors[key]: value for key, value in
+                                 vector_dict_glove_authors.items()}  # Translate indices.
+    author_vectors_glove = term_vectors_from_dict(vector_dict_glove_authors, terms_authors, normalize=True,
+                                                  verbose=verbose)
+    coauthor_similarity_glove = {}  # Co-author group similarities per weighting, shared by the variants.
+    results = []
+    for variant in glove_config['variants']:
+        if variant['weighting'] not in coauthor_similarity_glove:
+            coauthor_vectors_glove = vector_average(dtm_authors, author_vectors_glove,
+                                                    weighting=variant['weighting'])
+            coauthor_similarity_glove[variant['weighting']] = np.asarray(coauthor_vectors_glove).dot(
+                np.asarray(coauthor_vectors_glove).T)
+        coauthor_similarity = coauthor_similarity_glove[variant['weighting']]
+        if variant['clip']:
+            coauthor_similarity = coauthor_similarity.clip(min=0)
+        # Gather construct similarity matrix from coauthor group similarities.
+        construct_similarity_glove_authors = gather_construct_similarity(coauthor_similarity, var_author_codes,
+                                                                         var_ids_authors, condensed=True,
+                                                                         dtype=similarity_dtype)
+        fpr_glove_auth, tpr_glove_auth, roc_auc_glove_auth = evaluate(construct_similarity_glove_authors,
+                                                                      construct_identity_gold)
+        print("Result for GloVe on authors with", variant, "ROC AUC =", roc_auc_glove_auth)
+        results.append([dict(training_config, **variant),
+                        {'roc_auc': roc_auc_glove_auth, 'training_loss': loss_glove_auth[-1]}])
+    print("GloVe training loss =", loss_glove_auth[-1], "\n")
+    return results
+
+
+def stage_search_glove_authors(dtm, ttd):
+    # Perform grid search on GloVe self-trained on author corpus with vector average for speed.
+    # You can train GloVe with best parameters afterwards.
+    # Every training configuration is trained once, the post-processing variants are evaluated on its vectors.
+    search_n_components_auth = [70, 100, 130]
+    search_alpha_auth = [0.4, 0.5, 0.6, 0.7, 0.8]
+    search_x_max_auth = [10, 40, 70, 100]
+    search_step_size_auth = [0.005, 0.0075, 0.01, 0.025, 0.05, 0.15, 0.3]
+    search_n_epochs_auth = [50]
+    search_training_auth = [{'dtm_processing': dtm_processing, 'n_components': n_comp, 'alpha': alpha,
+                             'x_max': x_max, 'step_size': step_size, 'n_epochs': n_epochs, 'batch_size': 64}
+                            for n_comp in search_n_components_auth for alpha in search_alpha_auth
+                            for x_max in search_x_max_auth for step_size in search_step_size_auth
+                            for n_epochs in search_n_epochs_auth]
+    search_weighting_auth = [False, True]
+    search_clip_auth = [False, True]
+    search_variants_auth = [{'weighting': weighting, 'clip': clip} for weighting in search_weighting_auth
+                            for clip in search_clip_auth]
+    search_early_stopping_auth = 0.99  # ROC AUC for early stopping of grid search.
+    # Training configurations with their variants not recorded yet, trained configurations are skipped on restart.
+    search_grid_auth = []
+    for training_config in search_training_auth:
+        variants = [variant for variant in search_variants_auth if not result_store.completed(
+            'glove_authors', dict(training_config, **variant), data_version_authors)]
+        if variants:
+            search_grid_auth.append(dict(training_config, variants=variants))
+    print("Performing grid search on GloVe self-trained on author corpus:", len(search_grid_auth), "of",
+          len(search_training_auth), "trainings left with", len(search_variants_auth), "variants each...\n")
+    if grid_queue_dir is not None:
+        # Distributed grid search: the configurations are claimed by workers on all nodes (grid_worker = True).
+        grid_queue = WorkQueue(grid_queue_dir, lease_timeout=grid_lease_timeout)
+        grid_queue.submit('glove_authors', search_grid_auth, data_version_authors)
+        grid_queue.drain(result_store, 'glove_authors', verbose=verbose,
+                         stop=lambda results: max((result['roc_auc'] or 0) for config, result in results) >=
+                         search_early_stopping_auth)
+        failures = grid_queue.failures('glove_authors')
+        if failures:
+            print(len(failures), "of", len(search_grid_auth),
+                  "trainings failed, they are submitted again on the next run:")
+            for ticket in failures:
+                print(ticket['config'], "-", ticket['result']['error'])
+    else:
+        ctr_auth = 0
+        for glove_config in search_grid_auth:
+            try:
+                results = trial_glove_authors(glove_config, dtm, ttd)
+                for config, result in results:
+                    result_store.record('glove_authors', config, data_version_authors, result)
+                ctr_auth += 1
+                print("Grid search on GloVe.", ctr_auth / len(search_grid_auth) * 100, "%\n")
+                roc_auc_max = max((result['roc_auc'] or 0) for config, result in results)
+                if roc_auc_max >= search_early_stopping_auth:
+                    print("Early stopping: ROC AUC", roc_auc_max, ">=", search_early_stopping_auth)
+                    break
+            except:
+                print("Encountered some error. Continuing search with next parameter set...\n")
+                continue
+    print("Grid search results:")
+    glove_results_auth = result_store.results('glove_authors', data_version_authors).dropna().rename(
+        columns={'n_components': 'n_comp'})[['n_comp', 'alpha', 'x_max', 'step_size', 'n_epochs', 'weighting', 'clip',
+                                             'roc_auc', 'training_loss']].astype(float)
+    print(glove_results_auth)
+    # Print best GloVe configuration.
+    glove_results_auth_best = glove_results_auth.loc[glove_results_auth['roc_auc'] ==
+                                                     glove_results_auth['roc_auc'].max()]
+    print("Best result:")
+    print(glove_results_auth_best, "\n")
+    # Save grid search results.
+    glove_results_auth.to_csv('GloVe_search_results_auth.csv')  # Export of the result store.
+
+    return glove_results_auth
+
+
+def stage_glove_authors(dtm, ttd):
+    dtm_authors, terms_authors = dtm
+    ttd_authors, dict_term_ix_authors, dict_ix_term_authors = ttd
+    # Compute construct similarity matrix with GloVe on author corpus.
+    vector_dict_glove_authors, loss_glove_authors = train_vectors_glove(ttd_authors, n_components=100, alpha=0.4,
+                                                                        x_max=70.0, step_size=0.3, n_epochs=50,
+                                                                        batch_size=64, workers=2, verbose=verbose)
+    vector_dict_glove_authors = {dict_ix_term_authors[key]: value for key, value in
+                                 vector_dict_glove_authors.items()}  # Translate indices.
+    author_vectors_glove = term_vectors_from_dict(vector_dict_glove_authors, terms_authors, normalize=True,
+                                                  verbose=verbose)
+    coauthor_vectors_glove = vector_average(dtm_authors, author_vectors_glove, weighting=True)
+    coauthor_similarity_glove = pd.DataFrame(np.asarray(coauthor_vectors_glove).dot(coauthor_vectors_glove.T),
+                                             index=coauthor_vectors_glove.index.values,
+                                             columns=coauthor_vectors_glove.index.values)
+    # Gather construct similarity matrix from coauthor group similarities.
+    construct_similarity_glove_authors = gather_construct_similarity(coauthor_similarity_glove, var_author_codes,
+                                                                     var_ids_authors, condensed=True,
+                                                                     dtype=similarity_dtype)
+    return construct_similarity_glove_authors
+
+
+def stage_ppmi_authors(dtm, ttd):
+    # Compute construct similarity matrix with PPMI + truncated SVD author vectors on author corpus.
+    dtm_authors, terms_authors = dtm
+    ttd_authors, dict_term_ix_authors, dict_ix_term_authors = ttd
+    vector_dict_ppmi_authors = train_vectors_ppmi(ttd_authors, n_components=100, verbose=verbose)
+    vector_dict_ppmi_authors = {dict_ix_term_authors[key]: value for key, value in vector_dict_ppmi_authors.items()}
+    author_vectors_ppmi = term_vectors_from_dict(vector_dict_ppmi_authors, terms_authors, normalize=True,
+                                                 verbose=verbose)
+    coauthor_vectors_ppmi = vector_average(dtm_authors, author_vectors_ppmi, weighting=True)
+    coauthor_similarity_ppmi = pd.DataFrame(np.asarray(coauthor_vectors_ppmi).dot(coauthor_vectors_ppmi.T),
+                                            index=coauthor_vectors_ppmi.index.values,
+                                            columns=coauthor_vectors_ppmi.index.values)
+    return gather_construct_similarity(coauthor_similarity_ppmi, var_author_codes, var_ids_authors, condensed=True,
+                                       dtype=similarity_dtype)
+
+
+def stage_evaluate(name, construct_identity):
+    def evaluate_stage(construct_similarity):
+        if isinstance(construct_similarity, tuple):
+            construct_similarity = construct_similarity[-1]
+        fpr, tpr, roc_auc = evaluate(construct_similarity, construct_identity)
+        print("ROC AUC", name, "=", roc_auc, "\n")
+        return fpr, tpr, roc_auc
+    return evaluate_stage
+
+
+# Forking the co-occurrence workers from the threads of the pipeline can deadlock, so with several workers the item
+# document-term matrix and window co-occurrences are counted before the pipeline starts.
+precounted_items = {}
+if cooccurrence_window is not None and cooccurrence_workers > 1:
+    precounted_items['dtm items'] = stage_dtm_items()
+    precounted_items['co-occurrence items'] = stage_cooccurrence_items(precounted_items['dtm items'])
+
+pipeline = StageGraph()
+pipeline.add('dtm items', stage_dtm_items)
+pipeline.add('dtm authors', stage_dtm_authors)
+pipeline.add('co-occurrence items', stage_cooccurrence_items, ['dtm items'])
+pipeline.add('co-occurrence authors', stage_cooccurrence, ['dtm authors'])
+pipeline.add('LSA', stage_lsa_items, ['dtm items'])
+pipeline.add('preGloVe', stage_preglove_items, ['dtm items'])
+pipeline.add('trGloVe search', stage_search_glove_items, ['dtm items', 'co-occurrence items'], resources=2)
+pipeline.add('trGloVe', stage_trglove_items, ['dtm items', 'co-occurrence items'], resources=2)
+pipeline.add('PPMI', stage_ppmi_items, ['dtm items', 'co-occurrence items'])
+pipeline.add('BOW authors', stage_bow_authors, ['dtm authors'])
+pipeline.add('LSA authors', stage_lsa_authors, ['dtm authors'])
+pipeline.add('GloVe authors search', stage_search_glove_authors, ['dtm authors', 'co-occurrence authors'],
+             resources=2)
+pipeline.add('GloVe authors', stage_glove_authors, ['dtm authors', 'co-occurrence authors'], resources=2)
+pipeline.add('PPMI authors', stage_ppmi_authors, ['dtm authors', 'co-occurrence authors'])
+pipeline.add('author graph', stage_graph_authors)
+pipeline.add('graph BOW authors', stage_graph_bow_authors, ['author graph'])
+pipeline.add('graph SVD authors', stage_graph_embedding_authors('svd'), ['author graph'])
+pipeline.add('graph random walk authors', stage_graph_embedding_authors('random_walk'), ['author graph'])
+for method, identity in [('LSA', construct_identity_gold), ('preGloVe', construct_identity_gold),
+                         ('trGloVe', construct_identity_gold), ('BOW authors', construct_identity_gold_authors),
+                         ('LSA authors', construct_identity_gold_authors),
+                         ('GloVe authors', construct_identity_gold_authors)]:
+    pipeline.add('evaluate ' + method, stage_evaluate(method, identity), [method])
+if grid_worker:
+    # Grid search worker: create the document-term matrices and co-occurrences the trials need, then claim tickets
+    # from the coordinator (grid_queue_dir set, grid_worker = False) until none are left.
+    dtm_worker_items = stage_dtm_items()
+    ttd_worker_items = stage_cooccurrence_items(dtm_worker_items)
+    dtm_worker_authors = stage_dtm_authors()
+    ttd_worker_authors = stage_cooccurrence(dtm_worker_authors)
+    n_trials = run_worker(WorkQueue(grid_queue_dir, lease_timeout=grid_lease_timeout),
+                          {'glove_items': lambda glove_config: trial_glove_items(glove_config, dtm_worker_items,
+                                                                                 ttd_worker_items),
+                           'glove_authors': lambda glove_config: trial_glove_authors(glove_config, dtm_worker_authors,
+                                                                                     ttd_worker_authors)},
+                          data_versions={'glove_items': data_version_items, 'glove_authors': data_version_authors},
+                          heartbeat_interval=grid_lease_timeout / 10, max_idle=grid_lease_timeout, verbose=verbose)
+    print("Grid search worker finished", n_trials, "trials.")
+    raise SystemExit
+pipeline_results = pipeline.run(capacity=pipeline_capacity, verbose=verbose)
+dtm_items, terms_items = pipeline_results['dtm items']
+dtm_authors, terms_authors = pipeline_results['dtm authors']
+ttd_items, dict_term_ix_items, dict_ix_term_items = pipeline_results['co-occurrence items']
+ttd_authors, dict_term_ix_authors, dict_ix_term_authors = pipeline_results['co-occurrence authors']
+vector_dict_lsa, item_vectors_lsa, construct_similarity_lsa = pipeline_results['LSA']
+term_vectors_preglove, item_vectors_preglove, construct_similarity_preglove = pipeline_results['preGloVe']
+construct_similarity_trglove = pipeline_results['trGloVe']
+construct_similarity_authors = pipeline_results['BOW authors']
+construct_similarity_lsa_authors = pipeline_results['LSA authors']
+construct_similarity_glove_authors = pipeline_results['GloVe authors']
+construct_similarity_ppmi = pipeline_results['PPMI']
+construct_similarity_ppmi_authors = pipeline_results['PPMI authors']
+author_incidence, author_names = pipeline_results['author graph']
+glove_results = pipeline_results['trGloVe search']
+glove_results_auth = pipeline_results['GloVe authors search']
+fpr_lsa, tpr_lsa, roc_auc_lsa = pipeline_results['evaluate LSA']
+fpr_preglove, tpr_preglove, roc_auc_preglove = pipeline_results['evaluate preGloVe']
+fpr_trglove, tpr_trglove, roc_auc_trglove = pipeline_results['evaluate trGloVe']
+fpr_auth, tpr_auth, roc_auc_auth = pipeline_results['evaluate BOW authors']
+fpr_lsa_auth, tpr_lsa_auth, roc_auc_lsa_auth = pipeline_results['evaluate LSA authors']
+fpr_glove_auth, tpr_glove_auth, roc_auc_glove_auth = pipeline_results['evaluate GloVe authors']
+# Compare top-n item pair aggregation to construct centroids, which need one construct x construct product.
+# Negative similarities are clipped like in the top-n stage of the method.
+for method, item_vectors_method, construct_similarity_method, clip_method in [
+        ('LSA', item_vectors_lsa, construct_similarity_lsa, False),
+        ('preGloVe', item_vectors_preglove, construct_similarity_preglove, True)]:
+    start_time = time.time()
+    construct_similarity_centroid = construct_similarity_from_vectors(item_vectors_method, gold_items['VariableId'],
+                                                                      variable_ids, aggregation='centroid',
+                                                                      clip=clip_method,
+                                                                      block_size=similarity_block_size,
+                                                                      dtype=similarity_dtype)
+    print(method, "top-n aggregation compared to centroids, computed in", round(time.time() - start_time, 2), "s:")
+    evaluate(construct_similarity_method, construct_identity_gold,
+             compare={method + ' centroid': construct_similarity_centroid})
+# Compare the closed-form PPMI + SVD vectors to self-trained GloVe.
+print("Self-trained GloVe compared to PPMI + truncated SVD:")
+evaluate(construct_similarity_trglove, construct_identity_gold, compare={'PPMI-SVD': construct_similarity_ppmi})
+evaluate(construct_similarity_glove_authors, construct_identity_gold_authors,
+         compare={'PPMI-SVD authors': construct_similarity_ppmi_authors})
+# Compare the author graph methods to BOW on author name tokens.
+print("Author graph with", author_incidence.shape[0], "co-author groups,", len(author_names), "authors and",
+      author_incidence.nnz, "edges compared to BOW authors:")
+evaluate(construct_similarity_authors, construct_identity_gold_authors,
+         compare={method: pipeline_results[method]
+                  for method in ['graph BOW authors', 'graph SVD authors', 'graph random walk authors']})
+
+# Extract candidate sets of identical constructs from a sparse k-NN graph of LSA construct similarities.
+print("Extracting synonym clusters from construct k-NN graph...")
+knn_graph_lsa = construct_knn_graph(item_vectors_lsa, variable_ids, item_constructs=gold_items['VariableId'],
+                                    k=knn_k, threshold=knn_threshold, block_size=similarity_block_size, verbose=verbose)
+synonym_clusters_lsa = synonym_clusters(knn_graph_lsa, variable_ids, mutual=knn_mutual)
+cluster_recall_lsa = cluster_recall(synonym_clusters_lsa, construct_identity_gold, knn_graph=knn_graph_lsa,
+                                    verbose=verbose)
+
+# Query the neighbours of single constructs lazily, only their similarity rows are computed.
+lazy_similarity_lsa = LazyConstructSimilarity(item_vectors_lsa, gold_items['VariableId'], variable_ids,
+                                              block_size=similarity_block_size, dtype=similarity_dtype)
+for variable_id in variable_ids[:3]:
+    print("Most similar constructs to", variable_id, "with LSA:")
+    print(lazy_similarity_lsa.neighbours(variable_id, n=5), "\n")
 
 # Compare item vector and item similarity aggregation methods.
 term_vectors_lsa = term_vectors_from_dict(vector_dict_lsa, terms_items, normalize=True, verbose=verbose)
 item_vectors_lsa_dvec = item_vectors_lsa
 item_vectors_lsa_avg = vector_average(dtm_items, term_vectors_lsa, weighting=False)
 item_vectors_lsa_avg_tfidf = vector_average(dtm_items, term_vectors_lsa, weighting=True)
-item_similarity_lsa_dvec = np.asarray(np.asmatrix(item_vectors_lsa_dvec) * np.asmatrix(item_vectors_lsa_dvec).T)
-item_similarity_lsa_avg = np.asarray(np.asmatrix(item_vectors_lsa_avg) * np.asmatrix(item_vectors_lsa_avg).T)
-item_similarity_lsa_avg_tfidf = np.asarray(np.asmatrix(item_vectors_lsa_avg_tfidf) *
-                                           np.asmatrix(item_vectors_lsa_avg_tfidf).T)
-item_similarity_lsa_agg = aggregate_item_similarity(dtm_items, term_vectors_lsa, n_similarities=2,
-                                                    verbose=verbose)
-item_similarity_methods = pd.DataFrame(
-    np.asarray(np.asmatrix([np.asarray(item_similarity_lsa_dvec)[np.triu_indices(len(item_similarity_lsa), k=1)],
-                            np.asarray(item_similarity_lsa_avg)[np.triu_indices(len(item_similarity_lsa), k=1)],
-                            np.asarray(item_similarity_lsa_avg_tfidf)[np.triu_indices(len(item_similarity_lsa), k=1)],
-                            np.asarray(item_similarity_lsa_agg)[np.triu_indices(len(item_similarity_lsa), k=1)]]).T),
-    columns=['LSA dvec', 'LSA cent', 'LSA cent tfidf', 'LSA agg'])
+item_similarity_lsa_dvec = CondensedSimilarity.from_vectors(item_vectors_lsa_dvec, dtype=similarity_dtype)
+item_similarity_lsa_avg = CondensedSimilarity.from_vectors(item_vectors_lsa_avg, dtype=similarity_dtype)
+item_similarity_lsa_avg_tfidf = CondensedSimilarity.from_vectors(item_vectors_lsa_avg_tfidf, dtype=similarity_dtype)
+item_similarity_lsa_agg_full = aggregate_item_similarity(dtm_items, term_vectors_lsa, n_similarities=2, verbose=verbose)
+item_similarity_lsa_agg = CondensedSimilarity.from_square(item_similarity_lsa_agg_full, dtype=similarity_dtype)
+item_similarity_methods = pd.DataFrame({'LSA dvec': item_similarity_lsa_dvec.values,
+                                        'LSA cent': item_similarity_lsa_avg.values,
+                                        'LSA cent tfidf': item_similarity_lsa_avg_tfidf.values,
+                                        'LSA agg': item_similarity_lsa_agg.values})
 print("Correlation table for item similarity methods.")
 print(item_similarity_methods.corr())
 
-# Compute construct similarity matrix with pre-trained GloVe on item corpus.
-print("Computing construct similarity matrix with pre-trained GloVe...")
-vector_dict_preglove = load_term_vectors_glove(file_name=glove_pretrained_filename,
-                                               target_terms=terms_items,
-                                               new_reduce_dict=glove_new_reduce_dict, verbose=verbose)
-term_vectors_preglove = term_vectors_from_dict(vector_dict_preglove, terms_items, normalize=True, verbose=verbose)
-item_vectors_preglove = vector_average(dtm_items, term_vectors_preglove, weighting=False)
-# Compute item similarity. Set negative values to 0, unknown source.
-item_similarity_preglove = pd.DataFrame(np.asarray(
-    np.asmatrix(item_vectors_preglove) * np.asmatrix(item_vectors_preglove).T).clip(min=0),
-                                       index=item_vectors_preglove.index.values,
-                                       columns=item_vectors_preglove.index.values)
-# item_similarity_preglove = aggregate_item_similarity(dtm_items, term_vectors_preglove, n_similarities=2,
-#                                                      verbose=verbose)
-construct_similarity_preglove = aggregate_construct_similarity(item_similarity_preglove, gold_items, variable_ids,
-                                                               n_similarities=2, verbose=verbose)
-fpr_preglove, tpr_preglove, roc_auc_preglove = evaluate(construct_similarity_preglove, construct_identity_gold)
-print("ROC AUC pre-trained GloVe =", roc_auc_preglove, "\n")
-
-# Perform grid search on GloVe self-trained on item corpus with unweighted vector average for speed.
-# You can train GloVe with best parameters and item similarity aggregation instead of vector average afterwards.
-try:
-    glove_results = pd.read_csv('GloVe_search_results.csv', index_col=0).values.tolist()
-except FileNotFoundError:
-    glove_results = []
-search_alpha = [0.4, 0.5, 0.55, 0.6, 0.7, 0.8]
-search_x_max = [10, 40, 60, 80, 100]
-search_step_size = [0.001, 0.0075, 0.02, 0.075, 0.2]
-search_n_epochs = [50]
-search_weighting = [False, True]
-search_grid = [[alpha, x_max, step_size, n_epochs, weighting] for alpha in search_alpha for x_max in search_x_max
-               for step_size in search_step_size for n_epochs in search_n_epochs for weighting in search_weighting]
-search_early_stopping = 0.99  # ROC AUC for early stopping of grid search.
-ctr = 0
-print("Performing grid search on GloVe self-trained on item corpus...\n")
-for alpha, x_max, step_size, n_epochs, weighting in search_grid:
-    try:
-        print("alpha =", alpha, "x_max =", x_max, "step_size =", step_size,
-              "n_epochs =", n_epochs, "weighting =", weighting)
-        vector_dict_trglove, loss_glove_items = train_vectors_glove(ttd_items, n_components=300, alpha=alpha,
-                                                                    x_max=x_max,
-                                                                    step_size=step_size, n_epochs=n_epochs,
-                                                                    batch_size=64,
-                                                                    workers=2, verbose=verbose)  # Train vectors.
-        # Check for nan results. If present, go to next configuration.
-        if np.sum(np.isnan(loss_glove_items)) > 0:
-            print("Encountered nan loss with following parameters:")
-            print("alpha =", alpha, "x_max =", x_max, "step_size =", step_size,
-                  "n_epochs =", n_epochs, "weighting =", weighting, "\n")
-            continue
-        vector_dict_trglove = {dict_ix_term_items[key]: value for key, value in
-                               vector_dict_trglove.items()}  # Translate indices.
-        term_vectors_trglove = term_vectors_from_dict(vector_dict_trglove, terms_items, normalize=True, verbose=verbose)
-        item_vectors_trglove = vector_average(dtm_items, term_vectors_trglove, weighting=weighting)
-        item_similarity_trglove = pd.DataFrame(np.asarray(
-            np.asmatrix(item_vectors_trglove) * np.asmatrix(item_vectors_trglove).T),
-            index=item_vectors_trglove.index.values, columns=item_vectors_trglove.index.values)
-        construct_similarity_trglove = aggregate_construct_similarity(item_similarity_trglove, gold_items, variable_ids,
-                                                                      n_similarities=2, verbose=verbose)
-        fpr_trglove, tpr_trglove, roc_auc_trglove = evaluate(construct_similarity_trglove, construct_identity_gold)
-        ctr += 1
-        print("Result for GloVe with alpha =", alpha, "x_max =", x_max, "step_size =", step_size,
-              "n_epochs =", n_epochs, "weighting =", weighting)
-        print("ROC AUC =", roc_auc_trglove, "GloVe training loss =", loss_glove_items[-1], "\n")
-        print("Grid search on GloVe.", ctr / len(search_grid) * 100, "%\n")
-        glove_results.append([alpha, x_max, step_size, n_epochs, weighting, roc_auc_trglove, loss_glove_items[-1]])
-        if roc_auc_trglove >= search_early_stopping:
-            print("Early stopping: ROC AUC", roc_auc_trglove, ">=", search_early_stopping)
-            break
-    except:
-        print("Encountered some error. Continuing search with next parameter set...\n")
-        continue
-print("Grid search results:")
-glove_results = pd.DataFrame(np.asarray(glove_results), columns=['alpha', 'x_max', 'step_size', 'n_epochs',
-                                                                 'weighting', 'roc_auc', 'training_loss'])
-print(glove_results)
-# Print best GloVe configuration.
-glove_results_best = pd.DataFrame(
-    np.asarray(glove_results)[np.where(np.asarray(glove_results)[:, -2] == np.max(np.asarray(glove_results)[:, -2]))],
-    columns=['alpha', 'x_max', 'step_size', 'n_epochs', 'weighting', 'roc_auc', 'training_loss'])
-print("Best result:")
-print(glove_results_best, "\n")
-# Save grid search results.
-glove_results.to_csv('GloVe_search_results.csv')
+# Blocking: aggregate item similarity only for item pairs sharing terms or near terms, other pairs get 0.
+# Reports the fraction of pruned item pairs and the impact on ROC AUC.
+item_pairs_lsa = candidate_item_pairs(dtm_items, term_vectors=term_vectors_lsa, n_neighbours=blocking_neighbours,
+                                      block_size=similarity_block_size, verbose=verbose)
+item_similarity_lsa_agg_blocked = aggregate_item_similarity(dtm_items, term_vectors_lsa, n_similarities=2,
+                                                            candidates=item_pairs_lsa, verbose=verbose)
+evaluate(aggregate_construct_similarity(item_similarity_lsa_agg_full, gold_items, variable_ids, n_similarities=2,
+                                        condensed=True, dtype=similarity_dtype),
+         construct_identity_gold,
+         compare={'LSA agg blocked': aggregate_construct_similarity(item_similarity_lsa_agg_blocked, gold_items,
+                                                                    variable_ids, n_similarities=2, condensed=True,
+                                                                    dtype=similarity_dtype)})
+
+if quantization is not None:
+    # Quantize the pre-trained term vectors and the item vectors, item similarities are computed on the codes.
+    term_vectors_preglove_q = QuantizedVectors(term_vectors_preglove, method=quantization)
+    item_vectors_preglove_q = QuantizedVectors(vector_average(dtm_items, term_vectors_preglove_q.decode(),
+                                                              weighting=False), method=quantization)
+    print("Quantized pre-trained GloVe with", quantization, "- term vectors:", term_vectors_preglove_q.nbytes,
+          "bytes instead of", term_vectors_preglove.values.nbytes, "- item vectors:", item_vectors_preglove_q.nbytes,
+          "bytes instead of", item_vectors_preglove.values.nbytes)
+    construct_similarity_preglove_q = construct_similarity_from_vectors(item_vectors_preglove_q,
+                                                                        gold_items['VariableId'], variable_ids,
+                                                                        n_similarities=2, clip=True,
+                                                                        block_size=similarity_block_size,
+                                                                        dtype=similarity_dtype, verbose=verbose)
+    evaluate(construct_similarity_preglove, construct_identity_gold,
+             compare={'preGloVe ' + quantization: construct_similarity_preglove_q})
 
 # Plot GloVe grid search results.
 if verbose:
@@ -1105,142 +4087,6 @@ if verbose:
     plt.savefig('GloVe_search_results.png')
     plt.show(block=False)
 
-# Compute construct similarity matrix with self-trained GloVe on item corpus.
-print("Computing construct similarity matrix with self-trained GloVe...")
-glove_aggregation = False
-vector_dict_trglove, loss_glove_items = train_vectors_glove(ttd_items, n_components=300, alpha=0.4, x_max=10.0,
-                                                            step_size=0.2, n_epochs=50, batch_size=64, workers=2,
-                                                            verbose=verbose)  # Train vectors.
-vector_dict_trglove = {dict_ix_term_items[key]: value for key, value in
-                       vector_dict_trglove.items()}  # Translate indices.
-term_vectors_trglove = term_vectors_from_dict(vector_dict_trglove, terms_items, normalize=True, verbose=verbose)
-if glove_aggregation:
-    item_similarity_trglove = aggregate_item_similarity(dtm_items, term_vectors_trglove, n_similarities=2,
-                                                        verbose=verbose)
-else:
-    item_vectors_trglove = vector_average(dtm_items, term_vectors_trglove, weighting=False)
-    # Compute item similarity. Set negative values to 0, unknown source.
-    item_similarity_trglove = pd.DataFrame(np.asarray(
-        np.asmatrix(item_vectors_trglove) * np.asmatrix(item_vectors_trglove).T).clip(min=0),
-                                           index=item_vectors_trglove.index.values,
-                                           columns=item_vectors_trglove.index.values)
-construct_similarity_trglove = aggregate_construct_similarity(item_similarity_trglove, gold_items, variable_ids,
-                                                              n_similarities=2, verbose=verbose)
-fpr_trglove, tpr_trglove, roc_auc_trglove = evaluate(construct_similarity_trglove, construct_identity_gold)
-print("ROC AUC self-trained GloVe =", roc_auc_trglove, "\n")
-
-# Compute construct similarity based on normalized author co-occurrence matrix (BOW) without creating a semantic space.
-coauthor_similarity = np.asarray(dtm_authors).dot(np.asarray(dtm_authors).T)
-coauthor_similarity = pd.DataFrame(coauthor_similarity, index=corpus_authors, columns=corpus_authors)
-construct_similarity_authors = pd.DataFrame(np.zeros([len(var_ids_authors), len(var_ids_authors)]),
-                                            index=var_ids_authors, columns=var_ids_authors)
-for i in var_ids_authors:  # Fill construct similarity matrix with coauthor group similarities.
-    for k in var_ids_authors:
-        construct_similarity_authors[k][i] = \
-            coauthor_similarity[construct_authors[gold2funk[k]]][construct_authors[gold2funk[i]]]
-fpr_auth, tpr_auth, roc_auc_auth = evaluate(construct_similarity_authors,
-                                            construct_identity_gold_authors)
-print("ROC AUC authors =", roc_auc_auth, "\n")
-
-# Compute construct similarity matrix with LSA on author corpus.
-vector_dict_lsa_authors, coauthor_doc_vectors_lsa = train_vectors_lsa(dtm_authors, n_components=100,
-                                                                      return_doc_vectors=True)
-author_vectors_lsa = term_vectors_from_dict(vector_dict_lsa_authors, terms_authors, normalize=True, verbose=verbose)
-coauthor_vectors_lsa = vector_average(dtm_authors, author_vectors_lsa, weighting=False)
-coauthor_similarity_lsa = pd.DataFrame(np.asarray(coauthor_vectors_lsa).dot(coauthor_vectors_lsa.T),
-                                       index=coauthor_vectors_lsa.index.values,
-                                       columns=coauthor_vectors_lsa.index.values)
-# coauthor_similarity_lsa = pd.DataFrame(np.asmatrix(coauthor_doc_vectors_lsa) * np.asmatrix(coauthor_doc_vectors_lsa).T,
-#                                        index=coauthor_doc_vectors_lsa.index.values,
-#                                        columns=coauthor_doc_vectors_lsa.index.values)
-construct_similarity_lsa_authors = pd.DataFrame(np.zeros([len(var_ids_authors), len(var_ids_authors)]),
-                                                index=var_ids_authors, columns=var_ids_authors)
-for i in var_ids_authors:  # Fill construct similarity matrix with coauthor group similarities.
-    for k in var_ids_authors:
-        construct_similarity_lsa_authors[k][i] = \
-            coauthor_similarity_lsa[construct_authors[gold2funk[k]]][construct_authors[gold2funk[i]]]
-fpr_lsa_auth, tpr_lsa_auth, roc_auc_lsa_auth = evaluate(construct_similarity_lsa_authors,
-                                                        construct_identity_gold_authors)
-print("ROC AUC LSA authors =", roc_auc_lsa_auth, "\n")
-
-# Perform grid search on GloVe self-trained on author corpus with vector average for speed.
-# You can train GloVe with best parameters afterwards.
-try:
-    glove_results_auth = pd.read_csv('GloVe_search_results_auth.csv', index_col=0).values.tolist()
-except FileNotFoundError:
-    glove_results_auth = []
-search_n_components_auth = [70, 100, 130]
-search_alpha_auth = [0.4, 0.5, 0.6, 0.7, 0.8]
-search_x_max_auth = [10, 40, 70, 100]
-search_step_size_auth = [0.005, 0.0075, 0.01, 0.025, 0.05, 0.15, 0.3]
-search_n_epochs_auth = [50]
-search_weighting_auth = [False, True]
-search_grid_auth = [[n_comp, alpha, x_max, step_size, n_epochs, weighting] for n_comp in search_n_components_auth
-                    for alpha in search_alpha_auth for x_max in search_x_max_auth
-                    for step_size in search_step_size_auth for n_epochs in search_n_epochs_auth
-                    for weighting in search_weighting_auth]
-search_early_stopping_auth = 0.99  # ROC AUC for early stopping of grid search.
-ctr_auth = 0
-print("Performing grid search on GloVe self-trained on author corpus...\n")
-for n_comp, alpha, x_max, step_size, n_epochs, weighting in search_grid_auth:
-    try:
-        print("n_comp=", n_comp, "alpha =", alpha, "x_max =", x_max, "step_size =", step_size,
-              "n_epochs =", n_epochs, "weighting =", weighting)
-        vector_dict_glove_authors, loss_glove_auth = train_vectors_glove(ttd_authors, n_components=n_comp, alpha=alpha,
-                                                                         x_max=x_max,
-                                                                         step_size=step_size, n_epochs=n_epochs,
-                                                                         batch_size=64,
-                                                                         workers=2, verbose=verbose)  # Train vectors.
-        # Check for nan results. If present, go to next configuration.
-        if np.sum(np.isnan(loss_glove_auth)) > 0:
-            print("Encountered nan loss with following parameters:")
-            print("n_comp=", n_comp, "alpha =", alpha, "x_max =", x_max, "step_size =", step_size,
-                  "n_epochs =", n_epochs, "weighting =", weighting, "\n")
-            continue
-        vector_dict_glove_authors = {dict_ix_term_authors[key]: value for key, value in
-                                     vector_dict_glove_authors.items()}  # Translate indices.
-        author_vectors_glove = term_vectors_from_dict(vector_dict_glove_authors, terms_authors, normalize=True,
-                                                      verbose=verbose)
-        coauthor_vectors_glove = vector_average(dtm_authors, author_vectors_glove, weighting=weighting)
-        coauthor_similarity_glove = pd.DataFrame(np.asarray(
-            np.asmatrix(coauthor_vectors_glove) * np.asmatrix(coauthor_vectors_glove).T),
-            index=coauthor_vectors_glove.index.values, columns=coauthor_vectors_glove.index.values)
-        construct_similarity_glove_authors = pd.DataFrame(np.zeros([len(var_ids_authors), len(var_ids_authors)]),
-                                                          index=var_ids_authors, columns=var_ids_authors)
-        for i in var_ids_authors:  # Fill construct similarity matrix with coauthor group similarities.
-            for k in var_ids_authors:
-                construct_similarity_glove_authors[k][i] = \
-                    coauthor_similarity_glove[construct_authors[gold2funk[k]]][construct_authors[gold2funk[i]]]
-        fpr_glove_auth, tpr_glove_auth, roc_auc_glove_auth = evaluate(construct_similarity_glove_authors,
-                                                                      construct_identity_gold)
-        ctr_auth += 1
-        print("Result for GloVe on authors with n_comp=", n_comp, "alpha =", alpha, "x_max =", x_max,
-              "step_size =", step_size, "n_epochs =", n_epochs, "weighting =", weighting)
-        print("ROC AUC =", roc_auc_glove_auth, "GloVe training loss =", loss_glove_auth[-1], "\n")
-        print("Grid search on GloVe.", ctr_auth / len(search_grid_auth) * 100, "%\n")
-        glove_results_auth.append(
-            [n_comp, alpha, x_max, step_size, n_epochs, weighting, roc_auc_glove_auth, loss_glove_auth[-1]])
-        if roc_auc_glove_auth >= search_early_stopping:
-            print("Early stopping: ROC AUC", roc_auc_glove_auth, ">=", search_early_stopping)
-            break
-    except:
-        print("Encountered some error. Continuing search with next parameter set...\n")
-        continue
-print("Grid search results:")
-glove_results_auth = pd.DataFrame(np.asarray(glove_results_auth), columns=['n_comp', 'alpha', 'x_max', 'step_size',
-                                                                           'n_epochs', 'weighting', 'roc_auc',
-                                                                           'training_loss'])
-print(glove_results_auth)
-# Print best GloVe configuration.
-glove_results_auth_best = pd.DataFrame(
-    np.asarray(glove_results_auth)[np.where(
-        np.asarray(glove_results_auth)[:, -2] == np.max(np.asarray(glove_results_auth)[:, -2]))],
-    columns=['n_comp', 'alpha', 'x_max', 'step_size', 'n_epochs', 'weighting', 'roc_auc', 'training_loss'])
-print("Best result:")
-print(glove_results_auth_best, "\n")
-# Save grid search results.
-glove_results_auth.to_csv('GloVe_search_results_auth.csv')
-
 # Plot GloVe on authors grid search results.
 if verbose:
     plt.figure(figsize=(10, 6))
@@ -1299,41 +4145,42 @@ if verbose:
     plt.savefig('GloVe_search_results_auth.png')
     plt.show(block=False)
 
-# Compute construct similarity matrix with GloVe on author corpus.
-vector_dict_glove_authors, loss_glove_authors = train_vectors_glove(ttd_authors, n_components=100, alpha=0.4,
-                                                                    x_max=70.0, step_size=0.3, n_epochs=50,
-                                                                    batch_size=64, workers=2, verbose=verbose)
-vector_dict_glove_authors = {dict_ix_term_authors[key]: value for key, value in
-                             vector_dict_glove_authors.items()}  # Translate indices.
-author_vectors_glove = term_vectors_from_dict(vector_dict_glove_authors, terms_authors, normalize=True, verbose=verbose)
-coauthor_vectors_glove = vector_average(dtm_authors, author_vectors_glove, weighting=True)
-coauthor_similarity_glove = pd.DataFrame(np.asarray(coauthor_vectors_glove).dot(coauthor_vectors_glove.T),
-                                         index=coauthor_vectors_glove.index.values,
-                                         columns=coauthor_vectors_glove.index.values)
-construct_similarity_glove_authors = pd.DataFrame(np.zeros([len(var_ids_authors), len(var_ids_authors)]),
-                                                  index=var_ids_authors, columns=var_ids_authors)
-for i in var_ids_authors:  # Fill construct similarity matrix with coauthor group similarities.
-    for k in var_ids_authors:
-        construct_similarity_glove_authors[k][i] = \
-            coauthor_similarity_glove[construct_authors[gold2funk[k]]][construct_authors[gold2funk[i]]]
-fpr_glove_auth, tpr_glove_auth, roc_auc_glove_auth = evaluate(construct_similarity_glove_authors,
-                                                              construct_identity_gold_authors)
-print("ROC AUC GloVe authors =", roc_auc_glove_auth, "\n")
-
 # Construct correlation matrix between all construct similarities and gold standard.
-all_similarities_gold = np.asarray(np.asmatrix([np.asarray(construct_similarity_lsa)[triu_indices],
-                                                np.asarray(construct_similarity_preglove)[triu_indices],
-                                                np.asarray(construct_similarity_trglove)[triu_indices],
-                                                np.asarray(construct_similarity_authors)[triu_indices],
-                                                np.asarray(construct_similarity_lsa_authors)[triu_indices],
-                                                np.asarray(construct_similarity_glove_authors)[triu_indices],
-                                                np.asarray(construct_identity_gold_authors)[triu_indices]]).T)
-all_similarities_gold = pd.DataFrame(all_similarities_gold, columns=['LSA', 'preGloVe', 'trGloVe', 'BOW authors',
-                                                                     'LSA authors', 'GloVe authors', 'gold'])
+# Item based similarities are reduced to the constructs with known authors.
+all_similarities_gold = pd.DataFrame({
+    'LSA': construct_similarity_lsa.subset(var_ids_authors).values,
+    'preGloVe': construct_similarity_preglove.subset(var_ids_authors).values,
+    'trGloVe': construct_similarity_trglove.subset(var_ids_authors).values,
+    'BOW authors': construct_similarity_authors.values,
+    'LSA authors': construct_similarity_lsa_authors.values,
+    'GloVe authors': construct_similarity_glove_authors.values,
+    'gold': CondensedSimilarity.from_square(construct_identity_gold_authors, dtype=np.int8).values})
 all_similarity_correlations = all_similarities_gold.corr()
 print("Correlations between all construct similarity measures:")
 print(all_similarity_correlations, "\n")
 
+# Export everything needed for scoring new items as memory-mappable model bundle.
+if model_bundle_dir is not None:
+    # Global term statistics and LSA components (components x terms), so that a new item can be weighted like the
+    # document-term matrix and projected to an LSA item vector: counts * idf, L2 normalized, dot components.T.
+    statistics_items = term_statistics(CountVectorizer(stop_words=None, lowercase=False, vocabulary=terms_items,
+                                                       dtype='int32').fit_transform(corpus_items))
+    term_statistics_items = pd.DataFrame(
+        {'doc_freq': statistics_items['doc_freq'], 'global_freq': statistics_items['global_freq'],
+         'idf': np.log((1 + statistics_items['n_docs']) / (1 + statistics_items['doc_freq'])) + 1},
+        index=terms_items)
+    save_model_bundle(model_bundle_dir,
+                      {'terms_items': np.asarray(terms_items), 'term_statistics_items': term_statistics_items,
+                       'lsa_components_items': pd.DataFrame(vector_dict_lsa, columns=terms_items),
+                       'term_vectors_lsa': term_vectors_lsa,
+                       'term_vectors_preglove': term_vectors_preglove, 'item_vectors_lsa': item_vectors_lsa,
+                       'item_vectors_preglove': item_vectors_preglove,
+                       'item_constructs': np.asarray(gold_items['VariableId']), 'variable_ids': variable_ids,
+                       'funk2gold': funk2gold, 'gold2funk': gold2funk},
+                      metadata={'parser_config': parser_config_items, 'dtm_processing': dtm_processing,
+                                'n_docs': statistics_items['n_docs'], 'n_similarities': 2})
+    print("Saved model bundle to", model_bundle_dir, "\n")
+
 if verbose:
     # Plot ROC curves for item and for author determination..
     # Item determination.